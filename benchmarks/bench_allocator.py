@@ -0,0 +1,89 @@
+import getopt
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from core.engine import HashKeyConflict, UrlEngine
+from core.factory import Md5Allocator, SequenceAllocator
+
+
+def _init_engine(directory, name, count):
+    # The resolution cache is disabled so every probe reaches the database
+    engine = UrlEngine(conn_string=f"sqlite:///{os.path.join(directory, name)}.db", url_cache_size=0)
+    engine.create_tables()
+    engine.create_urls([f"https://www.graysonebarb.com/{i}" for i in range(count)])
+    return engine
+
+
+def _legacy_create(engine, allocator, url_id):
+    # The original probe-then-insert scheme of `UrlFactory._create_url_hash` (as a loop, it recurses far too deep)
+    tries = 0
+    while engine.get_url(allocator.allocate(url_id, tries)):
+        tries += 1
+    engine.create_url_hash({'hash_key': allocator.allocate(url_id, tries), 'url_id': url_id, 'date_created': datetime.now()})
+    return tries + 2
+
+
+def _allocated_create(engine, allocator, url_id):
+    # The insert-and-retry scheme of `UrlFactory._create_url_hash`
+    attempt = 0
+    while True:
+        try:
+            engine.create_url_hash({'hash_key': allocator.allocate(url_id, attempt), 'url_id': url_id, 'date_created': datetime.now()})
+            return attempt + 1
+        except HashKeyConflict:
+            attempt += 1
+
+
+def _run(name, create, url_ids):
+    queries = 0
+    start = time.perf_counter()
+    for url_id in url_ids:
+        queries += create(url_id) or 0
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24}{len(url_ids):>10}{len(url_ids) / elapsed:>16.1f}{queries / len(url_ids):>16.2f}")
+
+
+def main(argv):
+    count = 2000
+    repeats = 0.2
+    try:
+        opts, args = getopt.getopt(argv, 'n:r:', ['count=', 'repeats='])
+        for opt, arg in opts:
+            if opt in ('-n', '--count'):
+                count = int(arg)
+            elif opt in ('-r', '--repeats'):
+                repeats = float(arg)
+
+    except getopt.GetoptError as e:
+        print(e)
+        sys.exit(2)
+
+    # A share of creates re-shorten an already known long_url, which is what makes the md5 scheme collide
+    random.seed(0)
+    url_ids = []
+    for i in range(count):
+        url_ids.append(random.choice(url_ids) if url_ids and random.random() < repeats else i + 1)
+
+    print(f"{'scheme':<24}{'keys':>10}{'allocations/s':>16}{'queries/key':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        engine = _init_engine(directory, 'memory', count)
+        for name, allocator in (('md5 (in memory)', Md5Allocator()), ('sequence (in memory)', SequenceAllocator(engine))):
+            _run(name, lambda url_id, allocator=allocator: allocator.allocate(url_id) and 0, url_ids)
+
+        engine = _init_engine(directory, 'legacy', count)
+        _run('md5 + probe (legacy)', lambda url_id: _legacy_create(engine, Md5Allocator(), url_id), url_ids)
+
+        engine = _init_engine(directory, 'md5', count)
+        _run('md5 + retry', lambda url_id: _allocated_create(engine, Md5Allocator(), url_id), url_ids)
+
+        engine = _init_engine(directory, 'sequence', count)
+        allocator = SequenceAllocator(engine)
+        _run('sequence', lambda url_id: _allocated_create(engine, allocator, url_id), url_ids)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
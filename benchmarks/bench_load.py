@@ -0,0 +1,250 @@
+import getopt
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import Flask
+
+from benchmarks.workload import Results, load_workload, report, save_workload, zipf_workload
+from core.engine import HashKeyConflict, HitEngine, UrlEngine, RECORDERS
+from core.factory import get_allocator
+
+
+class Links:
+    # Short URLs created during the run, so operations can reference them by creation order (`link`)
+
+    def __init__(self):
+        self.KEYS = {}
+        self.LOCK = threading.Lock()
+        self.COUNT = 0
+
+    def add(self, hash_key):
+        with self.LOCK:
+            self.KEYS[self.COUNT] = hash_key
+            self.COUNT += 1
+
+    def resolve(self, op):
+        if op.get('hash_key'):
+            return op.get('hash_key')
+        return self.KEYS.get(op.get('link'))
+
+
+class FlaskTarget:
+    # Goes through the full Flask stack (routing, factories, engines) with a test client per thread
+
+    def __init__(self, conn_string):
+        from web import app
+        self.APP = app
+        self.APP.config.update({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': conn_string})
+        self.BASE_DOMAIN = self.APP.config.get('BASE_DOMAIN')
+        self.LOCAL = threading.local()
+
+    def _client(self):
+        if not hasattr(self.LOCAL, 'client'):
+            self.LOCAL.client = self.APP.test_client()
+        return self.LOCAL.client
+
+    def create(self, dest_url, src_url=None):
+        response = self._client().post('/url/create', json={'dest_url': dest_url, 'src_url': src_url})
+        if response.status_code != 200:
+            return None, response.status_code >= 500
+        return response.get_json().get('url').replace(self.BASE_DOMAIN, '').strip('/'), False
+
+    def redirect(self, hash_key):
+        return self._client().get(f"/{hash_key}").status_code >= 500
+
+    def get(self, hash_key):
+        return self._client().get(f"/url/{hash_key}").status_code >= 500
+
+    def stats(self, hash_key):
+        return self._client().get(f"/stats/{hash_key}").status_code >= 500
+
+    def delete(self, hash_key):
+        return self._client().delete(f"/url/{hash_key}").status_code >= 500
+
+
+class EngineTarget:
+    # Calls `UrlEngine`/`HitEngine` directly, doing what the factories do without Flask's overhead
+
+    def __init__(self, conn_string):
+        self.APP = _config_app(conn_string)
+        self.URL_ENGINE = UrlEngine(app=self.APP)
+        self.HIT_ENGINE = HitEngine(app=self.APP)
+        self.ALLOCATOR = get_allocator(
+            self.URL_ENGINE,
+            self.APP.config.get('KEY_ALLOCATOR', 'sequence'),
+            block_size=self.APP.config.get('KEY_BLOCK_SIZE'),
+            length=self.APP.config.get('KEY_LENGTH')
+        )
+
+    def create(self, dest_url, src_url=None):
+        url_id = self.URL_ENGINE.create_url(dest_url)
+        for attempt in range(100):
+            hash_key = src_url or self.ALLOCATOR.allocate(url_id, attempt)
+            try:
+                self.URL_ENGINE.create_url_hash({'hash_key': hash_key, 'url_id': url_id, 'date_created': datetime.now()})
+                return hash_key, False
+            except HashKeyConflict:
+                if src_url:
+                    return None, False
+        return None, True
+
+    def redirect(self, hash_key):
+        url = self.URL_ENGINE.get_url(hash_key)
+        if url:
+            self.HIT_ENGINE.record_hit({
+                'url_hash_id': url.get('id'),
+                'ip_address': '127.0.0.1',
+                'user_agent': 'bench_load',
+                'date_created': datetime.now()
+            })
+        return False
+
+    def get(self, hash_key):
+        self.URL_ENGINE.get_url(hash_key)
+        return False
+
+    def stats(self, hash_key):
+        self.HIT_ENGINE.get_statistics(hash_key)
+        return False
+
+    def delete(self, hash_key):
+        self.URL_ENGINE.delete_url(hash_key)
+        return False
+
+
+TARGETS = {'flask': FlaskTarget, 'engine': EngineTarget}
+
+
+def _config_app(conn_string):
+    # The configuration of `web/config.json`, pointed at the benchmark database
+    app = Flask(__name__)
+    app.config.from_file(os.path.join(os.path.dirname(__file__), '..', 'web', 'config.json'), load=json.load)
+    app.config.update({'SQLALCHEMY_DATABASE_URI': conn_string})
+    return app
+
+
+def init_db(conn_string):
+    app = _config_app(conn_string)
+    url_engine = UrlEngine(app=app)
+    hit_engine = HitEngine(app=app)
+    url_engine.create_tables()
+    hit_engine.create_table()
+    url_engine.migrate_tables()
+    hit_engine.migrate_table()
+
+
+def run(target, ops, concurrency=1):
+    results = Results()
+    links = Links()
+
+    def execute(op):
+        name = op.get('op')
+        start = time.perf_counter()
+        try:
+            if name == 'create':
+                hash_key, error = target.create(op.get('dest_url'), op.get('src_url'))
+                if hash_key:
+                    links.add(hash_key)
+            else:
+                hash_key = links.resolve(op)
+                if hash_key is None:
+                    # Refers to a link that hasn't been created (yet, with concurrent workers)
+                    results.skip()
+                    return
+                start = time.perf_counter()
+                error = getattr(target, name)(hash_key)
+        except Exception:
+            error = True
+        results.add(name, time.perf_counter() - start, error)
+
+    results.start()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(execute, ops, chunksize=64))
+    else:
+        for op in ops:
+            execute(op)
+    results.stop()
+
+    return results
+
+
+def main(argv):
+    target_name = 'engine'
+    workload = None
+    links = 1000
+    clicks = 20000
+    s = 1.1
+    concurrency = 1
+    database = None
+    output = None
+    baseline = None
+    save = None
+    try:
+        opts, args = getopt.getopt(argv, 't:w:l:n:s:c:d:o:b:', [
+            'target=', 'workload=', 'links=', 'clicks=', 'zipf=', 'concurrency=', 'database=', 'output=',
+            'baseline=', 'save-workload='])
+        for opt, arg in opts:
+            if opt in ('-t', '--target'):
+                target_name = arg
+            elif opt in ('-w', '--workload'):
+                workload = arg
+            elif opt in ('-l', '--links'):
+                links = int(arg)
+            elif opt in ('-n', '--clicks'):
+                clicks = int(arg)
+            elif opt in ('-s', '--zipf'):
+                s = float(arg)
+            elif opt in ('-c', '--concurrency'):
+                concurrency = int(arg)
+            elif opt in ('-d', '--database'):
+                database = arg
+            elif opt in ('-o', '--output'):
+                output = arg
+            elif opt in ('-b', '--baseline'):
+                baseline = arg
+            elif opt == '--save-workload':
+                save = arg
+
+        if target_name not in TARGETS:
+            raise getopt.GetoptError(f"Unknown target '{target_name}', expected one of {', '.join(TARGETS)}.")
+
+    except getopt.GetoptError as e:
+        print(e)
+        sys.exit(2)
+
+    ops = load_workload(workload) if workload else zipf_workload(links, clicks, s)
+    if save:
+        save_workload(ops, save)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # A scratch database unless one is given, so runs always start from the same state
+        conn_string = f"sqlite:///{database or os.path.join(directory, 'bench.db')}"
+        init_db(conn_string)
+
+        target = TARGETS.get(target_name)(conn_string)
+        results = run(target, ops, concurrency)
+        # Buffered hits belong to this run
+        RECORDERS.close()
+
+    results = results.as_dict(
+        target=target_name, workload=workload or f"zipf(links={links}, clicks={clicks}, s={s})",
+        concurrency=concurrency, operations=len(ops))
+
+    if baseline:
+        with open(baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
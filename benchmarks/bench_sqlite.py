@@ -0,0 +1,116 @@
+import getopt
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.bench_load import _config_app
+from benchmarks.workload import percentile
+from core.db import REGISTRY
+from core.db.registry import SQLITE_PRAGMAS
+from core.engine import HitEngine, UrlEngine
+
+
+# Connection profiles compared, `default` being SQLite's own (rollback journal, `synchronous=FULL`)
+PROFILES = {'default': {}, 'tuned': SQLITE_PRAGMAS}
+
+
+def _init_engines(path, pragmas, links):
+    app = _config_app(f"sqlite:///{path}")
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS'), sqlite_pragmas=pragmas)
+    # Every redirect reaches the database and every hit is written synchronously
+    app.config.update({'SQLALCHEMY_ENGINE_OPTIONS': options, 'URL_CACHE_SIZE': 0, 'HIT_BUFFER_ENABLED': False})
+
+    url_engine = UrlEngine(app=app)
+    hit_engine = HitEngine(app=app)
+    url_engine.create_tables()
+    hit_engine.create_table()
+
+    url_id = url_engine.create_url('https://www.graysonebarb.com')
+    url_hashes = [{'hash_key': f"bench{i}", 'url_id': url_id, 'date_created': datetime.now()} for i in range(links)]
+    url_engine.create_url_hashes(url_hashes)
+
+    return url_engine, hit_engine
+
+
+def _run(url_engine, hit_engine, readers, writers, duration, links):
+    stop = threading.Event()
+    latencies = []
+    writes = []
+    errors = []
+
+    def read(n):
+        # The lookup half of a redirect, the hits themselves come from the writers
+        i = n
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                url_engine.get_url(f"bench{i % links}")
+            except Exception:
+                errors.append(1)
+            latencies.append(time.perf_counter() - start)
+            i += readers
+
+    def write(n):
+        while not stop.is_set():
+            try:
+                hit_engine.create_hit({'url_hash_id': n % links + 1, 'ip_address': '127.0.0.1', 'date_created': datetime.now()})
+                writes.append(1)
+            except Exception:
+                errors.append(1)
+
+    threads = [threading.Thread(target=read, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=write, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'redirects/s': len(latencies) / duration,
+        'p50 ms': percentile(latencies, 50) * 1000,
+        'p99 ms': percentile(latencies, 99) * 1000,
+        'writes/s': len(writes) / duration,
+        'errors': len(errors)
+    }
+
+
+def main(argv):
+    readers = 4
+    writers = 2
+    duration = 5.0
+    links = 1000
+    try:
+        opts, args = getopt.getopt(argv, 'r:w:d:l:', ['readers=', 'writers=', 'duration=', 'links='])
+        for opt, arg in opts:
+            if opt in ('-r', '--readers'):
+                readers = int(arg)
+            elif opt in ('-w', '--writers'):
+                writers = int(arg)
+            elif opt in ('-d', '--duration'):
+                duration = float(arg)
+            elif opt in ('-l', '--links'):
+                links = int(arg)
+
+    except getopt.GetoptError as e:
+        print(e)
+        sys.exit(2)
+
+    print(f"{readers} redirect threads, {writers} hit writer threads, {duration:.0f}s per profile")
+    print(f"{'profile':<10}{'redirects/s':>14}{'p50 ms':>10}{'p99 ms':>10}{'writes/s':>12}{'errors':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, pragmas in PROFILES.items():
+            engines = _init_engines(os.path.join(directory, f"{name}.db"), pragmas, links)
+            r = _run(*engines, readers, writers, duration, links)
+            print(f"{name:<10}{r.get('redirects/s'):>14.1f}{r.get('p50 ms'):>10.2f}{r.get('p99 ms'):>10.2f}"
+                  f"{r.get('writes/s'):>12.1f}{r.get('errors'):>8}")
+        REGISTRY.dispose()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
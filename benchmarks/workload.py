@@ -0,0 +1,167 @@
+import bisect
+import json
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+
+# Endpoints reported on, in the order they are printed
+OPERATIONS = ('create', 'redirect', 'get', 'stats', 'delete')
+
+# Default share of each operation after the links have been created
+MIX = {'redirect': 0.90, 'get': 0.04, 'stats': 0.04, 'delete': 0.02}
+
+# Recorded access log paths and the operation each one maps to
+ROUTES = [
+    ('POST', re.compile(r'^/url(/create)?/?$'), 'create'),
+    ('GET', re.compile(r'^/url/(?P<hash_key>[^/]+)/?$'), 'get'),
+    ('DELETE', re.compile(r'^/url/(?P<hash_key>[^/]+)/?$'), 'delete'),
+    ('GET', re.compile(r'^/stats/(?P<hash_key>[^/]+)/?$'), 'stats'),
+    ('GET', re.compile(r'^/(?P<hash_key>[^/]+)/?$'), 'redirect')
+]
+
+
+def zipf_workload(links=1000, clicks=20000, s=1.1, mix=None, seed=0):
+    # Creates `links` Short URLs, then clicks on them with Zipf distributed popularity (a few links get most
+    # traffic). Operations reference links by creation order (`link`), so the workload can be saved and replayed.
+    rng = random.Random(seed)
+    mix = mix or MIX
+
+    ops = [{'op': 'create', 'dest_url': f"https://www.graysonebarb.com/{i}"} for i in range(links)]
+
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, links + 1):
+        total += 1.0 / rank ** s
+        cum_weights.append(total)
+
+    # Randomly assigning ranks to links keeps the popular links from all being the oldest ones
+    order = list(range(links))
+    rng.shuffle(order)
+
+    names = list(mix.keys())
+    weights = list(mix.values())
+    for _ in range(clicks):
+        rank = bisect.bisect_left(cum_weights, rng.random() * total)
+        ops.append({'op': rng.choices(names, weights)[0], 'link': order[min(rank, links - 1)]})
+
+    return ops
+
+
+def load_workload(path):
+    # JSONL of either operations (`{"op": "redirect", "hash_key": ...}` or `{"op": ..., "link": 3}`)
+    # or recorded requests (`{"method": "GET", "path": "/abc", "json": {...}}`)
+    ops = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            op = record if record.get('op') else _from_request(record)
+            if op:
+                ops.append(op)
+    return ops
+
+
+def save_workload(ops, path):
+    with open(path, 'w') as f:
+        for op in ops:
+            f.write(json.dumps(op) + '\n')
+
+
+def _from_request(record):
+    method = (record.get('method') or 'GET').upper()
+    path = (record.get('path') or '/').split('?')[0]
+    for route_method, route, name in ROUTES:
+        match = route.match(path)
+        if match and route_method == method:
+            op = {'op': name}
+            op.update(match.groupdict())
+            op.update({k: v for k, v in (record.get('json') or record.get('form') or {}).items()
+                       if k in ('dest_url', 'src_url')})
+            return op
+    return None
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of already sorted values
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Results:
+
+    def __init__(self):
+        self.LATENCIES = {op: [] for op in OPERATIONS}
+        self.ERRORS = {op: 0 for op in OPERATIONS}
+        self.SKIPPED = 0
+        self.LOCK = threading.Lock()
+        self.START = None
+        self.ELAPSED = 0.0
+
+    def start(self):
+        self.START = time.perf_counter()
+
+    def stop(self):
+        self.ELAPSED = time.perf_counter() - self.START
+
+    def add(self, op, seconds, error=False):
+        with self.LOCK:
+            self.LATENCIES[op].append(seconds)
+            if error:
+                self.ERRORS[op] += 1
+
+    def skip(self):
+        with self.LOCK:
+            self.SKIPPED += 1
+
+    def as_dict(self, **meta):
+        endpoints = {}
+        for op in OPERATIONS:
+            latencies = sorted(self.LATENCIES.get(op))
+            if not latencies:
+                continue
+            endpoints[op] = {
+                'count': len(latencies),
+                'errors': self.ERRORS.get(op),
+                'throughput': len(latencies) / self.ELAPSED if self.ELAPSED else 0.0,
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': latencies[-1] * 1000
+            }
+
+        total = sum(e.get('count') for e in endpoints.values())
+        return {
+            'meta': dict(meta, date_created=datetime.now().isoformat(timespec='seconds')),
+            'elapsed': self.ELAPSED,
+            'throughput': total / self.ELAPSED if self.ELAPSED else 0.0,
+            'skipped': self.SKIPPED,
+            'endpoints': endpoints
+        }
+
+
+def report(results, baseline=None):
+    # Prints the results, with the change against a saved baseline (in %) when one is given
+    print(f"{'endpoint':<10}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for op, e in results.get('endpoints').items():
+        print(f"{op:<10}{e.get('count'):>8}{e.get('errors'):>8}{e.get('throughput'):>10.1f}"
+              f"{e.get('p50_ms'):>10.2f}{e.get('p95_ms'):>10.2f}{e.get('p99_ms'):>10.2f}{e.get('max_ms'):>10.2f}")
+
+        b = (baseline or {}).get('endpoints', {}).get(op)
+        if b:
+            deltas = [_delta(e, b, k) for k in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+            print(f"{'  vs base':<26}" + ''.join(f"{d:>10}" for d in deltas))
+
+    print(f"{results.get('throughput'):.1f} ops/s over {results.get('elapsed'):.2f}s, {results.get('skipped')} skipped")
+
+
+def _delta(current, baseline, key):
+    if not baseline.get(key):
+        return '-'
+    return f"{(current.get(key) - baseline.get(key)) / baseline.get(key) * 100:+.1f}%"
@@ -0,0 +1,2 @@
+from .bloom import BloomFilter, FilterRegistry, KeyFilter, FILTERS
+from .resolution import CacheRegistry, ResolutionCache, CACHES
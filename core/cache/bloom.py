@@ -0,0 +1,249 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+# Persisted filters start with this header, followed by the JSON metadata (ie: watermarks) and the bit array
+HEADER = struct.Struct('<8sQIQI')
+MAGIC = b'TURLBF01'
+
+
+class BloomFilter:
+    # Set membership with no false negatives, answering "definitely not present" or "probably present" with a
+    # false positive rate of about `error_rate` while it holds at most `capacity` keys
+
+    def __init__(self, capacity=1000000, error_rate=0.01, num_bits=None, num_hashes=None, bits=None, count=0):
+        self.CAPACITY = max(int(capacity), 1)
+        self.ERROR_RATE = error_rate
+        self.NUM_BITS = num_bits or max(int(-self.CAPACITY * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.NUM_HASHES = num_hashes or max(round(self.NUM_BITS / self.CAPACITY * math.log(2)), 1)
+        self.BITS = bits if bits is not None else bytearray((self.NUM_BITS + 7) // 8)
+        self.COUNT = count
+
+    def _positions(self, key):
+        # Double hashing, every position is derived from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.NUM_BITS for i in range(self.NUM_HASHES)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.BITS[p >> 3] |= 1 << (p & 7)
+        self.COUNT += 1
+
+    def __contains__(self, key):
+        return all(self.BITS[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    @property
+    def size(self):
+        return len(self.BITS)
+
+    def estimated_error_rate(self):
+        # The false positive rate expected for the number of keys added so far
+        return (1 - math.exp(-self.NUM_HASHES * self.COUNT / self.NUM_BITS)) ** self.NUM_HASHES
+
+    def save(self, path, meta=None):
+        # Written next to the destination and renamed over it, so readers never map a partial file
+        meta = json.dumps(meta or {}).encode('utf-8')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.NUM_BITS, self.NUM_HASHES, self.COUNT, len(meta)))
+            f.write(meta)
+            f.write(self.BITS)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        # Maps a saved filter copy-on-write, so pages are only read in (and shared with other processes through
+        # the page cache) as they are probed, and later additions stay private to this process. Returns
+        # (None, None) when there is no usable file.
+        if not os.path.exists(path):
+            return None, None
+
+        with open(path, 'rb') as f:
+            try:
+                magic, num_bits, num_hashes, count, meta_size = HEADER.unpack(f.read(HEADER.size))
+                meta = json.loads(f.read(meta_size).decode('utf-8'))
+            except (struct.error, ValueError):
+                return None, None
+
+            offset = HEADER.size + meta_size
+            if magic != MAGIC or os.fstat(f.fileno()).st_size != offset + (num_bits + 7) // 8:
+                return None, None
+            bits = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))[offset:]
+
+        return cls(meta.get('capacity', 1), meta.get('error_rate', 0.01), num_bits, num_hashes, bits, count), meta
+
+
+class KeyFilter:
+    # The hash keys of one database (and its shards) in a `BloomFilter`, so lookups of keys that were never
+    # created can be answered without a query. Until it has been built every key is reported as possibly present.
+    # Keys created by other processes are picked up every `sync_interval` seconds from each database's `url_hash`
+    # ids above a watermark. Ids can commit out of order (ie: shard ids are reserved before their insert), so every
+    # sync re-reads the last `sync_overlap` ids as well.
+
+    def __init__(self, capacity=1000000, error_rate=0.01, path=None, sync_interval=1.0, sync_overlap=1000):
+        self.CAPACITY = capacity
+        self.ERROR_RATE = error_rate
+        self.PATH = path
+        self.SYNC_INTERVAL = sync_interval
+        self.SYNC_OVERLAP = sync_overlap
+
+        self.FILTER = None
+        self.WATERMARKS = {}
+        self.LOCK = threading.Lock()
+        self.BUILD_LOCK = threading.Lock()
+        self.SYNC_AT = 0.0
+
+        self.CHECKS = 0
+        self.NEGATIVES = 0
+        self.FALSE_POSITIVES = 0
+        self.SYNCS = 0
+        self.BUILD_SECONDS = None
+        self.LOADED = False
+
+    @property
+    def ready(self):
+        return self.FILTER is not None
+
+    def build(self, rows_by_database, capacity=None):
+        # `rows_by_database` yields (database, rows) pairs, every row having an `id` and a `hash_key`. The filter is
+        # sized for at least `capacity` keys (ie: the number of rows), so it holds its error rate as it fills.
+        start = time.perf_counter()
+        bloom = BloomFilter(max(capacity or 0, self.CAPACITY), self.ERROR_RATE)
+        watermarks = {}
+        for database, rows in rows_by_database:
+            for row in rows:
+                bloom.add(row.get('hash_key'))
+                watermarks[database] = max(watermarks.get(database, 0), row.get('id'))
+
+        with self.LOCK:
+            self.FILTER = bloom
+            self.WATERMARKS = watermarks
+            self.SYNC_AT = time.monotonic() + self.SYNC_INTERVAL
+        self.BUILD_SECONDS = time.perf_counter() - start
+
+    def load(self):
+        # A persisted filter, which still has to be synced with the keys created since it was saved. A filter saved
+        # with another error rate, a smaller capacity or that is already full is ignored (and rebuilt).
+        if not self.PATH:
+            return False
+        bloom, meta = BloomFilter.load(self.PATH)
+        if bloom is None or bloom.ERROR_RATE != self.ERROR_RATE or bloom.CAPACITY < self.CAPACITY \
+                or bloom.COUNT >= bloom.CAPACITY:
+            return False
+        with self.LOCK:
+            self.FILTER = bloom
+            self.WATERMARKS = meta.get('watermarks', {})
+            self.LOADED = True
+        return True
+
+    def save(self):
+        if self.PATH and self.FILTER is not None:
+            with self.LOCK:
+                self.FILTER.save(self.PATH, {
+                    'capacity': self.FILTER.CAPACITY,
+                    'error_rate': self.FILTER.ERROR_RATE,
+                    'watermarks': self.WATERMARKS
+                })
+
+    def add(self, hash_keys):
+        if self.FILTER is None:
+            return
+        with self.LOCK:
+            for hash_key in hash_keys:
+                if hash_key not in self.FILTER:
+                    self.FILTER.add(hash_key)
+
+    def might_contain(self, hash_key):
+        if self.FILTER is None:
+            return True
+        self.CHECKS += 1
+        if hash_key in self.FILTER:
+            return True
+        self.NEGATIVES += 1
+        return False
+
+    def false_positive(self):
+        # The filter said maybe, the database said no
+        self.FALSE_POSITIVES += 1
+
+    def needs_sync(self):
+        # Claims the next sync, so only one caller per interval queries for new keys
+        if self.FILTER is None:
+            return False
+
+        now = time.monotonic()
+        with self.LOCK:
+            if now < self.SYNC_AT:
+                return False
+            self.SYNC_AT = now + self.SYNC_INTERVAL
+            return True
+
+    def since(self, database, slots=1):
+        # The id to sync `database` from, `slots` being how far apart its consecutive ids are
+        return max(self.WATERMARKS.get(database, 0) - self.SYNC_OVERLAP * slots, 0)
+
+    def sync(self, database, rows):
+        with self.LOCK:
+            self.SYNCS += 1
+            for row in rows:
+                if row.get('hash_key') not in self.FILTER:
+                    self.FILTER.add(row.get('hash_key'))
+                self.WATERMARKS[database] = max(self.WATERMARKS.get(database, 0), row.get('id'))
+
+    def stats(self):
+        if self.FILTER is None:
+            return {'ready': False}
+        with self.LOCK:
+            return {
+                'ready': True,
+                'loaded': self.LOADED,
+                'keys': self.FILTER.COUNT,
+                'capacity': self.FILTER.CAPACITY,
+                'bytes': self.FILTER.size,
+                'num_hashes': self.FILTER.NUM_HASHES,
+                'error_rate': self.FILTER.ERROR_RATE,
+                'estimated_error_rate': self.FILTER.estimated_error_rate(),
+                'checks': self.CHECKS,
+                'negatives': self.NEGATIVES,
+                'false_positives': self.FALSE_POSITIVES,
+                'observed_error_rate': self.FALSE_POSITIVES / max(self.CHECKS - self.NEGATIVES, 1),
+                'syncs': self.SYNCS,
+                'build_seconds': self.BUILD_SECONDS
+            }
+
+
+class FilterRegistry:
+
+    def __init__(self):
+        self.FILTERS = {}
+        self.LOCK = threading.Lock()
+
+    def get(self, name, **options):
+        # Filters are shared process-wide (one per database), the options only apply on creation
+        key_filter = self.FILTERS.get(name)
+        if key_filter is None:
+            with self.LOCK:
+                key_filter = self.FILTERS.get(name)
+                if key_filter is None:
+                    options = {k: v for k, v in options.items() if v is not None}
+                    key_filter = KeyFilter(**options)
+                    self.FILTERS[name] = key_filter
+        return key_filter
+
+    def stats(self):
+        return {name: key_filter.stats() for name, key_filter in list(self.FILTERS.items())}
+
+    def clear(self):
+        with self.LOCK:
+            self.FILTERS.clear()
+
+
+FILTERS = FilterRegistry()
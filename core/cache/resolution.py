@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Stored in place of a row so that unknown hash keys are cached as well
+MISSING = object()
+
+
+class ResolutionCache:
+
+    def __init__(self, max_size=10000, ttl=300, negative_ttl=30, sync_interval=1.0):
+        self.MAX_SIZE = max_size
+        self.TTL = ttl
+        self.NEGATIVE_TTL = negative_ttl
+        # How often the generation shared by every process is checked for changes made elsewhere
+        self.SYNC_INTERVAL = sync_interval
+
+        self.ENTRIES = OrderedDict()
+        self.LOCK = threading.Lock()
+        self.EPOCH = 0
+        self.GENERATION = None
+        self.SYNC_AT = 0.0
+        # The latest change seen by `sync_changes`, and the keys it already dropped that are looked up again
+        self.CHANGES_SEEN = None
+        self.CHANGED = set()
+
+        self.HITS = 0
+        self.MISSES = 0
+        self.EVICTIONS = 0
+        self.EXPIRATIONS = 0
+        self.INVALIDATIONS = 0
+        self.SYNCS = 0
+        self.SYNC_CLEARS = 0
+
+    @property
+    def enabled(self):
+        return self.MAX_SIZE > 0
+
+    def get(self, key):
+        # Returns a (found, value) pair, where a found value of None is a cached miss
+        if not self.enabled:
+            return False, None
+
+        with self.LOCK:
+            entry = self.ENTRIES.get(key)
+            if entry is None:
+                self.MISSES += 1
+                return False, None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.ENTRIES[key]
+                self.EXPIRATIONS += 1
+                self.MISSES += 1
+                return False, None
+
+            self.ENTRIES.move_to_end(key)
+            self.HITS += 1
+
+        if value is MISSING:
+            return True, None
+        return True, dict(value)
+
+    def token(self):
+        # Taken before a lookup so that a result read before an invalidation is never stored
+        return self.EPOCH
+
+    def set(self, key, value, token=None):
+        if not self.enabled:
+            return
+
+        ttl = self.TTL if value else self.NEGATIVE_TTL
+        if ttl <= 0:
+            return
+
+        with self.LOCK:
+            if token is not None and token != self.EPOCH:
+                return
+
+            self.ENTRIES[key] = (dict(value) if value else MISSING, time.monotonic() + ttl)
+            self.ENTRIES.move_to_end(key)
+            while len(self.ENTRIES) > self.MAX_SIZE:
+                self.ENTRIES.popitem(last=False)
+                self.EVICTIONS += 1
+
+    def invalidate(self, key):
+        with self.LOCK:
+            self.EPOCH += 1
+            if self.ENTRIES.pop(key, None) is not None:
+                self.INVALIDATIONS += 1
+
+    def clear(self):
+        with self.LOCK:
+            self.EPOCH += 1
+            self.ENTRIES.clear()
+
+    def needs_sync(self):
+        # Claims the next check of the shared generation, so only one caller per interval queries it
+        if not self.enabled:
+            return False
+
+        now = time.monotonic()
+        with self.LOCK:
+            if now < self.SYNC_AT:
+                return False
+            self.SYNC_AT = now + self.SYNC_INTERVAL
+            return True
+
+    def sync(self, generation):
+        # Another process changed a cached row (ie: deleted it) since the last check, so nothing cached is trusted
+        with self.LOCK:
+            self.SYNCS += 1
+            changed = self.GENERATION is not None and generation != self.GENERATION
+            self.GENERATION = generation
+            if changed:
+                self.SYNC_CLEARS += 1
+                self.EPOCH += 1
+                self.ENTRIES.clear()
+
+    def changes_since(self, overlap):
+        # Where the next `sync_changes` looks from, None until the first one
+        with self.LOCK:
+            return self.CHANGES_SEEN - overlap if self.CHANGES_SEEN else None
+
+    def sync_changes(self, changes, now):
+        # Drops the rows another process changed (ie: deleted), `changes` being their (key, date) since
+        # `changes_since`. Those found again within the overlap are only dropped once. Returns the keys dropped.
+        with self.LOCK:
+            dropped = [key for key, _ in changes if key not in self.CHANGED]
+            for key in dropped:
+                if self.ENTRIES.pop(key, None) is not None:
+                    self.INVALIDATIONS += 1
+            if dropped:
+                self.EPOCH += 1
+            self.CHANGED = {key for key, _ in changes}
+            self.CHANGES_SEEN = max([date for _, date in changes] + [self.CHANGES_SEEN or now])
+        return dropped
+
+    def advance(self, generation):
+        # This process moved the shared generation on, which only needs a `clear` if someone else did as well
+        with self.LOCK:
+            if self.GENERATION is not None and generation == self.GENERATION + 1:
+                self.GENERATION = generation
+
+    def stats(self):
+        with self.LOCK:
+            return {
+                'size': len(self.ENTRIES),
+                'max_size': self.MAX_SIZE,
+                'hits': self.HITS,
+                'misses': self.MISSES,
+                'evictions': self.EVICTIONS,
+                'expirations': self.EXPIRATIONS,
+                'invalidations': self.INVALIDATIONS,
+                'syncs': self.SYNCS,
+                'sync_clears': self.SYNC_CLEARS
+            }
+
+
+class CacheRegistry:
+
+    def __init__(self):
+        self.CACHES = {}
+        self.LOCK = threading.Lock()
+
+    def get(self, name, **options):
+        # Caches are shared process-wide (one per database), the options only apply on creation
+        cache = self.CACHES.get(name)
+        if cache is None:
+            with self.LOCK:
+                cache = self.CACHES.get(name)
+                if cache is None:
+                    options = {k: v for k, v in options.items() if v is not None}
+                    cache = ResolutionCache(**options)
+                    self.CACHES[name] = cache
+        return cache
+
+    def stats(self):
+        return {name: cache.stats() for name, cache in list(self.CACHES.items())}
+
+    def clear(self):
+        with self.LOCK:
+            self.CACHES.clear()
+
+
+CACHES = CacheRegistry()
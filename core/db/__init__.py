@@ -1,2 +1,7 @@
+from .aio import AsyncDatabase, AsyncEngineRegistry, ASYNC_REGISTRY
 from .database import Database
-from .schema import Schema
\ No newline at end of file
+from .registry import EngineRegistry, REGISTRY
+from .routing import RecentWrites, RECENT_WRITES, is_pinned, pin, unpin
+from .schema import Schema
+from .sharding import ShardRing, SHARD_SLOTS
+from .slow_query import SlowQueryLog, SLOW_QUERIES
@@ -0,0 +1,202 @@
+import time
+import aiosqlite
+from sqlalchemy import CursorResult
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from core.db.database import Database
+from core.db.registry import EngineRegistry, QUEUE_POOL_OPTIONS, SQLITE_PRAGMAS
+from core.db.registry import listen_query_metrics, listen_sqlite_pragmas
+from core.db.slow_query import SLOW_QUERIES, listen_query_parameters, query_parameters
+from core.timing import timed
+
+
+# Synchronous drivers and their asyncio equivalents
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite'
+}
+
+
+def async_conn_string(conn_string):
+    url = make_url(conn_string)
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    if driver is None:
+        return conn_string
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def _aiosqlite_creator(url):
+    # Opens connections like the dialect would, on a daemon thread: aiosqlite no longer subclasses `Thread` so the
+    # dialect's `daemon = True` misses it, and pooled connections would hold the interpreter open at exit
+    args, kwargs = url.get_dialect()().create_connect_args(url)
+
+    async def _connect():
+        connection = aiosqlite.connect(*args, **kwargs)
+        connection._thread.daemon = True
+        return await connection
+
+    return _connect
+
+
+class AsyncEngineRegistry(EngineRegistry):
+
+    async def connect(self, conn_string, isolation_level=None, **options):
+        engine = self.get(conn_string, isolation_level, **options)
+        stats = self.STATS[(conn_string, isolation_level)]
+
+        start = time.perf_counter()
+        try:
+            connection = await engine.connect()
+        except Exception:
+            stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        stats.record_wait(time.perf_counter() - start)
+
+        return engine, connection
+
+    async def dispose(self):
+        with self.LOCK:
+            engines = list(self.ENGINES.values())
+            self.ENGINES.clear()
+            self.STATS.clear()
+        for engine in engines:
+            await engine.dispose()
+
+    @staticmethod
+    def _create(conn_string, isolation_level, options):
+        options = {k: v for k, v in options.items() if v is not None}
+        if isolation_level:
+            options['isolation_level'] = isolation_level
+        pragmas = options.pop('sqlite_pragmas', SQLITE_PRAGMAS)
+
+        # File databases get a bounded pool rather than the dialect's default `NullPool`, which opened a connection
+        # (and an aiosqlite thread) and re-applied the PRAGMAs for every query. In-memory ones keep theirs.
+        url = make_url(conn_string)
+        pool_class = options.get('poolclass') or url.get_dialect().get_pool_class(url)
+        if issubclass(pool_class, NullPool) and url.get_backend_name() == 'sqlite':
+            pool_class = options['poolclass'] = AsyncAdaptedQueuePool
+            options.setdefault('async_creator', _aiosqlite_creator(url))
+        if not issubclass(pool_class, QueuePool):
+            for option in QUEUE_POOL_OPTIONS:
+                options.pop(option, None)
+
+        engine = create_async_engine(conn_string, **options)
+        if url.get_backend_name() == 'sqlite':
+            listen_sqlite_pragmas(engine, pragmas)
+        listen_query_metrics(engine)
+        listen_query_parameters(engine)
+        return engine
+
+
+ASYNC_REGISTRY = AsyncEngineRegistry()
+
+
+class AsyncDatabase(Database):
+    # `async with AsyncDatabase(...) as db` counterpart of `Database`, every query method is awaitable
+
+    def __init__(self, app=None, conn_string=None, isolation_level=None, is_transaction=False, engine_options=None,
+                 read_only=False, shard=None):
+        super(AsyncDatabase, self).__init__(
+            app=app, conn_string=conn_string, isolation_level=isolation_level,
+            is_transaction=is_transaction, engine_options=engine_options, read_only=read_only, shard=shard)
+
+        # The async override only applies to the primary, read databases and shards are derived from their own URI
+        if self.APP and not shard and not (read_only and self.APP.config.get('SQLALCHEMY_READ_DATABASE_URI')):
+            self.CONNECTION_STRING = self.APP.config.get('SQLALCHEMY_ASYNC_DATABASE_URI') or self.CONNECTION_STRING
+        self.CONNECTION_STRING = async_conn_string(self.CONNECTION_STRING)
+
+    @timed('pool')
+    async def __aenter__(self):
+        self.CONNECTION, self.CURSOR = await ASYNC_REGISTRY.connect(
+            self.CONNECTION_STRING, self.ISOLATION_LEVEL, **self.ENGINE_OPTIONS)
+
+        if self.IS_TRANSACTION:
+            self.TRANSACTION = await self.CURSOR.begin()
+
+        self.ALIVE = True
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._terminate(exc_type is not None)
+
+    def __enter__(self):
+        raise Exception('AsyncDatabase must be used with `async with`.')
+
+    def __del__(self):
+        # Connections can't be awaited from a finalizer, they are returned by `__aexit__`
+        pass
+
+    @timed('db')
+    async def _execute(self, query, action, params=None):
+        if self.SLOW_QUERY_THRESHOLD is None:
+            return await self._run(query, action, params)
+
+        start = time.perf_counter()
+        results = await self._run(query, action, params)
+        duration = time.perf_counter() - start
+        if duration >= self.SLOW_QUERY_THRESHOLD:
+            SLOW_QUERIES.record(
+                query, query_parameters(self.CURSOR, params), duration, self.CONNECTION_STRING, self.CURSOR.dialect)
+
+        return results
+
+    async def _run(self, query, action, params=None):
+        match action:
+            case self.ALL:
+                results = (await self.CURSOR.execute(query, params)).fetchall()
+            case self.ONE:
+                results = (await self.CURSOR.execute(query, params)).first()
+            case self.SCALAR:
+                results = (await self.CURSOR.execute(query, params)).scalar()
+            case self.EXECUTE:
+                results = await self.CURSOR.execute(query, params)
+            case _:
+                results = None
+
+        if not self.IS_TRANSACTION:
+            await self.CURSOR.commit()
+        if results and isinstance(results, CursorResult):
+            if results.is_insert and not isinstance(params, list):
+                if results.inserted_primary_key and len(results.inserted_primary_key) > 0:
+                    results = results.inserted_primary_key[0] or results.lastrowid
+
+        return results
+
+    async def _terminate(self, error=False):
+        if not self.ALIVE:
+            return
+
+        if self.IS_TRANSACTION:
+            if self.ERROR or error:
+                await self.TRANSACTION.rollback()
+            else:
+                await self.TRANSACTION.commit()
+            self.IS_TRANSACTION = False
+
+        await self.CURSOR.close()
+        self.ALIVE = False
+
+    @staticmethod
+    def pool_stats():
+        return ASYNC_REGISTRY.stats()
+
+    async def create(self, table):
+        return await self.CURSOR.run_sync(lambda conn: table.create(conn, checkfirst=True))
+
+    async def execute(self, query, params=None):
+        return await self._execute(query, self.EXECUTE, params)
+
+    async def fetch(self, query, params=None):
+        return self._parse(
+            await self._execute(query, self.ALL, params)
+        )
+
+    async def get(self, query, params=None):
+        return self._parse(
+            await self._execute(query, self.ONE, params)
+        )
+
+    async def scalar(self, query):
+        return await self._execute(query, self.SCALAR)
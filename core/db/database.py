@@ -1,11 +1,17 @@
 
+import time
 from typing import overload
-from sqlalchemy import CursorResult, Sequence, Row, create_engine
+from sqlalchemy import CursorResult, Sequence, Row, inspect, text
+from sqlalchemy.schema import CreateIndex, DropIndex
+from core.db.registry import REGISTRY
+from core.db.slow_query import SLOW_QUERIES, query_parameters
+from core.timing import timed
 
 
 class Database():
 
-    def __init__(self, app=None, conn_string=None, isolation_level=None, is_transaction=False):
+    def __init__(self, app=None, conn_string=None, isolation_level=None, is_transaction=False, engine_options=None,
+                 read_only=False, shard=None):
         self.APP = app
         self.ISOLATION_LEVEL = isolation_level
         self.IS_TRANSACTION = is_transaction
@@ -13,22 +19,27 @@ class Database():
         self.ALIVE = False
         self.ERROR = False
         if self.APP:
-            self.CONNECTION_STRING = self.APP.config.get('SQLALCHEMY_DATABASE_URI')
+            # Sharded tables live in one of `SQLALCHEMY_SHARDS`, otherwise reads may go to a separate (replicated)
+            # database and writes always go to the primary
+            read_uri = self.APP.config.get('SQLALCHEMY_READ_DATABASE_URI') if read_only else None
+            self.CONNECTION_STRING = shard or read_uri or self.APP.config.get('SQLALCHEMY_DATABASE_URI')
+            self.ENGINE_OPTIONS = self.APP.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+            self.SLOW_QUERY_THRESHOLD = self.APP.config.get('SLOW_QUERY_THRESHOLD', SLOW_QUERIES.THRESHOLD)
         else:
             self.CONNECTION_STRING = conn_string
+            self.ENGINE_OPTIONS = engine_options or {}
+            self.SLOW_QUERY_THRESHOLD = SLOW_QUERIES.THRESHOLD
 
         self.ALL = 1
         self.ONE = 2
         self.SCALAR = 3
         self.EXECUTE = 4
 
+    @timed('pool')
     def __enter__(self):
-        if self.ISOLATION_LEVEL:
-            self.CONNECTION = create_engine(
-                self.CONNECTION_STRING, self.ISOLATION_LEVEL)
-        else:
-            self.CONNECTION = create_engine(self.CONNECTION_STRING)
-        self.CURSOR = self.CONNECTION.connect()
+        # Engines (and their connection pools) are shared process-wide, so only a connection is checked out here
+        self.CONNECTION, self.CURSOR = REGISTRY.connect(
+            self.CONNECTION_STRING, self.ISOLATION_LEVEL, **self.ENGINE_OPTIONS)
 
         if self.IS_TRANSACTION:
             self.TRANSACTION = self.CURSOR.begin()
@@ -43,23 +54,39 @@ class Database():
     def __del__(self):
         self._terminate()
 
-    def _execute(self, query, action):
+    @timed('db')
+    def _execute(self, query, action, params=None):
+        # Only timed when the slow query log is on
+        if self.SLOW_QUERY_THRESHOLD is None:
+            return self._run(query, action, params)
+
+        start = time.perf_counter()
+        results = self._run(query, action, params)
+        duration = time.perf_counter() - start
+        if duration >= self.SLOW_QUERY_THRESHOLD:
+            SLOW_QUERIES.record(
+                query, query_parameters(self.CURSOR, params), duration, self.CONNECTION_STRING, self.CURSOR.dialect)
+
+        return results
+
+    def _run(self, query, action, params=None):
         match action:
             case self.ALL:
-                results = self.CURSOR.execute(query).fetchall()
+                results = self.CURSOR.execute(query, params).fetchall()
             case self.ONE:
-                results = self.CURSOR.execute(query).first()
+                results = self.CURSOR.execute(query, params).first()
             case self.SCALAR:
-                results = self.CURSOR.execute(query).scalar()
+                results = self.CURSOR.execute(query, params).scalar()
             case self.EXECUTE:
-                results = self.CURSOR.execute(query)
+                results = self.CURSOR.execute(query, params)
             case _:
                 results = None
 
         if not self.IS_TRANSACTION:
             self.CURSOR.commit()
         if results and isinstance(results, CursorResult):
-            if results.is_insert:
+            # A list of parameters is an `executemany` call, which has no single inserted primary key
+            if results.is_insert and not isinstance(params, list):
                 if results.inserted_primary_key and len(results.inserted_primary_key) > 0:
                     results = results.inserted_primary_key[0] or results.lastrowid
 
@@ -93,27 +120,66 @@ class Database():
                 self.TRANSACTION.commit()
             self.IS_TRANSACTION = False
 
+        # Return the connection to the pool
         self.CURSOR.close()
-        self.CONNECTION.dispose()
         self.ALIVE = False
 
+    @staticmethod
+    def pool_stats():
+        return REGISTRY.stats()
+
     def create(self, table):
         return table.create(self.CONNECTION, checkfirst=True)
 
-    def execute(self, query):
+    def drop(self, table):
+        # On the cursor, so it can be part of a transaction (SQLite DDL is transactional)
+        table.drop(self.CURSOR, checkfirst=True)
+        if not self.IS_TRANSACTION:
+            self.CURSOR.commit()
+
+    def columns(self, table):
+        return [c.get('name') for c in inspect(self.CURSOR).get_columns(table.name)]
+
+    def rename(self, table, name):
+        preparer = self.CURSOR.dialect.identifier_preparer
+        query = text(f"ALTER TABLE {preparer.format_table(table)} RENAME TO {preparer.quote(name)}")
         return self._execute(query, self.EXECUTE)
 
-    def fetch(self, query):
+    def drop_index(self, index):
+        return self._execute(DropIndex(index, if_exists=True), self.EXECUTE)
+
+    def add_column(self, table, column):
+        # Idempotent `ALTER TABLE ... ADD COLUMN` for migrating existing databases
+        existing = [c.get('name') for c in inspect(self.CURSOR).get_columns(table.name)]
+        if column.name in existing:
+            return False
+        preparer = self.CURSOR.dialect.identifier_preparer
+        # Existing rows get the server default, if there is one
+        default = f" NOT NULL DEFAULT {column.server_default.arg.text}" if column.server_default is not None else ''
+        self.CURSOR.execute(text(
+            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+            f"{column.type.compile(dialect=self.CURSOR.dialect)}{default}"
+        ))
+        self.CURSOR.commit()
+        return True
+
+    def create_index(self, index):
+        # `IF NOT EXISTS` rather than reflection, which may see a stale schema on a pooled SQLite connection
+        self.CURSOR.execute(CreateIndex(index, if_not_exists=True))
+        self.CURSOR.commit()
+
+    def execute(self, query, params=None):
+        return self._execute(query, self.EXECUTE, params)
+
+    def fetch(self, query, params=None):
         return self._parse(
-            self._execute(query, self.ALL)
+            self._execute(query, self.ALL, params)
         )
 
-    def get(self, query):
+    def get(self, query, params=None):
         return self._parse(
-            self._execute(query, self.ONE)
+            self._execute(query, self.ONE, params)
         )
 
     def scalar(self, query):
-        return self._parse(
-            self._execute(query, self.SCALAR)
-        )
+        return self._execute(query, self.SCALAR)
@@ -0,0 +1,221 @@
+import re
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from core.db.slow_query import listen_query_parameters
+from core.metrics import METRICS
+
+
+# Pool options that only apply to QueuePool-style pools (ie: not SQLite in-memory databases)
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_use_lifo')
+
+# Applied to every new SQLite connection unless `sqlite_pragmas` is given. WAL lets readers carry on while
+# hits are written, and with it `synchronous=NORMAL` only syncs at checkpoints rather than on every commit.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY'
+}
+
+
+def listen_sqlite_pragmas(engine, pragmas):
+    # `engine` may be an async engine, whose connect events are raised by its synchronous counterpart
+    if not pragmas:
+        return
+
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    event.listen(getattr(engine, 'sync_engine', engine), 'connect', _on_connect)
+
+
+# The statement and first table of a query, as the labels of its latency. Monthly hit partitions share one label.
+_STATEMENT = re.compile(r'^\s*(\w+)')
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?"?(\w+)"?', re.IGNORECASE)
+_PARTITION = re.compile(r'^hit_\d{4}_\d{2}$')
+_QUERY_LABELS = {}
+_QUERY_LABELS_MAX = 2000
+
+
+def _query_labels(statement):
+    labels = _QUERY_LABELS.get(statement)
+    if labels is None:
+        verb = _STATEMENT.match(statement)
+        table = _TABLE.search(statement)
+        table = table.group(1) if table else ''
+        labels = (
+            ('statement', verb.group(1).upper() if verb else ''),
+            ('table', 'hit_YYYY_MM' if _PARTITION.match(table) else table)
+        )
+        # Statements with an expanding `IN` differ by their number of parameters, so not all of them are kept
+        if len(_QUERY_LABELS) < _QUERY_LABELS_MAX:
+            _QUERY_LABELS[statement] = labels
+    return labels
+
+
+def listen_query_metrics(engine):
+    # Records every query's latency in `METRICS`, `engine` may be an async engine like for `listen_sqlite_pragmas`
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if starts:
+            METRICS.observe('turl_db_query_duration_seconds', time.perf_counter() - starts.pop(),
+                            _query_labels(statement))
+
+    def _handle_error(context):
+        # A failed query never reaches `after_cursor_execute`
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    event.listen(sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', _handle_error)
+
+
+class PoolStats:
+
+    def __init__(self, engine):
+        self.ENGINE = engine
+        self.LOCK = threading.Lock()
+
+        self.CONNECTS = 0
+        self.CHECKOUTS = 0
+        self.CHECKINS = 0
+        self.CHECKED_OUT = 0
+        self.MAX_CHECKED_OUT = 0
+        self.TIMEOUTS = 0
+        self.WAIT_TOTAL = 0.0
+        self.WAIT_MAX = 0.0
+
+        event.listen(engine.pool, 'connect', self._on_connect)
+        event.listen(engine.pool, 'checkout', self._on_checkout)
+        event.listen(engine.pool, 'checkin', self._on_checkin)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.LOCK:
+            self.CONNECTS += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.LOCK:
+            self.CHECKOUTS += 1
+            self.CHECKED_OUT += 1
+            self.MAX_CHECKED_OUT = max(self.MAX_CHECKED_OUT, self.CHECKED_OUT)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self.LOCK:
+            self.CHECKINS += 1
+            self.CHECKED_OUT = max(self.CHECKED_OUT - 1, 0)
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.LOCK:
+            self.WAIT_TOTAL += seconds
+            self.WAIT_MAX = max(self.WAIT_MAX, seconds)
+            if timed_out:
+                self.TIMEOUTS += 1
+
+    def as_dict(self):
+        pool = self.ENGINE.pool
+        with self.LOCK:
+            stats = {
+                'pool': pool.__class__.__name__,
+                'connects': self.CONNECTS,
+                'checkouts': self.CHECKOUTS,
+                'checkins': self.CHECKINS,
+                'checked_out': self.CHECKED_OUT,
+                'max_checked_out': self.MAX_CHECKED_OUT,
+                'timeouts': self.TIMEOUTS,
+                'wait_total': self.WAIT_TOTAL,
+                'wait_max': self.WAIT_MAX,
+                'wait_avg': self.WAIT_TOTAL / self.CHECKOUTS if self.CHECKOUTS else 0.0
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'overflow': pool.overflow(),
+                'checked_in': pool.checkedin()
+            })
+        return stats
+
+
+class EngineRegistry:
+
+    def __init__(self):
+        self.ENGINES = {}
+        self.STATS = {}
+        self.LOCK = threading.Lock()
+
+    def get(self, conn_string, isolation_level=None, **options):
+        # Engines are shared process-wide, keyed by connection string and isolation level.
+        # The options only take effect for the first caller that creates the engine.
+        key = (conn_string, isolation_level)
+        engine = self.ENGINES.get(key)
+        if engine is None:
+            with self.LOCK:
+                engine = self.ENGINES.get(key)
+                if engine is None:
+                    engine = self._create(conn_string, isolation_level, options)
+                    self.STATS[key] = PoolStats(engine)
+                    self.ENGINES[key] = engine
+        return engine
+
+    def connect(self, conn_string, isolation_level=None, **options):
+        engine = self.get(conn_string, isolation_level, **options)
+        stats = self.STATS[(conn_string, isolation_level)]
+
+        start = time.perf_counter()
+        try:
+            connection = engine.connect()
+        except Exception:
+            stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        stats.record_wait(time.perf_counter() - start)
+
+        return engine, connection
+
+    def stats(self):
+        return {
+            f"{conn_string}#{isolation_level or 'default'}": stats.as_dict()
+            for (conn_string, isolation_level), stats in list(self.STATS.items())
+        }
+
+    def dispose(self):
+        with self.LOCK:
+            for engine in self.ENGINES.values():
+                engine.dispose()
+            self.ENGINES.clear()
+            self.STATS.clear()
+
+    @staticmethod
+    def _create(conn_string, isolation_level, options):
+        options = {k: v for k, v in options.items() if v is not None}
+        if isolation_level:
+            options['isolation_level'] = isolation_level
+        pragmas = options.pop('sqlite_pragmas', SQLITE_PRAGMAS)
+
+        url = make_url(conn_string)
+        pool_class = options.get('poolclass') or url.get_dialect().get_pool_class(url)
+        if not issubclass(pool_class, QueuePool):
+            for option in QUEUE_POOL_OPTIONS:
+                options.pop(option, None)
+
+        engine = create_engine(conn_string, **options)
+        if url.get_backend_name() == 'sqlite':
+            listen_sqlite_pragmas(engine, pragmas)
+        listen_query_metrics(engine)
+        listen_query_parameters(engine)
+        return engine
+
+
+REGISTRY = EngineRegistry()
@@ -0,0 +1,51 @@
+import threading
+import time
+from contextvars import ContextVar
+
+
+# Set once the current request (or thread) has written, so its later reads see those writes
+_PINNED = ContextVar('pinned', default=False)
+
+
+def pin():
+    _PINNED.set(True)
+
+
+def unpin():
+    _PINNED.set(False)
+
+
+def is_pinned():
+    return _PINNED.get()
+
+
+class RecentWrites:
+    # Keys (ie: hash keys) this process has written recently, so any request reading them is sent to the primary
+    # until the read database has had time to catch up
+
+    def __init__(self, prune_every=1000):
+        self.EXPIRES = {}
+        self.LOCK = threading.Lock()
+        self.PRUNE_EVERY = prune_every
+        self.ADDS = 0
+
+    def add(self, keys, window):
+        expires = time.monotonic() + window
+        with self.LOCK:
+            for key in keys:
+                self.EXPIRES[key] = expires
+            self.ADDS += 1
+            if self.ADDS % self.PRUNE_EVERY == 0:
+                now = time.monotonic()
+                self.EXPIRES = {k: e for k, e in self.EXPIRES.items() if e > now}
+
+    def __contains__(self, key):
+        expires = self.EXPIRES.get(key)
+        return expires is not None and expires > time.monotonic()
+
+    def clear(self):
+        with self.LOCK:
+            self.EXPIRES.clear()
+
+
+RECENT_WRITES = RecentWrites()
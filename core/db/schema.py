@@ -1,5 +1,5 @@
-from sqlalchemy import Column, ForeignKey, MetaData, Table
-from sqlalchemy.dialects.sqlite import INTEGER, TEXT, DATETIME
+from sqlalchemy import Column, ForeignKey, Index, MetaData, Table, text
+from sqlalchemy.dialects.sqlite import BLOB, INTEGER, REAL, TEXT, DATE, DATETIME
 
 
 class Schema:
@@ -7,7 +7,10 @@ class Schema:
         'url', MetaData(),
         Column('id', INTEGER, primary_key=True, nullable=False),
         Column('url', TEXT,  nullable=False),
-        Column('date_created', DATETIME, nullable=False)
+        # SHA-256 hex digest of `url`, so dedupe lookups don't compare arbitrarily long TEXT
+        Column('url_digest', TEXT,  nullable=True),
+        Column('date_created', DATETIME, nullable=False),
+        Index('ix_url_url_digest', 'url_digest', unique=True)
     )
 
     url_hash = Table(
@@ -17,14 +20,165 @@ class Schema:
         Column('url_id', INTEGER, ForeignKey(url.c.id), nullable=False),
         Column('date_created', DATETIME, nullable=False),
         Column('date_modified', DATETIME, nullable=True),
-        Column('is_deleted', INTEGER, nullable=False, default=0)
+        Column('is_deleted', INTEGER, nullable=False, default=0),
+        # 1 for a User supplied hash_key, Short URLs created before this column existed count as generated
+        Column('is_custom', INTEGER, nullable=False, server_default=text('0')),
+        # 1 to redirect with a cacheable 301, clicks replayed from a browser or CDN cache are then never counted
+        Column('is_permanent', INTEGER, nullable=False, server_default=text('0')),
+        Index('ix_url_hash_hash_key', 'hash_key', unique=True),
+        # Lookups only ever want live keys, deleted ones stay out of this (smaller) index
+        Index('ix_url_hash_live_hash_key', 'hash_key', sqlite_where=text('is_deleted = 0')),
+        # Deleted keys by age, for the purge job
+        Index('ix_url_hash_deleted_date_modified', 'date_modified', sqlite_where=text('is_deleted = 1')),
+        # The live generated Short URL of a Long URL, which creates without a Custom URL may return again
+        Index('ix_url_hash_generated_url_id', 'url_id', sqlite_where=text('is_deleted = 0 AND is_custom = 0'))
+    )
+
+    # Short URLs deleted long enough ago to be moved out of `url_hash` (see `UrlEngine.purge_deleted`), only
+    # kept to tell that a hash_key was deleted. The hash_key can be used again once it is here.
+    url_hash_purged = Table(
+        'url_hash_purged', MetaData(),
+        Column('id', INTEGER, primary_key=True, nullable=False),
+        # The id it had in `url_hash`, which its hits in `hit_purged` refer to
+        Column('url_hash_id', INTEGER, nullable=False),
+        Column('hash_key', TEXT,  nullable=False),
+        Column('url_id', INTEGER, nullable=False),
+        Column('date_created', DATETIME, nullable=False),
+        Column('date_modified', DATETIME, nullable=True),
+        Column('date_purged', DATETIME, nullable=False),
+        Index('ix_url_hash_purged_hash_key', 'hash_key')
     )
 
+    # Client supplied `Idempotency-Key`s and the Short URL each one created, so retried creates return it again
+    idempotency_key = Table(
+        'idempotency_key', MetaData(),
+        Column('key', TEXT, primary_key=True, nullable=False),
+        # The digest of the Long URL it was used with, the same key sent with another Long URL is rejected
+        Column('url_digest', TEXT, nullable=False),
+        Column('hash_key', TEXT, nullable=False),
+        Column('date_created', DATETIME, nullable=False)
+    )
+
+    # Token buckets shared by every worker when rate limiting uses the `sqlite` backend (see `core.limiter`)
+    rate_bucket = Table(
+        'rate_bucket', MetaData(),
+        Column('key', TEXT, primary_key=True, nullable=False),
+        Column('tokens', REAL, nullable=False),
+        # `time.time()` of the last take, tokens are refilled from it on the next one
+        Column('updated', REAL, nullable=False),
+        # Whether the last take was allowed, so one upsert both takes a token and reports the outcome
+        Column('allowed', INTEGER, nullable=False),
+        sqlite_with_rowid=False
+    )
+
+    # Block reservations for generated hash keys
+    key_sequence = Table(
+        'key_sequence', MetaData(),
+        Column('name', TEXT, primary_key=True, nullable=False),
+        Column('next_value', INTEGER, nullable=False, default=0)
+    )
+
+    # Every distinct `User-Agent` once, hits and their counters refer to it by id
+    user_agent = Table(
+        'user_agent', MetaData(),
+        Column('id', INTEGER, primary_key=True, nullable=False),
+        Column('user_agent', TEXT, nullable=False),
+        Index('ix_user_agent_user_agent', 'user_agent', unique=True)
+    )
+
+    # The layout of databases created before partitioning, whose rows are moved to the partitions by the migration
     hit = Table(
         'hit', MetaData(),
         Column('id', INTEGER, primary_key=True, nullable=False),
         Column('url_hash_id', INTEGER, ForeignKey(url_hash.c.id)),
         Column('ip_address', TEXT,  nullable=True),
         Column('user_agent', TEXT,  nullable=True),
-        Column('date_created', DATETIME, nullable=False)
+        Column('date_created', DATETIME, nullable=False),
+        Index('ix_hit_url_hash_id_date_created', 'url_hash_id', 'date_created')
+    )
+
+    # Hits are written to one `hit_YYYY_MM` table per month (see `hit_month`)
+    hit_partition = Table(
+        'hit_partition', MetaData(),
+        Column('name', TEXT, primary_key=True, nullable=False),
+        Column('month', DATE, nullable=False),
+        # Set once the partition has been rolled into the counters, exported and dropped
+        Column('num_rows', INTEGER, nullable=True),
+        Column('archive_path', TEXT, nullable=True),
+        Column('date_archived', DATETIME, nullable=True),
+        Index('ix_hit_partition_month', 'month', unique=True)
+    )
+
+    # Click counters maintained as hits are recorded, so statistics never scan `hit`
+    hit_total = Table(
+        'hit_total', MetaData(),
+        Column('url_hash_id', INTEGER, ForeignKey(url_hash.c.id), primary_key=True, nullable=False),
+        Column('num_clicks', INTEGER, nullable=False, default=0),
+        Column('date_modified', DATETIME, nullable=True)
     )
+
+    hit_daily = Table(
+        'hit_daily', MetaData(),
+        Column('url_hash_id', INTEGER, ForeignKey(url_hash.c.id), primary_key=True, nullable=False),
+        Column('day', DATE, primary_key=True, nullable=False),
+        Column('num_clicks', INTEGER, nullable=False, default=0)
+    )
+
+    # Rollups for the analytics range queries. Without a rowid, the primary key is a covering index.
+    hit_hourly = Table(
+        'hit_hourly', MetaData(),
+        Column('url_hash_id', INTEGER, ForeignKey(url_hash.c.id), primary_key=True, nullable=False),
+        Column('hour', DATETIME, primary_key=True, nullable=False),
+        Column('num_clicks', INTEGER, nullable=False, default=0),
+        sqlite_with_rowid=False
+    )
+
+    hit_agent_daily = Table(
+        'hit_agent_daily', MetaData(),
+        Column('url_hash_id', INTEGER, ForeignKey(url_hash.c.id), primary_key=True, nullable=False),
+        Column('day', DATE, primary_key=True, nullable=False),
+        # 0 when the hit had no `User-Agent`
+        Column('user_agent_id', INTEGER, primary_key=True, nullable=False),
+        Column('num_clicks', INTEGER, nullable=False, default=0),
+        sqlite_with_rowid=False
+    )
+
+    hit_ip_daily = Table(
+        'hit_ip_daily', MetaData(),
+        Column('url_hash_id', INTEGER, ForeignKey(url_hash.c.id), primary_key=True, nullable=False),
+        Column('day', DATE, primary_key=True, nullable=False),
+        # Packed (4 or 16 bytes), empty when the hit had no address
+        Column('ip_address', BLOB, primary_key=True, nullable=False),
+        Column('num_clicks', INTEGER, nullable=False, default=0),
+        sqlite_with_rowid=False
+    )
+
+    # Hits of purged Short URLs, in the layout of the `hit_YYYY_MM` partitions
+    hit_purged = Table(
+        'hit_purged', MetaData(),
+        Column('id', INTEGER, primary_key=True, nullable=False),
+        Column('url_hash_id', INTEGER, nullable=False),
+        Column('ip_address', BLOB, nullable=True),
+        Column('user_agent_id', INTEGER, nullable=True),
+        Column('date_created', DATETIME, nullable=False),
+        Index('ix_hit_purged_url_hash_id', 'url_hash_id')
+    )
+
+    _hit_months = {}
+
+    @classmethod
+    def hit_month(cls, month):
+        # The `hit` table for the month starting on `month`, with packed IPs and interned user agents
+        name = f"hit_{month:%Y_%m}"
+        table = cls._hit_months.get(name)
+        if table is None:
+            table = cls._hit_months.setdefault(name, Table(
+                name, MetaData(),
+                Column('id', INTEGER, primary_key=True, nullable=False),
+                Column('url_hash_id', INTEGER, ForeignKey(cls.url_hash.c.id)),
+                Column('ip_address', BLOB, nullable=True),
+                Column('user_agent_id', INTEGER, ForeignKey(cls.user_agent.c.id), nullable=True),
+                Column('date_created', DATETIME, nullable=False),
+                Index(f"ix_{name}_url_hash_id_date_created", 'url_hash_id', 'date_created')
+            ))
+        return table
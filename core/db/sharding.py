@@ -0,0 +1,40 @@
+import bisect
+import hashlib
+
+
+# Sharded row ids carry the index of their shard in their low bits, so rows referring to them (ie: hits to their
+# `url_hash_id`) can be routed without a lookup
+SHARD_SLOTS = 256
+
+
+class ShardRing:
+    # Consistent hashing of keys onto shards. Every shard owns the arcs of the ring ending at its `replicas` points,
+    # so adding a shard only takes over about 1/N of the keys, all of them from the existing shards.
+    # Shards are identified by their position in the list (their connection string may change), so new shards
+    # must always be appended.
+
+    def __init__(self, shards, replicas=64):
+        if not 0 < len(shards) <= SHARD_SLOTS:
+            raise Exception(f"Between 1 and {SHARD_SLOTS} shards are supported.")
+
+        self.SHARDS = list(shards)
+        points = sorted((self._hash(f"shard-{i}#{r}"), i) for i in range(len(self.SHARDS)) for r in range(replicas))
+        self.POINTS = [p for p, _ in points]
+        self.OWNERS = [i for _, i in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def index_for(self, key):
+        i = bisect.bisect(self.POINTS, self._hash(key))
+        return self.OWNERS[i % len(self.OWNERS)]
+
+    def shard_for(self, key):
+        return self.SHARDS[self.index_for(key)]
+
+    def shard_of_id(self, row_id):
+        return self.SHARDS[row_id % SHARD_SLOTS]
+
+    def encode_id(self, shard, sequence):
+        return sequence * SHARD_SLOTS + self.SHARDS.index(shard)
@@ -0,0 +1,106 @@
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import sys
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+logger = logging.getLogger(__name__)
+
+# Parameters are logged to help reproduce a query, not in full (ie: a whole batch of hits)
+MAX_PARAM_ROWS = 5
+MAX_PARAM_LENGTH = 200
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > MAX_PARAM_LENGTH:
+        return f"{value[:MAX_PARAM_LENGTH]}..."
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, (list, tuple)):
+        return [_truncate(v) for v in value[:MAX_PARAM_ROWS]]
+    if isinstance(value, dict):
+        return {k: _truncate(v) for k, v in value.items()}
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _caller():
+    # The outermost `UrlEngine`/`HitEngine` (or async) method on the stack, ie: `UrlEngine.get_url`
+    caller = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if owner is not None and type(owner).__module__.startswith('core.engine.') \
+                and not frame.f_code.co_name.startswith('_'):
+            caller = f"{type(owner).__name__}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return caller
+
+
+def listen_query_parameters(engine):
+    # Keeps the parameters of each connection's last query as they were compiled, so inline `bindparam`s and literal
+    # values are logged along with those passed to `execute`. `engine` may be an async engine.
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_parameters'] = context.compiled_parameters if context.compiled is not None else parameters
+
+    event.listen(getattr(engine, 'sync_engine', engine), 'after_cursor_execute', _after_cursor_execute)
+
+
+def query_parameters(connection, default=None):
+    # The parameters of the last query run on `connection`, a single execution's as one dict
+    params = connection.info.get('query_parameters', default)
+    return params[0] if isinstance(params, list) and len(params) == 1 else params
+
+
+class SlowQueryLog:
+    # Queries that took `threshold` seconds or longer, logged as JSON lines to the `core.db.slow_query` logger and
+    # the last `max_entries` of them kept for inspection. Only queries run through `Database` are timed.
+
+    def __init__(self, threshold=None, max_entries=100):
+        # Used by `Database`s without an application, whose `SLOW_QUERY_THRESHOLD` applies otherwise
+        self.THRESHOLD = threshold
+        self.ENTRIES = deque(maxlen=max_entries)
+        self.LOCK = threading.Lock()
+        self.COUNT = 0
+
+    def record(self, query, params, duration, conn_string, dialect=None):
+        try:
+            sql = str(query.compile(dialect=dialect)) if hasattr(query, 'compile') else str(query)
+        except Exception:
+            sql = str(query)
+        try:
+            database = make_url(conn_string).render_as_string(hide_password=True)
+        except Exception:
+            database = None
+
+        entry = {
+            'sql': sql,
+            'params': _truncate(params),
+            'duration': duration,
+            'database': database,
+            'caller': _caller(),
+            'date_created': datetime.now().isoformat()
+        }
+        with self.LOCK:
+            self.ENTRIES.append(entry)
+            self.COUNT += 1
+        logger.warning(json.dumps(entry))
+
+        return entry
+
+    def entries(self):
+        with self.LOCK:
+            return list(self.ENTRIES)
+
+    def clear(self):
+        with self.LOCK:
+            self.ENTRIES.clear()
+            self.COUNT = 0
+
+
+SLOW_QUERIES = SlowQueryLog()
@@ -1,2 +1,5 @@
+from .aio import AsyncHitEngine, AsyncUrlEngine
 from .hit import HitEngine
-from .url import UrlEngine
\ No newline at end of file
+from .recorder import HitRecorder, RECORDERS
+from .url import HashKeyConflict, UrlEngine
+from .warmup import warm_up
@@ -0,0 +1,123 @@
+import asyncio
+from sqlalchemy import select
+from core.engine.hit import HitEngine, PARTITIONS, month_start
+from core.engine.url import UrlEngine
+from core.db import AsyncDatabase
+from core.timing import timed
+
+
+class AsyncUrlEngine(UrlEngine):
+    # Shares the resolution cache (and the queries) of `UrlEngine`, but looks up misses without blocking the event loop.
+    # The coroutines are named apart (`aget_url`) so the inherited synchronous methods still call their own.
+
+    @timed('engine')
+    async def aget_url(self, hash_key):
+        if self.CACHE.needs_sync():
+            await asyncio.to_thread(self._sync_caches)
+
+        found, url = self.CACHE.get(hash_key)
+        if found:
+            return url
+        if await self._adefinitely_missing(hash_key):
+            return None
+
+        token = self.CACHE.token()
+        url = await self._aget_url(hash_key)
+        self.CACHE.set(hash_key, url, token)
+        if url is None and self.FILTER:
+            self.FILTER.false_positive()
+
+        return url
+
+    @timed('engine')
+    async def aget_deleted_url(self, hash_key):
+        if await self._adefinitely_missing(hash_key):
+            return None
+
+        for shard in self._owners(hash_key):
+            async with AsyncDatabase(**self._reader(hash_key, shard)) as db:
+                for q_ in self._get_deleted_url_queries():
+                    url = await db.get(q_, {'b_hash_key': hash_key})
+                    if url:
+                        return url
+        return None
+
+    async def _adefinitely_missing(self, hash_key):
+        if self.FILTER is None:
+            return False
+        if not self.FILTER.ready:
+            # Scans every `url_hash` once, off the event loop
+            await asyncio.to_thread(self.build_key_filter, rebuild=False)
+        elif self.FILTER.needs_sync():
+            for shard in self._databases():
+                async with AsyncDatabase(**self._on(shard)) as db:
+                    rows = await db.fetch(self._key_filter_sync_query(shard))
+                self.FILTER.sync(self._filter_name(shard), rows)
+        return not self.FILTER.might_contain(hash_key)
+
+    async def _aget_url(self, hash_key):
+        for shard in self._owners(hash_key):
+            async with AsyncDatabase(**self._reader(hash_key, shard)) as db:
+                url = await db.get(self._get_url_query(), {'b_hash_key': hash_key})
+            if url:
+                return url
+        return None
+
+
+class AsyncHitEngine(HitEngine):
+    # Buffered hits are still written by the (threaded) recorder shared with `HitEngine`, through the
+    # inherited synchronous `create_hits`, so only the single-hit write path is asynchronous
+
+    @timed('engine')
+    async def acreate_hit(self, hit):
+        if not hit.get('user_agent_id'):
+            hit = dict(hit, user_agent_id=await self.aintern_user_agent(hit.get('user_agent')))
+
+        # A month seen for the first time gets its partition off the event loop, so building the queries never blocks
+        shard = self._shard_of_hit(hit)
+        month = month_start(hit.get('date_created'))
+        if month not in PARTITIONS.get(shard or self._database_name(), ()):
+            await asyncio.to_thread(self._ensure_partitions, [month], shard)
+        queries = self._create_hits_queries([hit], shard)
+        async with AsyncDatabase(**self._on(shard, is_transaction=True)) as db:
+            for q_, params in queries:
+                await db.execute(q_, params)
+
+    async def aintern_user_agent(self, user_agent):
+        if not user_agent:
+            return None
+
+        found, entry = self.USER_AGENTS.get(user_agent)
+        if found:
+            return entry.get('id')
+
+        ua = self.SCHEMA.user_agent
+        async with AsyncDatabase(**self._on(None)) as db:
+            await db.execute(self._insert_user_agent_query(), [{'user_agent': user_agent}])
+            user_agent_id = await db.scalar(select(ua.c.id).where(ua.c.user_agent == user_agent))
+
+        self.USER_AGENTS.set(user_agent, {'id': user_agent_id})
+        return user_agent_id
+
+    @timed('engine')
+    async def arecord_hit(self, hit):
+        # Never wait on a full buffer from the event loop, write the hit asynchronously instead
+        if self.RECORDER and self.RECORDER.try_record(hit):
+            return
+        await self.acreate_hit(hit)
+
+    async def aflush_hits(self, max_lag=None):
+        if self.RECORDER and (max_lag is None or self.RECORDER.lag() > max_lag):
+            await asyncio.to_thread(self.RECORDER.flush)
+
+    @timed('engine')
+    async def aget_statistics(self, hash_key):
+        # Buffered hits are counted, up to `HIT_READ_MAX_LAG`
+        await self.aflush_hits(self._config('HIT_READ_MAX_LAG'))
+
+        for shard in self._owners(hash_key):
+            async with AsyncDatabase(**self._reader(hash_key, shard)) as db:
+                statistics = await db.get(self._get_statistics_query(), {'b_hash_key': hash_key})
+            if statistics:
+                return statistics
+        return None
@@ -1,6 +1,85 @@
+from core.db import RECENT_WRITES, ShardRing, is_pinned, pin
+
+
+# Fixed statements, built once per process and reused with bound parameters. Besides skipping the query
+# construction, SQLAlchemy's compiled cache (and the driver's prepared statement cache) then always hit.
+STATEMENTS = {}
+
+
 class BaseEngine:
 
     def __init__(self, **kwargs):
         self.APP = kwargs.get('app', None)
         self.CONN_STRING = kwargs.get('conn_string', 'sqlite://test.db')
+        self.OPTIONS = kwargs
+        # None unless reads go to a separate database
+        self.READ_CONN_STRING = self._config('SQLALCHEMY_READ_DATABASE_URI', kwargs.get('read_conn_string'))
+
+        # Short URLs (and their hits) are spread over `SQLALCHEMY_SHARDS` by hash_key when set. The previous
+        # shards are those from before shards were last added, until `rebalance_shards` has moved every key.
+        shards = self._config('SQLALCHEMY_SHARDS', kwargs.get('shards'))
+        previous = self._config('SQLALCHEMY_SHARDS_PREVIOUS', kwargs.get('shards_previous'))
+        self.SHARDS = ShardRing(shards) if shards else None
+        self.PREVIOUS_SHARDS = ShardRing(previous) if previous and self.SHARDS else None
+
+    def _config(self, key, default=None):
+        # Application config takes precedence, otherwise fall back to the lower-cased keyword argument
+        if self.APP:
+            return self.APP.config.get(key, default)
+        return self.OPTIONS.get(key.lower(), default)
+
+    def _database_name(self):
+        if self.APP:
+            return self.APP.config.get('SQLALCHEMY_DATABASE_URI')
+        return self.CONN_STRING
+
+    def _databases(self):
+        # The primary, then every shard
+        return [None] + (self.SHARDS.SHARDS if self.SHARDS else [])
+
+    def _shards(self):
+        # Every database holding sharded tables, where None is the primary of an unsharded setup
+        return list(self.SHARDS.SHARDS) if self.SHARDS else [None]
+
+    def _shard_for(self, key):
+        return self.SHARDS.shard_for(key) if self.SHARDS else None
+
+    def _owners(self, key):
+        # Where `key` may live: its shard and, until a rebalance has completed, the shard that owned it before
+        owners = [self._shard_for(key)]
+        if self.PREVIOUS_SHARDS and self.PREVIOUS_SHARDS.shard_for(key) not in owners:
+            owners.append(self.PREVIOUS_SHARDS.shard_for(key))
+        return owners
+
+    def _shard_of_id(self, row_id):
+        return self.SHARDS.shard_of_id(row_id) if self.SHARDS and row_id is not None else None
+
+    def _on(self, shard, **kwargs):
+        # `Database` arguments for a shard, or the primary for None
+        if shard is None:
+            return dict(app=self.APP, conn_string=self.CONN_STRING, **kwargs)
+        return dict(app=self.APP, conn_string=shard, shard=shard, **kwargs)
+
+    def _reader(self, key=None, shard=None):
+        # `Database` arguments for a read. Shards are read directly. Otherwise it goes to the read database, unless
+        # this request has written or this process wrote `key` within the last `READ_YOUR_WRITES_WINDOW` seconds
+        # (which replication may not have caught up with).
+        if shard is not None:
+            return self._on(shard)
+        if not self.READ_CONN_STRING or is_pinned() or (self._database_name(), key) in RECENT_WRITES:
+            return {'app': self.APP, 'conn_string': self.CONN_STRING}
+        return {'app': self.APP, 'conn_string': self.READ_CONN_STRING, 'read_only': True}
+
+    def _wrote(self, *keys):
+        # Keeps the reads of this request, and of `keys` by any request, on the primary for a while
+        if not self.READ_CONN_STRING:
+            return
+        pin()
+        RECENT_WRITES.add([(self._database_name(), key) for key in keys], self._config('READ_YOUR_WRITES_WINDOW', 5))
 
+    @staticmethod
+    def _statement(name, build):
+        statement = STATEMENTS.get(name)
+        if statement is None:
+            statement = STATEMENTS.setdefault(name, build())
+        return statement
@@ -1,6 +1,44 @@
-from sqlalchemy import select, and_, func
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+import gzip
+import ipaddress
+import json
+import os
+from sqlalchemy import select, and_, bindparam, cast, func, literal, union_all
+from sqlalchemy import Column, Date, DateTime, MetaData, Table, TEXT
+from sqlalchemy.dialects.sqlite import insert
+from core.cache import CACHES
 from core.engine.base import BaseEngine
+from core.engine.recorder import RECORDERS
 from core.db import Database, Schema
+from core.timing import timed
+
+
+# Monthly `hit` partitions each process knows to exist, keyed by database
+PARTITIONS = {}
+
+
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def add_months(month, n):
+    month = month.year * 12 + month.month - 1 + n
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def pack_ip(address):
+    # 4 (IPv4) or 16 (IPv6) bytes, None for anything that isn't an address
+    if not address or isinstance(address, bytes):
+        return address or None
+    try:
+        return ipaddress.ip_address(address).packed
+    except ValueError:
+        return None
+
+
+def unpack_ip(packed):
+    return str(ipaddress.ip_address(packed)) if packed else None
 
 
 class HitEngine(BaseEngine):
@@ -8,34 +46,685 @@ class HitEngine(BaseEngine):
         super(HitEngine, self).__init__(**kwargs)
 
         self.SCHEMA = Schema()
+        # Interned ids never change, so entries only leave the cache to make room
+        self.USER_AGENTS = CACHES.get(
+            f"{self._database_name()}#user_agent",
+            max_size=self._config('USER_AGENT_CACHE_SIZE'),
+            ttl=float('inf'),
+            negative_ttl=0
+        )
+        self.RECORDER = None
+        if self._config('HIT_BUFFER_ENABLED', False):
+            self.RECORDER = RECORDERS.get(
+                self._database_name(), self,
+                batch_size=self._config('HIT_BUFFER_BATCH_SIZE'),
+                flush_interval=self._config('HIT_BUFFER_FLUSH_INTERVAL'),
+                max_queue=self._config('HIT_BUFFER_MAX_QUEUE'),
+                put_timeout=self._config('HIT_BUFFER_PUT_TIMEOUT'),
+                max_retries=self._config('HIT_BUFFER_MAX_RETRIES'),
+                retry_backoff=self._config('HIT_BUFFER_RETRY_BACKOFF')
+            )
+
+    def _rollups(self):
+        # (table, key columns, function mapping a hit to its key values) for every maintained counter
+        return [
+            (self.SCHEMA.hit_total, ['url_hash_id'],
+             lambda hit: (hit.get('url_hash_id'),)),
+            (self.SCHEMA.hit_daily, ['url_hash_id', 'day'],
+             lambda hit: (hit.get('url_hash_id'), hit.get('date_created').date())),
+            (self.SCHEMA.hit_hourly, ['url_hash_id', 'hour'],
+             lambda hit: (hit.get('url_hash_id'), hit.get('date_created').replace(minute=0, second=0, microsecond=0))),
+            (self.SCHEMA.hit_agent_daily, ['url_hash_id', 'day', 'user_agent_id'],
+             lambda hit: (hit.get('url_hash_id'), hit.get('date_created').date(), hit.get('user_agent_id') or 0)),
+            (self.SCHEMA.hit_ip_daily, ['url_hash_id', 'day', 'ip_address'],
+             lambda hit: (hit.get('url_hash_id'), hit.get('date_created').date(), hit.get('ip_address') or b''))
+        ]
 
     def create_table(self):
-        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+        # User agents are interned on the primary, hits and their counters live with their Short URL's shard
+        with Database(**self._on(None)) as db:
+            db.create(self.SCHEMA.user_agent)
+
+        for shard in self._shards():
+            with Database(**self._on(shard)) as db:
+                h = self.SCHEMA.hit
+
+                db.create(h)
+                db.create(self.SCHEMA.hit_partition)
+                db.create(self.SCHEMA.hit_purged)
+                for table, _, _ in self._rollups():
+                    db.create(table)
+
+    def migrate_table(self, batch_size=1000):
+        with Database(**self._on(None)) as db:
+            db.create(self.SCHEMA.user_agent)
+
+        for shard in self._shards():
+            self._migrate_table(shard, batch_size)
+
+    def _migrate_table(self, shard, batch_size):
+        with Database(**self._on(shard)) as db:
             h = self.SCHEMA.hit
 
-            db.create(h)
+            # Databases created before partitioning (or counters) don't have these yet
+            db.create(self.SCHEMA.hit_partition)
+            db.create(self.SCHEMA.hit_purged)
+            for table, _, _ in self._rollups():
+                db.create(table)
+            for index in h.indexes:
+                db.create_index(index)
+
+            # Counters were introduced after `hit`, so seed any empty ones from the existing rows
+            needs_rebuild = db.get(select(h.c.id).limit(1)) and any(
+                not db.get(select(table.c.url_hash_id).limit(1)) for table, _, _ in self._rollups())
+
+            legacy = [t for t in self._hot_partitions(db) if 'user_agent' in db.columns(t)]
+
+        self._migrate_rollups(shard)
+
+        # Move hits recorded before partitioning into their monthly partitions
+        self._move_hits(h, batch_size, shard)
+
+        # Partitions created before user agents were interned are rebuilt in the current layout
+        for t in legacy:
+            source = Table(f"{t.name}_legacy", MetaData(), *[c._copy() for c in h.columns])
+            with Database(**self._on(shard)) as db:
+                for index in t.indexes:
+                    db.drop_index(index)
+                db.rename(t, source.name)
+                db.create(t)
+            self._move_hits(source, batch_size, shard)
+            with Database(**self._on(shard)) as db:
+                db.drop(source)
+
+        if needs_rebuild:
+            self.rebuild_counters()
+
+    def _move_hits(self, source, batch_size, shard=None):
+        while True:
+            hits = self._fetch(select(source).order_by(source.c.id).limit(batch_size), shard)
+            if not hits:
+                break
+            queries = self._insert_hits_queries(self._encode_hits(hits), shard)
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                for q_, params in queries:
+                    db.execute(q_, params)
+                db.execute(source.delete().where(source.c.id <= hits[-1].get('id')))
+
+    def _migrate_rollups(self, shard=None):
+        # The counters keyed by the user agent and IP address as TEXT are re-keyed by their interned id and packed
+        # address. Converted keys can collide (ie: unparseable addresses), so rows are re-added as increments.
+        hat = self.SCHEMA.hit_agent_daily
+        hid = self.SCHEMA.hit_ip_daily
+
+        with Database(**self._on(shard)) as db:
+            agents_legacy = 'user_agent' in db.columns(hat)
+
+        if agents_legacy:
+            columns = ('url_hash_id', 'day', 'user_agent', 'num_clicks')
+            legacy = Table(f"{hat.name}_legacy", MetaData(), *[Column(c) for c in columns])
+            with Database(**self._on(shard)) as db:
+                db.rename(hat, legacy.name)
+                db.create(hat)
+            rows = self._fetch(select(legacy), shard)
+            ids = self.intern_user_agents(r.get('user_agent') for r in rows)
+            rows = [{
+                'url_hash_id': r.get('url_hash_id'),
+                'day': date.fromisoformat(str(r.get('day'))),
+                'user_agent_id': ids.get(r.get('user_agent')) or 0,
+                'num_clicks': r.get('num_clicks')
+            } for r in rows]
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                if rows:
+                    db.execute(self._increment_query(hat, ['url_hash_id', 'day', 'user_agent_id']), rows)
+                db.drop(legacy)
+
+        with Database(**self._on(shard, is_transaction=True)) as db:
+            rows = db.fetch(select(hid).where(func.typeof(hid.c.ip_address) == 'text'))
+            if rows:
+                db.execute(hid.delete().where(func.typeof(hid.c.ip_address) == 'text'))
+                db.execute(self._increment_query(hid, ['url_hash_id', 'day', 'ip_address']), [
+                    dict(r, ip_address=pack_ip(r.get('ip_address')) or b'') for r in rows])
+
+    def _fetch(self, query, shard=None):
+        with Database(**self._on(shard)) as db:
+            return db.fetch(query)
+
+    def _user_agent_texts(self, ids):
+        # Interned user agents live on the primary, so they are looked up separately from hits and counters
+        ids = [i for i in set(ids) if i]
+        if not ids:
+            return {}
+        ua = self.SCHEMA.user_agent
+        return {r.get('id'): r.get('user_agent') for r in self._fetch(select(ua).where(ua.c.id.in_(ids)))}
+
+    def _shard_of_hit(self, hit):
+        # Hits live with their Short URL, whose id encodes its shard (hits without one go to the first shard)
+        if hit.get('url_hash_id') is None:
+            return self._shards()[0]
+        return self._shard_of_id(hit.get('url_hash_id'))
+
+    def _shard_name(self, shard):
+        return f"shard_{self.SHARDS.SHARDS.index(shard)}" if shard else ''
+
+    def intern_user_agents(self, user_agents):
+        # Maps each user agent to its id, adding the ones not seen before. Known ones come from the cache.
+        ids = {}
+        missing = []
+        for user_agent in set(user_agents):
+            if not user_agent:
+                continue
+            found, entry = self.USER_AGENTS.get(user_agent)
+            if found:
+                ids[user_agent] = entry.get('id')
+            else:
+                missing.append(user_agent)
+
+        if missing:
+            ua = self.SCHEMA.user_agent
+            with Database(**self._on(None)) as db:
+                db.execute(self._insert_user_agent_query(), [{'user_agent': user_agent} for user_agent in missing])
+                rows = db.fetch(select(ua.c.id, ua.c.user_agent).where(ua.c.user_agent.in_(missing)))
+            for row in rows:
+                ids[row.get('user_agent')] = row.get('id')
+                self.USER_AGENTS.set(row.get('user_agent'), {'id': row.get('id')})
+
+        return ids
+
+    def intern_user_agent(self, user_agent):
+        return self.intern_user_agents([user_agent]).get(user_agent)
+
+    def _insert_user_agent_query(self):
+        ua = self.SCHEMA.user_agent
+        return self._statement('user_agent.insert', lambda: insert(ua).on_conflict_do_nothing())
+
+    def _encode_hits(self, hits):
+        # Hits as stored: the user agent by its interned id (unless the caller resolved it) and a packed IP
+        ids = self.intern_user_agents(hit.get('user_agent') for hit in hits if not hit.get('user_agent_id'))
+        return [{
+            'url_hash_id': hit.get('url_hash_id'),
+            'ip_address': pack_ip(hit.get('ip_address')),
+            'user_agent_id': hit.get('user_agent_id') or ids.get(hit.get('user_agent')),
+            'date_created': hit.get('date_created')
+        } for hit in hits]
+
+    def _ensure_partitions(self, months, shard=None):
+        known = PARTITIONS.setdefault(shard or self._database_name(), set())
+        months = [month for month in months if month not in known]
+        if not months:
+            return
+
+        with Database(**self._on(shard)) as db:
+            hp = self.SCHEMA.hit_partition
+            for month in months:
+                table = self.SCHEMA.hit_month(month)
+                db.create(table)
+                db.execute(insert(hp).values(name=table.name, month=month).on_conflict_do_nothing())
+                known.add(month)
+
+    def _hot_partitions(self, db, start=None, end=None):
+        # Partitions that haven't been archived, optionally only those overlapping [start, end]
+        hp = self.SCHEMA.hit_partition
+
+        wc_ = [hp.c.date_archived.is_(None)]
+        if start:
+            wc_.append(hp.c.month >= month_start(start))
+        if end:
+            wc_.append(hp.c.month <= month_start(end))
+
+        q_ = select(hp.c.month).where(and_(*wc_)).order_by(hp.c.month)
+        return [self.SCHEMA.hit_month(r.get('month')) for r in db.fetch(q_)]
+
+    def _archived_until(self, db):
+        # Archived partitions are always the oldest ones, so raw hits exist for everything from this month on
+        hp = self.SCHEMA.hit_partition
+        month = db.scalar(select(func.max(hp.c.month)).where(hp.c.date_archived.is_not(None)))
+        return add_months(date.fromisoformat(str(month)), 1) if month else None
+
+    def _hits_subquery(self, tables, start=None, end=None):
+        # The raw hits of several partitions as one selectable
+        selects = []
+        for t in tables:
+            wc_ = []
+            if start:
+                wc_.append(t.c.date_created >= start)
+            if end:
+                wc_.append(t.c.date_created < end)
+            selects.append(select(t.c.url_hash_id, t.c.ip_address, t.c.user_agent_id, t.c.date_created).where(*wc_))
+
+        if not selects:
+            t = self.SCHEMA.hit_month(date.min)
+            selects.append(select(t.c.url_hash_id, t.c.ip_address, t.c.user_agent_id, t.c.date_created).where(False))
+        return union_all(*selects).subquery('h') if len(selects) > 1 else selects[0].subquery('h')
 
     def create_hit(self, hit):
-        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
-            h = self.SCHEMA.hit
+        self.create_hits([hit])
+
+    @timed('engine')
+    def create_hits(self, hits):
+        shards = {}
+        for hit in hits:
+            shards.setdefault(self._shard_of_hit(hit), []).append(hit)
+
+        for shard, shard_hits in shards.items():
+            # Interning user agents and creating partitions happen before the transaction, on their own connection
+            queries = self._create_hits_queries(shard_hits, shard)
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                for q_, params in queries:
+                    db.execute(q_, params)
+
+    def _create_hits_queries(self, hits, shard=None):
+        # The `executemany` statements (and their parameters) that insert the hits and increment their counters
+        hits = self._encode_hits(hits)
+        queries = self._insert_hits_queries(hits, shard)
+        queries.extend(self._increment_counters_queries([hit for hit in hits if hit.get('url_hash_id') is not None]))
+        return queries
+
+    def _insert_hits_queries(self, hits, shard=None):
+        # Encoded hits (see `_encode_hits`) grouped into their partitions
+        months = {}
+        for hit in hits:
+            months.setdefault(month_start(hit.get('date_created')), []).append(hit)
+        self._ensure_partitions(months.keys(), shard)
+
+        return [
+            (self._statement(f"hit_{month:%Y_%m}.insert", self.SCHEMA.hit_month(month).insert), rows)
+            for month, rows in months.items()
+        ]
+
+    def _increment_counters_queries(self, hits):
+        if not hits:
+            return
+
+        now = datetime.now()
+        for table, keys, key_for in self._rollups():
+            # Aggregate the batch first so each counter row is only touched once
+            counts = Counter(key_for(hit) for hit in hits)
+
+            q_ = self._statement(f"{table.name}.increment", lambda: self._increment_query(table, keys))
+
+            rows = [dict(zip(keys, key), num_clicks=count) for key, count in counts.items()]
+            if 'date_modified' in table.c:
+                rows = [dict(row, date_modified=now) for row in rows]
+
+            yield q_, rows
+
+    def _rollup_buckets(self, h):
+        # The SQL equivalent of each rollup's key function, grouping raw hits (`h`) the same way (dates as TEXT)
+        day = func.date(h.c.date_created)
+        hour = func.strftime('%Y-%m-%d %H:00:00.000000', h.c.date_created)
+        return {
+            'hit_total': [],
+            'hit_daily': [day],
+            'hit_hourly': [hour],
+            'hit_agent_daily': [day, func.coalesce(h.c.user_agent_id, 0)],
+            'hit_ip_daily': [day, func.coalesce(h.c.ip_address, literal(b'', h.c.ip_address.type))]
+        }
+
+    @staticmethod
+    def _bucket_range(table, keys, start=None, end=None):
+        # Filters a bucketed rollup to [start, end), where its bucket is the first key after `url_hash_id`
+        b = table.c[keys[1]]
+        bound = (lambda d: d) if isinstance(b.type, Date) else (lambda d: datetime.combine(d, time()))
+
+        wc_ = []
+        if start:
+            wc_.append(b >= bound(start))
+        if end:
+            wc_.append(b < bound(end))
+        return wc_
 
-            q_ = h.insert().values(hit)
+    @staticmethod
+    def _increment_query(table, keys):
+        q_ = insert(table)
+        set_ = {'num_clicks': table.c.num_clicks + q_.excluded.num_clicks}
+        if 'date_modified' in table.c:
+            set_['date_modified'] = q_.excluded.date_modified
+        return q_.on_conflict_do_update(index_elements=keys, set_=set_)
 
-            db.execute(q_)
+    def check_counters(self):
+        # Compare every maintained counter against the raw hits (of the partitions that haven't been archived)
+        # and the totals against the daily counters, returning any mismatches
+        mismatches = []
+        for shard in self._shards():
+            mismatches.extend(self._check_counters(shard))
+        return mismatches
 
+    def _check_counters(self, shard):
+        mismatches = []
+
+        with Database(**self._on(shard)) as db:
+            since = self._archived_until(db)
+            h = self._hits_subquery(self._hot_partitions(db, since), since)
+            buckets = self._rollup_buckets(h)
+
+            for table, keys, _ in self._rollups():
+                if table is self.SCHEMA.hit_total:
+                    hd = self.SCHEMA.hit_daily
+                    q_ = select(hd.c.url_hash_id, func.sum(hd.c.num_clicks).label('num_clicks'))
+                    q_ = q_.group_by(hd.c.url_hash_id)
+                    wc_ = []
+                else:
+                    bucket = buckets.get(table.name)
+                    q_ = select(h.c.url_hash_id, *bucket, func.count().label('num_clicks'))
+                    q_ = q_.where(h.c.url_hash_id.is_not(None)).group_by(h.c.url_hash_id, *bucket)
+                    wc_ = self._bucket_range(table, keys, since)
+                expected = {tuple(r.values())[:-1]: r.get('num_clicks') for r in db.fetch(q_)}
+
+                # Compare the stored dates as TEXT, as `rebuild_counters` writes them
+                rc_ = [cast(table.c[k], TEXT) if isinstance(table.c[k].type, (Date, DateTime)) else table.c[k]
+                       for k in keys[1:]]
+                q_ = select(table.c.url_hash_id, *rc_, table.c.num_clicks)
+                actual = {tuple(r.values())[:-1]: r.get('num_clicks') for r in db.fetch(q_.where(*wc_))}
+
+                mismatches.extend(
+                    {'table': table.name, 'url_hash_id': k[0], 'bucket': k[1:],
+                     'expected': expected.get(k, 0), 'actual': actual.get(k, 0)}
+                    for k in sorted(set(expected) | set(actual))
+                    if expected.get(k, 0) != actual.get(k, 0)
+                )
+
+        return mismatches
+
+    def rebuild_counters(self):
+        # Recompute the counters from the raw hits in a single transaction (per shard). Buckets of archived
+        # partitions no longer have raw hits, so they are kept (and the totals are recomputed from the daily counters).
+        for shard in self._shards():
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                since = self._archived_until(db)
+                self._rebuild_rollups(db, self._hot_partitions(db, since), since)
+                self._rebuild_totals(db)
+
+    def _rebuild_rollups(self, db, tables, start=None, end=None):
+        h = self._hits_subquery(tables, start, end)
+        buckets = self._rollup_buckets(h)
+
+        for table, keys, _ in self._rollups():
+            if table is self.SCHEMA.hit_total:
+                continue
+            db.execute(table.delete().where(*self._bucket_range(table, keys, start, end)))
+
+            rc_ = [h.c.url_hash_id] + buckets.get(table.name) + [func.count()]
+            q_ = select(*rc_).where(h.c.url_hash_id.is_not(None))
+            q_ = q_.group_by(h.c.url_hash_id, *buckets.get(table.name))
+            db.execute(table.insert().from_select(keys + ['num_clicks'], q_))
+
+    def _rebuild_totals(self, db):
+        ht = self.SCHEMA.hit_total
+        hd = self.SCHEMA.hit_daily
+
+        db.execute(ht.delete())
+        q_ = select(hd.c.url_hash_id, func.sum(hd.c.num_clicks), literal(datetime.now(), ht.c.date_modified.type))
+        q_ = q_.group_by(hd.c.url_hash_id)
+        db.execute(ht.insert().from_select(['url_hash_id', 'num_clicks', 'date_modified'], q_))
+
+    def compact_hits(self, archive_dir, hot_months=3, batch_size=5000):
+        # Partitions older than the `hot_months` most recent months have their counters recomputed from their
+        # raw hits, which are then exported to `<archive_dir>/<partition>.jsonl.gz` before the table is dropped
+        self.flush_hits()
+        archived = []
+        for shard in self._shards():
+            # Every shard archives its own partitions, under `<archive_dir>/shard_<n>` once sharded
+            archived.extend(self._compact_hits(
+                shard, os.path.join(archive_dir, self._shard_name(shard)), hot_months, batch_size))
+        return archived
+
+    def _compact_hits(self, shard, archive_dir, hot_months, batch_size):
+        cutoff = add_months(month_start(date.today()), 1 - hot_months)
+        archived = []
+
+        with Database(**self._on(shard)) as db:
+            partitions = [t for t in self._hot_partitions(db) if t.name < self.SCHEMA.hit_month(cutoff).name]
+
+        os.makedirs(archive_dir, exist_ok=True)
+        for table in partitions:
+            month = date(int(table.name[4:8]), int(table.name[9:11]), 1)
+            path = os.path.join(archive_dir, f"{table.name}.jsonl.gz")
+
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                num_rows = 0
+                rc_ = [table.c.id, table.c.url_hash_id, table.c.ip_address, table.c.user_agent_id, table.c.date_created]
+
+                # Archives are self-contained, with the addresses and user agents spelled out
+                with gzip.open(path, 'wt', encoding='utf-8') as f:
+                    last_id = 0
+                    while True:
+                        q_ = select(*rc_).where(table.c.id > last_id)
+                        rows = db.fetch(q_.order_by(table.c.id).limit(batch_size))
+                        if not rows:
+                            break
+                        user_agents = self._user_agent_texts(r.get('user_agent_id') for r in rows)
+                        for row in rows:
+                            row = dict(row, ip_address=unpack_ip(row.get('ip_address')))
+                            row['user_agent'] = user_agents.get(row.pop('user_agent_id'))
+                            f.write(json.dumps(row, default=str) + '\n')
+                        num_rows += len(rows)
+                        last_id = rows[-1].get('id')
+
+                self._rebuild_rollups(db, [table], month, add_months(month, 1))
+
+                hp = self.SCHEMA.hit_partition
+                db.execute(hp.update().where(hp.c.name == table.name).values(
+                    num_rows=num_rows, archive_path=path, date_archived=datetime.now()))
+                db.drop(table)
+
+            PARTITIONS.get(shard or self._database_name(), set()).discard(month)
+            archived.append({'partition': table.name, 'num_rows': num_rows, 'archive_path': path})
+
+        if archived:
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                self._rebuild_totals(db)
+
+        return archived
+
+    def purge_hits(self, db, url_hash_ids):
+        # Called by `UrlEngine.purge_deleted` within the transaction purging these Short URLs (on their database):
+        # their hits are moved to `hit_purged` and their counters dropped
+        hp = self.SCHEMA.hit_purged
+        for table in self._hot_partitions(db):
+            rc_ = [table.c.url_hash_id, table.c.ip_address, table.c.user_agent_id, table.c.date_created]
+            q_ = select(*rc_).where(table.c.url_hash_id.in_(url_hash_ids)).order_by(table.c.id)
+            db.execute(hp.insert().from_select([c.name for c in rc_], q_))
+            db.execute(table.delete().where(table.c.url_hash_id.in_(url_hash_ids)))
+
+        for table, _, _ in self._rollups():
+            db.execute(table.delete().where(table.c.url_hash_id.in_(url_hash_ids)))
+
+    def move_hits(self, source, target, ids):
+        # Moves the raw hits and counters of Short URLs rebalanced from `source` to `target`, where `ids` maps their
+        # old ids to their new ones. Partitions and counters are copied before being deleted from the source, and
+        # counters are added as increments, so the target may already have some.
+        self.flush_hits()
+        old_ids = list(ids.keys())
+
+        with Database(**self._on(source)) as db:
+            partitions = self._hot_partitions(db)
+
+        for table in partitions:
+            hits = self._fetch(select(table).where(table.c.url_hash_id.in_(old_ids)).order_by(table.c.id), source)
+            if not hits:
+                continue
+            hits = [{
+                'url_hash_id': ids.get(hit.get('url_hash_id')),
+                'ip_address': hit.get('ip_address'),
+                'user_agent_id': hit.get('user_agent_id'),
+                'date_created': hit.get('date_created')
+            } for hit in hits]
+            queries = self._insert_hits_queries(hits, target)
+            with Database(**self._on(target, is_transaction=True)) as db:
+                for q_, params in queries:
+                    db.execute(q_, params)
+            with Database(**self._on(source)) as db:
+                db.execute(table.delete().where(table.c.url_hash_id.in_(old_ids)))
+
+        for table, keys, _ in self._rollups():
+            rows = self._fetch(select(table).where(table.c.url_hash_id.in_(old_ids)), source)
+            if not rows:
+                continue
+            rows = [dict(row, url_hash_id=ids.get(row.get('url_hash_id'))) for row in rows]
+            with Database(**self._on(target)) as db:
+                db.execute(self._increment_query(table, keys), rows)
+            with Database(**self._on(source)) as db:
+                db.execute(table.delete().where(table.c.url_hash_id.in_(old_ids)))
+
+    def warm_up(self, limit=1000, days=7):
+        # Does what the first requests of a worker would otherwise do: creates this month's partition (so the first
+        # hit doesn't wait on DDL), caches the ids of the `limit` user agents with the most clicks over the last
+        # `days` days, runs the statistics lookup once and builds the statements recording hits. Returns the
+        # number of user agents loaded.
+        month = month_start(date.today())
+        for shard in self._shards():
+            self._ensure_partitions([month], shard)
+        self._statement(f"hit_{month:%Y_%m}.insert", self.SCHEMA.hit_month(month).insert)
+        for table, keys, _ in self._rollups():
+            self._statement(f"{table.name}.increment", lambda: self._increment_query(table, keys))
+        self._insert_user_agent_query()
+
+        hat = self.SCHEMA.hit_agent_daily
+        num_clicks = func.sum(hat.c.num_clicks).label('num_clicks')
+        wc_ = [hat.c.day >= date.today() - timedelta(days=days), hat.c.user_agent_id != 0]
+        q_ = select(hat.c.user_agent_id, num_clicks).where(and_(*wc_)).group_by(hat.c.user_agent_id)
+        q_ = q_.order_by(num_clicks.desc()).limit(limit)
+
+        top = Counter()
+        for shard in self._shards():
+            with Database(**self._reader(shard=shard)) as db:
+                for r in db.fetch(q_):
+                    top[r.get('user_agent_id')] += r.get('num_clicks')
+                db.get(self._get_statistics_query(), {'b_hash_key': ''})
+
+        user_agents = self._user_agent_texts(user_agent_id for user_agent_id, _ in top.most_common(limit))
+        for user_agent_id, user_agent in user_agents.items():
+            self.USER_AGENTS.set(user_agent, {'id': user_agent_id})
+
+        return len(user_agents)
+
+    @timed('engine')
+    def record_hit(self, hit):
+        # Queue the hit for a batched write when buffering is enabled
+        if self.RECORDER:
+            self.RECORDER.record(hit)
+        else:
+            self.create_hit(hit)
+
+    def flush_hits(self, max_lag=None):
+        # Writes the buffered hits, unless the oldest of them was queued less than `max_lag` seconds ago
+        if self.RECORDER and (max_lag is None or self.RECORDER.lag() > max_lag):
+            self.RECORDER.flush()
+
+    def _flush_for_read(self):
+        # Reads only wait for the buffer once it is `HIT_READ_MAX_LAG` seconds behind, rather than contending with the
+        # recorder for the write lock on every request. Without it, buffered hits are always counted.
+        self.flush_hits(self._config('HIT_READ_MAX_LAG'))
+
+    @timed('engine')
     def get_statistics(self, hash_key):
-        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
-            uh = self.SCHEMA.url_hash.alias('uh')
-            u = self.SCHEMA.url.alias('u')
-            h = self.SCHEMA.hit.alias('h')
+        # Buffered hits are counted, up to `HIT_READ_MAX_LAG`
+        self._flush_for_read()
+
+        # The Short URL, its destination and its totals live on its shard (or the shard it is being moved from)
+        for shard in self._owners(hash_key):
+            with Database(**self._reader(hash_key, shard)) as db:
+                statistics = db.get(self._get_statistics_query(), {'b_hash_key': hash_key})
+            if statistics:
+                return statistics
+        return None
+
+    def _get_statistics_query(self):
+        return self._statement('hit.get_statistics', self._build_get_statistics_query)
+
+    def _build_get_statistics_query(self):
+        uh = self.SCHEMA.url_hash.alias('uh')
+        u = self.SCHEMA.url.alias('u')
+        ht = self.SCHEMA.hit_total.alias('ht')
+
+        rc_ = [uh, u.c.url, func.coalesce(ht.c.num_clicks, 0).label('num_clicks'),
+               ht.c.date_modified.label('date_last_clicked')]
+        wc_ = [uh.c.hash_key == bindparam('b_hash_key')]
+
+        js_ = uh
+        js_ = js_.join(u, uh.c.url_id == u.c.id)
+        js_ = js_.outerjoin(ht, uh.c.id == ht.c.url_hash_id)
+
+        return select(*rc_).select_from(js_).where(and_(*wc_))
+
+    @timed('engine')
+    def get_hits(self, url_hash_id, start, end, limit=100):
+        # The most recent raw hits between two timestamps, only reading the partitions of those months
+        self._flush_for_read()
+
+        with Database(**self._reader(shard=self._shard_of_id(url_hash_id))) as db:
+            h = self._hits_subquery(self._hot_partitions(db, start, end), start, end)
+
+            rc_ = [h.c.ip_address, h.c.user_agent_id, h.c.date_created]
+
+            q_ = select(*rc_).where(h.c.url_hash_id == url_hash_id)
+            q_ = q_.order_by(h.c.date_created.desc()).limit(limit)
+
+            hits = db.fetch(q_)
+
+        user_agents = self._user_agent_texts(hit.get('user_agent_id') for hit in hits)
+        return [{
+            'ip_address': unpack_ip(hit.get('ip_address')),
+            'user_agent': user_agents.get(hit.get('user_agent_id')),
+            'date_created': hit.get('date_created')
+        } for hit in hits]
+
+    def count_hits(self):
+        # Raw hits that haven't been archived
+        count = 0
+        for shard in self._shards():
+            with Database(**self._on(shard)) as db:
+                h = self._hits_subquery(self._hot_partitions(db))
+                count += db.scalar(select(func.count()).select_from(h))
+        return count
+
+    @timed('engine')
+    def get_clicks(self, url_hash_id, start, end, bucket='day'):
+        # Clicks per hour or day bucket between two timestamps (inclusive)
+        self._flush_for_read()
+
+        with Database(**self._reader(shard=self._shard_of_id(url_hash_id))) as db:
+            if bucket == 'hour':
+                t = self.SCHEMA.hit_hourly
+                b = t.c.hour
+                start = start.replace(minute=0, second=0, microsecond=0)
+            else:
+                t = self.SCHEMA.hit_daily
+                b = t.c.day
+                start, end = start.date(), end.date()
+
+            rc_ = [b.label('bucket'), t.c.num_clicks]
+            wc_ = [t.c.url_hash_id == url_hash_id, b >= start, b <= end]
+
+            q_ = select(*rc_).where(and_(*wc_)).order_by(b)
+
+            return db.fetch(q_)
+
+    @timed('engine')
+    def get_top_user_agents(self, url_hash_id, start, end, limit=10):
+        # Ranked by the interned id, the (few) winners are then resolved to their text
+        with Database(**self._reader(shard=self._shard_of_id(url_hash_id))) as db:
+            top = db.fetch(self._get_top(self.SCHEMA.hit_agent_daily, 'user_agent_id', url_hash_id, start, end, limit))
+
+        user_agents = self._user_agent_texts(r.get('user_agent_id') for r in top)
+        return [{
+            'user_agent': user_agents.get(r.get('user_agent_id'), ''),
+            'num_clicks': r.get('num_clicks')
+        } for r in top]
+
+    @timed('engine')
+    def get_top_ip_addresses(self, url_hash_id, start, end, limit=10):
+        with Database(**self._reader(shard=self._shard_of_id(url_hash_id))) as db:
+            top = db.fetch(self._get_top(self.SCHEMA.hit_ip_daily, 'ip_address', url_hash_id, start, end, limit))
+        return [dict(r, ip_address=unpack_ip(r.get('ip_address')) or '') for r in top]
 
-            rc_ = [uh, u.c.url, func.count(h.c.id.distinct()).label('num_clicks')]
-            wc_ = [uh.c.hash_key == hash_key]
+    def _get_top(self, t, column, url_hash_id, start, end, limit):
+        self._flush_for_read()
 
-            js_ = uh
-            js_ = js_.join(u, uh.c.url_id == u.c.id)
-            js_ = js_.outerjoin(h, uh.c.id == h.c.url_hash_id)
+        num_clicks = func.sum(t.c.num_clicks).label('num_clicks')
 
-            q_ = select(*rc_).select_from(js_).where(and_(*wc_))
+        rc_ = [t.c[column], num_clicks]
+        wc_ = [t.c.url_hash_id == url_hash_id, t.c.day >= start.date(), t.c.day <= end.date()]
 
-            return db.get(q_)
+        return select(*rc_).where(and_(*wc_)).group_by(t.c[column]).order_by(num_clicks.desc()).limit(limit)
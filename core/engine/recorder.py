@@ -0,0 +1,210 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+
+
+logger = logging.getLogger(__name__)
+
+
+class HitRecorder:
+
+    def __init__(self, engine, batch_size=500, flush_interval=0.5, max_queue=10000, put_timeout=0.05,
+                 max_retries=5, retry_backoff=0.05):
+        # `engine` is the HitEngine used to write each batch with `create_hits`
+        self.ENGINE = engine
+        self.BATCH_SIZE = batch_size
+        self.FLUSH_INTERVAL = flush_interval
+        self.PUT_TIMEOUT = put_timeout
+        # Transient failures (ie: `database is locked`) are retried, doubling the wait each time
+        self.MAX_RETRIES = max_retries
+        self.RETRY_BACKOFF = retry_backoff
+
+        self.QUEUE = queue.Queue(maxsize=max_queue)
+        self.READY = threading.Event()
+        self.STOP = threading.Event()
+        # Items are only ever taken off the queue while holding this lock, so a flush sees every pending hit
+        self.FLUSH_LOCK = threading.Lock()
+        self.STATS_LOCK = threading.Lock()
+        self.WORKER = None
+
+        self.ENQUEUED = 0
+        self.WRITTEN = 0
+        self.DROPPED = 0
+        self.WRITE_THROUGHS = 0
+        self.RETRIES = 0
+        self.BATCHES = 0
+        self.MAX_DEPTH = 0
+        self.FLUSH_LAST = 0.0
+        self.FLUSH_TOTAL = 0.0
+        self.FLUSH_MAX = 0.0
+        # When the oldest hit not yet written was queued, None while the queue is empty
+        self.PENDING_SINCE = None
+
+    def start(self):
+        if self.WORKER is None:
+            self.WORKER = threading.Thread(target=self._run, name='hit-recorder', daemon=True)
+            self.WORKER.start()
+            atexit.register(self.close)
+        return self
+
+    def record(self, hit):
+        try:
+            self.QUEUE.put(hit, timeout=self.PUT_TIMEOUT)
+        except queue.Full:
+            # Backpressure: the worker can't keep up, so the caller pays for its own write
+            with self.STATS_LOCK:
+                self.WRITE_THROUGHS += 1
+            self._write([hit])
+            return
+
+        self._enqueued()
+
+    def try_record(self, hit):
+        # Non-blocking version of `record` for callers (ie: an event loop) that write through themselves when full
+        try:
+            self.QUEUE.put_nowait(hit)
+        except queue.Full:
+            with self.STATS_LOCK:
+                self.WRITE_THROUGHS += 1
+            return False
+
+        self._enqueued()
+        return True
+
+    def _enqueued(self):
+        depth = self.QUEUE.qsize()
+        with self.STATS_LOCK:
+            self.ENQUEUED += 1
+            self.MAX_DEPTH = max(self.MAX_DEPTH, depth)
+            if self.PENDING_SINCE is None:
+                self.PENDING_SINCE = time.monotonic()
+        if depth >= self.BATCH_SIZE:
+            self.READY.set()
+
+    def flush(self):
+        with self.FLUSH_LOCK:
+            while True:
+                drained = time.monotonic()
+                batch = self._drain()
+                if not batch:
+                    break
+                self._write(batch)
+
+            # Hits queued since the last drain are at most that old
+            with self.STATS_LOCK:
+                self.PENDING_SINCE = None if self.QUEUE.empty() else drained
+
+    def lag(self):
+        # Seconds since the oldest hit not yet written was queued, ie: how far behind reads of the counters may be
+        since = self.PENDING_SINCE
+        return 0.0 if since is None else time.monotonic() - since
+
+    def close(self):
+        self.STOP.set()
+        self.READY.set()
+        if self.WORKER is not None and self.WORKER is not threading.current_thread():
+            self.WORKER.join()
+        # Guarantee that nothing left in the queue is lost on shutdown
+        self.flush()
+
+    def stats(self):
+        with self.STATS_LOCK:
+            return {
+                'queue_depth': self.QUEUE.qsize(),
+                'lag': self.lag(),
+                'max_queue_depth': self.MAX_DEPTH,
+                'enqueued': self.ENQUEUED,
+                'written': self.WRITTEN,
+                'dropped': self.DROPPED,
+                'write_throughs': self.WRITE_THROUGHS,
+                'retries': self.RETRIES,
+                'batches': self.BATCHES,
+                'flush_last': self.FLUSH_LAST,
+                'flush_max': self.FLUSH_MAX,
+                'flush_avg': self.FLUSH_TOTAL / self.BATCHES if self.BATCHES else 0.0
+            }
+
+    def _run(self):
+        while not self.STOP.is_set():
+            # Flush once the batch size is reached or the interval elapses, whichever comes first
+            self.READY.wait(self.FLUSH_INTERVAL)
+            self.READY.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Unable to flush recorded hits')
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.BATCH_SIZE:
+            try:
+                batch.append(self.QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                self.ENGINE.create_hits(batch)
+                break
+            except OperationalError:
+                if attempt >= self.MAX_RETRIES:
+                    logger.exception(f"Unable to write {len(batch)} recorded hits after {attempt + 1} attempts")
+                    with self.STATS_LOCK:
+                        self.DROPPED += len(batch)
+                    return
+                with self.STATS_LOCK:
+                    self.RETRIES += 1
+                time.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+                attempt += 1
+            except Exception:
+                # Anything else (ie: a malformed hit) would fail again, so don't hold up the queue retrying it
+                logger.exception(f"Unable to write {len(batch)} recorded hits")
+                with self.STATS_LOCK:
+                    self.DROPPED += len(batch)
+                return
+        elapsed = time.perf_counter() - start
+
+        with self.STATS_LOCK:
+            self.WRITTEN += len(batch)
+            self.BATCHES += 1
+            self.FLUSH_LAST = elapsed
+            self.FLUSH_TOTAL += elapsed
+            self.FLUSH_MAX = max(self.FLUSH_MAX, elapsed)
+
+
+class RecorderRegistry:
+
+    def __init__(self):
+        self.RECORDERS = {}
+        self.LOCK = threading.Lock()
+
+    def get(self, name, engine, **options):
+        # One background recorder per database, the options only apply on creation
+        recorder = self.RECORDERS.get(name)
+        if recorder is None:
+            with self.LOCK:
+                recorder = self.RECORDERS.get(name)
+                if recorder is None:
+                    options = {k: v for k, v in options.items() if v is not None}
+                    recorder = HitRecorder(engine, **options).start()
+                    self.RECORDERS[name] = recorder
+        return recorder
+
+    def stats(self):
+        return {name: recorder.stats() for name, recorder in list(self.RECORDERS.items())}
+
+    def close(self):
+        with self.LOCK:
+            for recorder in self.RECORDERS.values():
+                recorder.close()
+            self.RECORDERS.clear()
+
+
+RECORDERS = RecorderRegistry()
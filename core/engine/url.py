@@ -1,7 +1,62 @@
-from datetime import datetime
-from sqlalchemy import select, and_
+from datetime import datetime, timedelta
+import hashlib
+import json
+import time
+from urllib.parse import urlsplit, urlunsplit
+import zlib
+from sqlalchemy import select, and_, bindparam, func, inspect, literal
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from core.cache import CACHES, FILTERS
 from core.engine.base import BaseEngine
-from core.db import Database, Schema
+from core.db import Database, Schema, SHARD_SLOTS
+from core.timing import timed
+
+
+# `key_sequence` entry bumped whenever a row that may be cached by another process changes
+CACHE_GENERATION = 'url_cache_generation'
+# `key_sequence` entry holding the signature of the normalization the stored `url_digest`s were computed with
+DIGEST_NORMALIZATION = 'url_digest_normalization'
+
+# Deletes made by other processes are found by their `date_modified`, looked up again for this long to allow for
+# clocks and commits running a little behind
+DELETE_SYNC_OVERLAP = timedelta(seconds=5)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# `url_hash` columns added after its first release, left out of inserts until `migrate_tables` has run
+ADDED_COLUMNS = {'is_custom', 'is_permanent'}
+
+
+def normalize_url(long_url, lowercase=False, default_ports=False, trailing_slash=False):
+    # Equivalent spellings of a Long URL mapped to one form: the scheme and host lower-cased, the scheme's default
+    # port dropped and trailing slashes stripped from the path. The query and fragment are kept as they are.
+    if not (lowercase or default_ports or trailing_slash):
+        return long_url
+    try:
+        parts = urlsplit(long_url)
+        port = parts.port
+    except ValueError:
+        return long_url
+
+    scheme = parts.scheme.lower() if lowercase else parts.scheme
+    netloc = parts.netloc
+    if parts.hostname is not None:
+        userinfo, at, host = netloc.rpartition('@')
+        if port is not None:
+            host = host.rsplit(':', 1)[0]
+        if lowercase:
+            host = host.lower()
+        if port is not None and not (default_ports and DEFAULT_PORTS.get(scheme.lower()) == port):
+            host = f"{host}:{port}"
+        netloc = f"{userinfo}{at}{host}"
+    path = parts.path.rstrip('/') if trailing_slash else parts.path
+
+    return urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+
+class HashKeyConflict(Exception):
+    # The hash_key is already used by another Short URL
+    pass
 
 
 class UrlEngine(BaseEngine):
@@ -9,64 +64,770 @@ class UrlEngine(BaseEngine):
         super(UrlEngine, self).__init__(**kwargs)
 
         self.SCHEMA = Schema()
+        self.CACHE = CACHES.get(
+            self._database_name(),
+            max_size=self._config('URL_CACHE_SIZE'),
+            ttl=self._config('URL_CACHE_TTL'),
+            negative_ttl=self._config('URL_CACHE_NEGATIVE_TTL'),
+            sync_interval=self._config('URL_CACHE_SYNC_INTERVAL')
+        )
+        # The generated hash_key of each `url` id, for creates that return an existing Short URL
+        self.GENERATED = CACHES.get(
+            f"{self._database_name()}#generated",
+            max_size=self._config('URL_CACHE_SIZE'),
+            ttl=self._config('URL_CACHE_TTL'),
+            negative_ttl=0,
+            sync_interval=self._config('URL_CACHE_SYNC_INTERVAL')
+        )
+        # Answers lookups of hash_keys that were never created without a query
+        self.FILTER = FILTERS.get(
+            self._database_name(),
+            capacity=self._config('HASH_KEY_FILTER_CAPACITY'),
+            error_rate=self._config('HASH_KEY_FILTER_ERROR_RATE'),
+            path=self._config('HASH_KEY_FILTER_PATH'),
+            sync_interval=self._config('HASH_KEY_FILTER_SYNC_INTERVAL'),
+            sync_overlap=self._config('HASH_KEY_FILTER_SYNC_OVERLAP')
+        ) if self._config('HASH_KEY_FILTER_ENABLED', False) else None
+        self.UNIQUE_HASH_KEYS = {}
+        self.URL_HASH_COLUMNS = {}
+        # `URL_NORMALIZATION` options of `normalize_url`, applied before Long URLs are digested
+        self.NORMALIZATION = self._config('URL_NORMALIZATION') or {}
 
     def create_tables(self):
-        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+        # Shards hold their Short URLs with a copy of the `url` rows they refer to, and their own `key_sequence`
+        for shard in self._databases():
+            with Database(**self._on(shard)) as db:
+                u = self.SCHEMA.url
+                uh = self.SCHEMA.url_hash
+                ks = self.SCHEMA.key_sequence
+
+                db.create(u)
+                db.create(uh)
+                db.create(ks)
+                db.create(self.SCHEMA.url_hash_purged)
+                if shard is None:
+                    db.create(self.SCHEMA.idempotency_key)
+
+    def migrate_tables(self, batch_size=1000):
+        resolved = {'merged_urls': 0, 'rekeyed_hash_keys': []}
+        for shard in self._databases():
+            migrated = self._migrate_tables(shard, batch_size)
+            resolved['merged_urls'] += migrated.get('merged_urls')
+            resolved['rekeyed_hash_keys'].extend(migrated.get('rekeyed_hash_keys'))
+        return resolved
+
+    def _migrate_tables(self, shard, batch_size):
+        with Database(**self._on(shard)) as db:
             u = self.SCHEMA.url
             uh = self.SCHEMA.url_hash
+            ks = self.SCHEMA.key_sequence
 
-            db.create(u)
-            db.create(uh)
+            db.add_column(u, u.c.url_digest)
+            db.add_column(uh, uh.c.is_custom)
+            db.add_column(uh, uh.c.is_permanent)
+            db.create(ks)
+            db.create(self.SCHEMA.url_hash_purged)
+            if shard is None:
+                db.create(self.SCHEMA.idempotency_key)
 
-    def create_url(self, long_url):
-        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+            # Digests computed with another normalization are recomputed (and the URLs now equivalent are merged)
+            signature = self._normalization_signature()
+            if (db.scalar(select(ks.c.next_value).where(ks.c.name == DIGEST_NORMALIZATION)) or 0) != signature:
+                for index in u.indexes:
+                    db.drop_index(index)
+                db.execute(u.update().values(url_digest=None))
+
+            # Backfill the digest for any rows created before the column existed
+            q_ = u.update().where(u.c.id == bindparam('b_id')).values(url_digest=bindparam('b_digest'))
+            while True:
+                rows = db.fetch(select(u.c.id, u.c.url).where(u.c.url_digest.is_(None)).limit(batch_size))
+                if not rows:
+                    break
+                db.execute(q_, [{'b_id': r.get('id'), 'b_digest': self._digest(r.get('url'))} for r in rows])
+
+        # The unique indexes can't be created over the duplicates older versions could insert concurrently
+        resolved = self._resolve_duplicates(shard)
+
+        with Database(**self._on(shard)) as db:
+            for index in list(u.indexes) + list(uh.indexes):
+                db.create_index(index)
+            db.execute(insert(ks).values(name=DIGEST_NORMALIZATION, next_value=signature).on_conflict_do_update(
+                index_elements=[ks.c.name], set_={'next_value': signature}))
+
+        return resolved
+
+    def _resolve_duplicates(self, shard=None):
+        # Duplicate `url` rows are merged into the oldest, while duplicate hash_keys keep the row that currently
+        # resolves (the oldest live one) and the others are re-keyed so they remain reachable
+        resolved = {'merged_urls': 0, 'rekeyed_hash_keys': []}
+
+        with Database(**self._on(shard, is_transaction=True)) as db:
             u = self.SCHEMA.url
+            uh = self.SCHEMA.url_hash
+
+            q_ = select(u.c.url_digest).where(u.c.url_digest.is_not(None))
+            q_ = q_.group_by(u.c.url_digest).having(func.count() > 1)
+            for digest in [r.get('url_digest') for r in db.fetch(q_)]:
+                ids = [r.get('id') for r in db.fetch(select(u.c.id).where(u.c.url_digest == digest).order_by(u.c.id))]
+                keep, duplicates = ids[0], ids[1:]
+
+                db.execute(uh.update().where(uh.c.url_id.in_(duplicates)).values(url_id=keep))
+                db.execute(u.delete().where(u.c.id.in_(duplicates)))
+                resolved['merged_urls'] += len(duplicates)
 
-            # See if this url already exists
-            wc_ = [u.c.url == long_url]
+            q_ = select(uh.c.hash_key).group_by(uh.c.hash_key).having(func.count() > 1)
+            for hash_key in [r.get('hash_key') for r in db.fetch(q_)]:
+                q_ = select(uh.c.id).where(uh.c.hash_key == hash_key).order_by(uh.c.is_deleted, uh.c.id)
+                ids = [r.get('id') for r in db.fetch(q_)]
 
-            q_ = u.select().where(and_(*wc_))
-            url = db.get(q_)
+                for url_hash_id in ids[1:]:
+                    new_key = f"{hash_key}-{url_hash_id}"
+                    if db.get(select(uh.c.id).where(uh.c.hash_key == new_key)):
+                        raise Exception(f"Unable to re-key the duplicate Short URL '{hash_key}' ({url_hash_id}).")
+
+                    db.execute(uh.update().where(uh.c.id == url_hash_id).values(
+                        hash_key=new_key, date_modified=datetime.now()))
+                    resolved['rekeyed_hash_keys'].append((hash_key, new_key))
+
+        return resolved
+
+    @timed('engine')
+    def create_url(self, long_url):
+        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+            # Insert the url unless an equivalent one already exists, which is then looked up by its digest
+            digest = self._digest(long_url)
+            url = {
+                'url': long_url,
+                'url_digest': digest,
+                'date_created': datetime.now()
+            }
+            url = db.get(self._statement('url.upsert', self._upsert_url_query), url)
             if url:
                 return url.get('id')
-            else:
-                url = {
-                    'url': long_url,
-                    'date_created': datetime.now()
-                }
-                q_ = u.insert().values(url)
-                return db.execute(q_)
 
+            return db.get(self._get_url_by_digest_query(), {'b_digest': digest}).get('id')
+
+    def _upsert_url_query(self):
+        u = self.SCHEMA.url
+        return insert(u).on_conflict_do_nothing().returning(u.c.id)
+
+    def _get_url_by_digest_query(self):
+        u = self.SCHEMA.url
+        return self._statement('url.get_by_digest', lambda: select(u.c.id).where(u.c.url_digest == bindparam('b_digest')))
+
+    def _digest(self, long_url):
+        return hashlib.sha256(normalize_url(long_url, **self.NORMALIZATION).encode('utf-8')).hexdigest()
+
+    def _normalization_signature(self):
+        # 0 without normalization, so databases digested before it existed are left as they are
+        options = {k: v for k, v in self.NORMALIZATION.items() if v}
+        return zlib.crc32(json.dumps(options, sort_keys=True).encode('utf-8')) if options else 0
+
+    def has_unique_hash_keys(self, shard=None):
+        # Whether `ix_url_hash_hash_key` exists yet, databases that haven't been migrated by `setup.py` lack it
+        if not self.UNIQUE_HASH_KEYS.get(shard):
+            with Database(**self._on(shard)) as db:
+                self.UNIQUE_HASH_KEYS[shard] = any(
+                    i.get('unique') and i.get('column_names') == ['hash_key']
+                    for i in inspect(db.CURSOR).get_indexes(self.SCHEMA.url_hash.name))
+        return self.UNIQUE_HASH_KEYS.get(shard)
+
+    def _url_hash_columns(self, shard=None):
+        # The `url_hash` columns that exist yet, until `ADDED_COLUMNS` do every Short URL is created without them
+        if not ADDED_COLUMNS <= self.URL_HASH_COLUMNS.get(shard, set()):
+            with Database(**self._on(shard)) as db:
+                self.URL_HASH_COLUMNS[shard] = {
+                    c.get('name') for c in inspect(db.CURSOR).get_columns(self.SCHEMA.url_hash.name)}
+        return self.URL_HASH_COLUMNS.get(shard)
+
+    def _insertable(self, shard, url_hashes):
+        columns = self._url_hash_columns(shard)
+        if ADDED_COLUMNS <= columns:
+            return url_hashes
+        return [{k: v for k, v in url_hash.items() if k in columns} for url_hash in url_hashes]
+
+    def _taken(self, shard, hash_keys):
+        # The hash_keys already used in a shard, only those the filter can't rule out are looked up
+        hash_keys = [hash_key for hash_key in hash_keys if not self._definitely_missing(hash_key)]
+        if not hash_keys:
+            return set()
+
+        uh = self.SCHEMA.url_hash
+        with Database(**self._on(shard)) as db:
+            return {r.get('hash_key') for r in db.fetch(select(uh.c.hash_key).where(uh.c.hash_key.in_(hash_keys)))}
+
+    def _place(self, shard, url_hashes):
+        # Prepares Short URLs for their shard: the `url` rows they refer to are copied over from the primary (where
+        # Long URLs are deduplicated), and their ids are reserved from the shard's sequence with the shard encoded
+        u = self.SCHEMA.url
+        url_ids = list({url_hash.get('url_id') for url_hash in url_hashes})
+
+        with Database(**self._on(None)) as db:
+            urls = db.fetch(select(u).where(u.c.id.in_(url_ids)))
+        with Database(**self._on(shard)) as db:
+            if urls:
+                db.execute(insert(u).on_conflict_do_nothing(), urls)
+            end = self._reserve(db, 'url_hash_id', len(url_hashes))
+
+        start = end - len(url_hashes) + 1
+        return [dict(url_hash, id=self.SHARDS.encode_id(shard, start + i)) for i, url_hash in enumerate(url_hashes)]
+
+    @staticmethod
+    def _is_hash_key_conflict(e):
+        message = str(e.orig).lower()
+        return 'unique' in message and 'hash_key' in message
+
+    @timed('engine')
     def create_url_hash(self, url_hash):
-        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+        shard, *previous = self._owners(url_hash.get('hash_key'))
+
+        # Until a rebalance has completed, the hash_key may still be used on the shard that owned it before
+        for other in previous:
+            if self._taken(other, [url_hash.get('hash_key')]):
+                raise HashKeyConflict(url_hash.get('hash_key'))
+        if shard:
+            url_hash = self._place(shard, [url_hash])[0]
+
+        with Database(**self._on(shard)) as db:
             uh = self.SCHEMA.url_hash
 
-            q_ = uh.insert().values(url_hash)
+            # Without the unique index, fall back to probing for the hash_key first
+            if not self.has_unique_hash_keys(shard):
+                if db.get(select(uh.c.id).where(uh.c.hash_key == url_hash.get('hash_key'))):
+                    raise HashKeyConflict(url_hash.get('hash_key'))
 
-            return db.execute(q_)
+            try:
+                url_hash_id = db.execute(
+                    self._statement('url_hash.insert', uh.insert), self._insertable(shard, [url_hash])[0])
+            except IntegrityError as e:
+                if self._is_hash_key_conflict(e):
+                    raise HashKeyConflict(url_hash.get('hash_key')) from e
+                raise
+        # Drop any cached miss for this hash_key
+        self.CACHE.invalidate(url_hash.get('hash_key'))
+        if self.FILTER:
+            self.FILTER.add([url_hash.get('hash_key')])
+        if not url_hash.get('is_custom') and not url_hash.get('is_permanent'):
+            self.GENERATED.set(url_hash.get('url_id'), {'hash_key': url_hash.get('hash_key')})
+        self._wrote(url_hash.get('hash_key'))
 
-    def get_url(self, hash_key):
+        return url_hash_id
+
+    @timed('engine')
+    def create_urls(self, long_urls, chunk_size=500):
+        # Batch version of `create_url`, returns a mapping of each long_url to its `url` id
+        url_ids = {}
+        # Equivalent long_urls share a digest, the first one is stored
+        digests = {}
+        for long_url in long_urls:
+            digests.setdefault(self._digest(long_url), long_url)
+        pending = list(digests.keys())
+
+        for i in range(0, len(pending), chunk_size):
+            chunk = pending[i:i + chunk_size]
+            with Database(app=self.APP, conn_string=self.CONN_STRING, is_transaction=True) as db:
+                u = self.SCHEMA.url
+
+                # Insert every url of this chunk, then look up those that already existed with one set-based query
+                now = datetime.now()
+                urls = [{'url': digests.get(digest), 'url_digest': digest, 'date_created': now} for digest in chunk]
+                q_ = insert(u).on_conflict_do_nothing().returning(u.c.id, u.c.url_digest)
+                existing = {r.get('url_digest'): r.get('id') for r in db.fetch(q_, urls)}
+
+                missing = [digest for digest in chunk if digest not in existing]
+                if missing:
+                    q_ = select(u.c.id, u.c.url_digest).where(u.c.url_digest.in_(missing))
+                    existing.update({r.get('url_digest'): r.get('id') for r in db.fetch(q_)})
+
+            url_ids.update(existing)
+
+        return {long_url: url_ids.get(self._digest(long_url)) for long_url in long_urls}
+
+    @timed('engine')
+    def create_url_hashes(self, url_hashes, chunk_size=500):
+        # Batch version of `create_url_hash`, returns the hash_keys that could not be created due to a conflict
+        conflicts = set()
+
+        shards = {}
+        for url_hash in url_hashes:
+            shards.setdefault(self._shard_for(url_hash.get('hash_key')), []).append(url_hash)
+
+        for shard, rows in shards.items():
+            for i in range(0, len(rows), chunk_size):
+                conflicts.update(self._create_url_hashes(shard, rows[i:i + chunk_size]))
+
+        return conflicts
+
+    def _create_url_hashes(self, shard, chunk):
+        conflicts = set()
+        uh = self.SCHEMA.url_hash
+
+        # Until a rebalance has completed, hash_keys may still be used on the shard that owned them before
+        previous = {}
+        for url_hash in chunk:
+            for other in self._owners(url_hash.get('hash_key'))[1:]:
+                previous.setdefault(other, []).append(url_hash.get('hash_key'))
+        for other, hash_keys in previous.items():
+            conflicts.update(self._taken(other, hash_keys))
+        chunk = [r for r in chunk if r.get('hash_key') not in conflicts]
+        if shard and chunk:
+            chunk = self._place(shard, chunk)
+
+        try:
+            with Database(**self._on(shard, is_transaction=True)) as db:
+                if not self.has_unique_hash_keys(shard):
+                    q_ = select(uh.c.hash_key).where(uh.c.hash_key.in_([r.get('hash_key') for r in chunk]))
+                    taken = {r.get('hash_key') for r in db.fetch(q_)}
+                    conflicts.update(taken)
+                    chunk = [r for r in chunk if r.get('hash_key') not in taken]
+
+                if chunk:
+                    db.execute(uh.insert(), self._insertable(shard, chunk))
+        except IntegrityError as e:
+            if not self._is_hash_key_conflict(e):
+                raise
+            # Another writer took one of these keys since they were checked, so insert row by row
+            for url_hash in chunk:
+                try:
+                    self.create_url_hash({k: v for k, v in url_hash.items() if k != 'id'})
+                except HashKeyConflict:
+                    conflicts.add(url_hash.get('hash_key'))
+
+        for url_hash in chunk:
+            self.CACHE.invalidate(url_hash.get('hash_key'))
+            if not url_hash.get('is_custom') and not url_hash.get('is_permanent') \
+                    and url_hash.get('hash_key') not in conflicts:
+                self.GENERATED.set(url_hash.get('url_id'), {'hash_key': url_hash.get('hash_key')})
+        if self.FILTER:
+            self.FILTER.add([url_hash.get('hash_key') for url_hash in chunk])
+        self._wrote(*[url_hash.get('hash_key') for url_hash in chunk])
+
+        return conflicts
+
+    @timed('engine')
+    def get_generated_hash_keys(self, url_ids):
+        # The live generated hash_key of each `url` id that has one (the oldest, if several were generated), so
+        # repeated creates of a Long URL can return it rather than generate another. Short URLs are sharded by
+        # hash_key, so uncached ids are looked up on every shard.
+        if not url_ids:
+            return {}
+        if self.GENERATED.needs_sync():
+            self._sync_caches()
+
+        hash_keys = {}
+        for url_id in set(url_ids):
+            found, entry = self.GENERATED.get(url_id)
+            if found:
+                hash_keys[url_id] = entry.get('hash_key')
+        missing = [url_id for url_id in set(url_ids) if url_id not in hash_keys]
+        if not missing:
+            return hash_keys
+
+        token = self.GENERATED.token()
+        rows = []
+        for shard in self._shards():
+            if not ADDED_COLUMNS <= self._url_hash_columns(shard):
+                continue
+            with Database(**self._reader(shard=shard)) as db:
+                rows.extend(db.fetch(self._get_generated_query(), {'b_url_ids': missing}))
+        for r in sorted(rows, key=lambda r: r.get('id')):
+            if r.get('url_id') not in hash_keys:
+                hash_keys[r.get('url_id')] = r.get('hash_key')
+                self.GENERATED.set(r.get('url_id'), {'hash_key': r.get('hash_key')}, token)
+
+        return hash_keys
+
+    def _get_generated_query(self):
+        uh = self.SCHEMA.url_hash
+        return self._statement('url_hash.get_generated', lambda: select(uh.c.id, uh.c.url_id, uh.c.hash_key).where(and_(
+            uh.c.url_id.in_(bindparam('b_url_ids', expanding=True)), uh.c.is_deleted == 0, uh.c.is_custom == 0,
+            uh.c.is_permanent == 0)))
+
+    @timed('engine')
+    def get_idempotency_keys(self, requests):
+        # The Short URL created for each of `requests`, (`Idempotency-Key`, Long URL) pairs, or None for keys that
+        # weren't used yet. A key that was used with another Long URL is returned with `conflict` set.
+        if not requests:
+            return []
+
+        ik = self.SCHEMA.idempotency_key
+        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+            rows = db.fetch(self._statement('idempotency_key.get', lambda: select(ik).where(
+                ik.c.key.in_(bindparam('b_keys', expanding=True)))), {'b_keys': list({key for key, _ in requests})})
+        rows = {r.get('key'): r for r in rows}
+
+        return [{
+            'hash_key': rows.get(key).get('hash_key'),
+            'conflict': rows.get(key).get('url_digest') != self._digest(long_url)
+        } if key in rows else None for key, long_url in requests]
+
+    @timed('engine')
+    def save_idempotency_keys(self, idempotency_keys):
+        # Each a {`key`, `long_url`, `hash_key`}, a key already saved (by a concurrent retry) keeps its Short URL
+        if not idempotency_keys:
+            return
+
+        ik = self.SCHEMA.idempotency_key
+        now = datetime.now()
         with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
-            uh = self.SCHEMA.url_hash.alias('uh')
-            u = self.SCHEMA.url.alias('u')
+            db.execute(insert(ik).on_conflict_do_nothing(), [{
+                'key': r.get('key'),
+                'url_digest': self._digest(r.get('long_url')),
+                'hash_key': r.get('hash_key'),
+                'date_created': now
+            } for r in idempotency_keys])
+
+    @timed('engine')
+    def reserve_keys(self, name, count):
+        # Atomically reserve `count` values of the named sequence, returning the end of the reserved block
+        with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
+            return self._reserve(db, name, count)
+
+    def _reserve(self, db, name, count):
+        return db.get(self._statement('key_sequence.reserve', self._reserve_keys_query),
+                      {'b_name': name, 'b_count': count}).get('next_value')
+
+    def _reserve_keys_query(self):
+        ks = self.SCHEMA.key_sequence
+        count_ = bindparam('b_count', type_=ks.c.next_value.type)
+
+        q_ = insert(ks).values(name=bindparam('b_name'), next_value=count_)
+        return q_.on_conflict_do_update(
+            index_elements=[ks.c.name], set_={'next_value': ks.c.next_value + count_}).returning(ks.c.next_value)
+
+    @timed('engine')
+    def get_url(self, hash_key):
+        if self.CACHE.needs_sync():
+            self._sync_caches()
+
+        found, url = self.CACHE.get(hash_key)
+        if found:
+            return url
+        if self._definitely_missing(hash_key):
+            return None
+
+        token = self.CACHE.token()
+        url = self._get_url(hash_key)
+        self.CACHE.set(hash_key, url, token)
+        if url is None and self.FILTER:
+            self.FILTER.false_positive()
+
+        return url
+
+    def _get_url(self, hash_key):
+        for shard in self._owners(hash_key):
+            with Database(**self._reader(hash_key, shard)) as db:
+                url = db.get(self._get_url_query(), {'b_hash_key': hash_key})
+            if url:
+                return url
+        return None
+
+    def _get_url_query(self):
+        return self._statement('url.get_url', self._build_get_url_query)
+
+    def _build_get_url_query(self):
+        uh = self.SCHEMA.url_hash.alias('uh')
+        u = self.SCHEMA.url.alias('u')
+
+        rc_ = [uh, u.c.url]
+        # Deleted Short URLs are left to `get_deleted_url`
+        wc_ = [uh.c.hash_key == bindparam('b_hash_key'), uh.c.is_deleted == 0]
+
+        js_ = uh
+        js_ = js_.join(u, uh.c.url_id == u.c.id)
+
+        return select(*rc_).select_from(js_).where(and_(*wc_))
+
+    @timed('engine')
+    def get_deleted_url(self, hash_key):
+        # The tombstone of a deleted Short URL (its `url_hash` row, or the one it was purged with) to tell when it
+        # was deleted, None if it never existed or is live. Not cached, it's only needed to explain a miss.
+        if self._definitely_missing(hash_key):
+            return None
+
+        for shard in self._owners(hash_key):
+            with Database(**self._reader(hash_key, shard)) as db:
+                for q_ in self._get_deleted_url_queries():
+                    url = db.get(q_, {'b_hash_key': hash_key})
+                    if url:
+                        return url
+        return None
+
+    def _get_deleted_url_queries(self):
+        uh = self.SCHEMA.url_hash
+        uhp = self.SCHEMA.url_hash_purged
+        return [
+            self._statement('url_hash.get_deleted', lambda: select(uh).where(and_(
+                uh.c.hash_key == bindparam('b_hash_key'), uh.c.is_deleted == 1))),
+            self._statement('url_hash_purged.get', lambda: select(
+                uhp.c.url_hash_id.label('id'), uhp.c.hash_key, uhp.c.url_id, uhp.c.date_created, uhp.c.date_modified,
+                literal(1).label('is_deleted')).where(
+                uhp.c.hash_key == bindparam('b_hash_key')).order_by(uhp.c.date_purged.desc()).limit(1))
+        ]
+
+    def build_key_filter(self, batch_size=10000, rebuild=True):
+        # Loads the filter persisted at `HASH_KEY_FILTER_PATH` (catching up with newer keys), or builds it by
+        # scanning every `url_hash`, then saves it for the next start. Returns the filter's stats.
+        if self.FILTER is None:
+            return None
+
+        with self.FILTER.BUILD_LOCK:
+            # Another thread may have built it while this one waited
+            if rebuild or not self.FILTER.ready:
+                if self.FILTER.load():
+                    self._sync_key_filter()
+                else:
+                    uh = self.SCHEMA.url_hash
+                    count = 0
+                    for shard in self._databases():
+                        with Database(**self._on(shard)) as db:
+                            count += db.scalar(select(func.count()).select_from(uh))
+                    # Sized with room for as many new keys again when there are more than its capacity
+                    self.FILTER.build([(self._filter_name(shard), self._scan_hash_keys(shard, batch_size))
+                                       for shard in self._databases()], capacity=count * 2)
+                self.FILTER.save()
+
+        return self.FILTER.stats()
+
+    def _scan_hash_keys(self, shard, batch_size):
+        uh = self.SCHEMA.url_hash
+        last_id = 0
+        while True:
+            with Database(**self._on(shard)) as db:
+                q_ = select(uh.c.id, uh.c.hash_key).where(uh.c.id > last_id).order_by(uh.c.id).limit(batch_size)
+                rows = db.fetch(q_)
+            if not rows:
+                break
+            yield from rows
+            last_id = rows[-1].get('id')
 
-            rc_ = [uh, u.c.url]
-            wc_ = [uh.c.hash_key == hash_key]
+    @staticmethod
+    def _filter_name(shard):
+        return shard or 'primary'
 
-            js_ = uh
-            js_ = js_.join(u, uh.c.url_id == u.c.id)
+    def _key_filter_sync_query(self, shard):
+        # Keys created since the last sync (by any process), shard ids being `SHARD_SLOTS` apart
+        uh = self.SCHEMA.url_hash
+        since = self.FILTER.since(self._filter_name(shard), SHARD_SLOTS if shard else 1)
+        return select(uh.c.id, uh.c.hash_key).where(uh.c.id > since)
 
-            q_ = select(*rc_).select_from(js_).where(and_(*wc_))
+    def _sync_key_filter(self):
+        # Always from the primary (or shard), a read database may not have the newest keys yet
+        for shard in self._databases():
+            with Database(**self._on(shard)) as db:
+                rows = db.fetch(self._key_filter_sync_query(shard))
+            self.FILTER.sync(self._filter_name(shard), rows)
 
-            return db.get(q_)
+    def _definitely_missing(self, hash_key):
+        # Whether the filter rules out that `hash_key` exists, building it on first use
+        if self.FILTER is None:
+            return False
+        if not self.FILTER.ready:
+            self.build_key_filter(rebuild=False)
+        elif self.FILTER.needs_sync():
+            self._sync_key_filter()
+        return not self.FILTER.might_contain(hash_key)
 
+    def _get_cache_generation_query(self):
+        ks = self.SCHEMA.key_sequence
+        return self._statement('key_sequence.cache_generation', lambda: select(ks.c.next_value).where(
+            ks.c.name == CACHE_GENERATION))
+
+    @timed('engine')
     def delete_url(self, hash_key):
+        q_ = self._delete_url_query()
+
+        deleted = None
+        for shard in self._owners(hash_key):
+            with Database(**self._on(shard)) as db:
+                deleted = db.get(q_, {'b_hash_key': hash_key, 'b_date_modified': datetime.now()})
+            if deleted:
+                break
+        # Other processes drop their cached copies on their next sync, when they find the delete (see `_sync_caches`)
+        self.CACHE.invalidate(hash_key)
+        if deleted:
+            self.GENERATED.invalidate(deleted.get('url_id'))
+        self._wrote(hash_key)
+
+        return deleted
+
+    def _delete_url_query(self):
+        uh = self.SCHEMA.url_hash
+        return self._statement('url_hash.delete', lambda: uh.update().values(
+            is_deleted=1, date_modified=bindparam('b_date_modified')).where(
+            uh.c.hash_key == bindparam('b_hash_key')).returning(uh.c.id, uh.c.url_id))
+
+    def _sync_caches(self):
+        # Picks up what other processes changed: a new generation (ie: after a rebalance) clears the caches, while
+        # Short URLs deleted since the last sync are only dropped from them
+        now = datetime.now()
+        since = self.CACHE.changes_since(DELETE_SYNC_OVERLAP)
+        with Database(**self._reader()) as db:
+            generation = db.scalar(self._get_cache_generation_query()) or 0
+        deleted = []
+        if since is not None:
+            for shard in self._shards():
+                with Database(**self._reader(shard=shard)) as db:
+                    deleted.extend(db.fetch(self._get_deleted_since_query(), {'b_since': since}))
+
+        self.CACHE.sync(generation)
+        self.GENERATED.sync(generation)
+        dropped = set(self.CACHE.sync_changes([(r.get('hash_key'), r.get('date_modified')) for r in deleted], now))
+        for r in deleted:
+            if r.get('hash_key') in dropped:
+                self.GENERATED.invalidate(r.get('url_id'))
+
+    def _get_deleted_since_query(self):
+        uh = self.SCHEMA.url_hash
+        return self._statement('url_hash.get_deleted_since', lambda: select(
+            uh.c.hash_key, uh.c.url_id, uh.c.date_modified).where(and_(
+            uh.c.is_deleted == 1, uh.c.date_modified > bindparam('b_since', type_=uh.c.date_modified.type))))
+
+    def purge_deleted(self, older_than_days=30, batch_size=500, purge_hits=None, pause=0.0):
+        # Moves Short URLs deleted more than `older_than_days` days ago from `url_hash` to `url_hash_purged`, freeing
+        # their hash_key. `purge_hits(db, ids)` is called within each batch's transaction to move their hits too.
+        # Every batch is its own short transaction, with `pause` seconds in between to let other writers in.
+        uh = self.SCHEMA.url_hash
+        uhp = self.SCHEMA.url_hash_purged
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+
+        wc_ = [uh.c.is_deleted == 1, uh.c.date_modified < cutoff]
+        q_ = select(uh).where(and_(*wc_)).order_by(uh.c.date_modified).limit(batch_size)
+
+        purged = 0
+        for shard in self._databases():
+            while True:
+                with Database(**self._on(shard, is_transaction=True)) as db:
+                    rows = db.fetch(q_)
+                    if not rows:
+                        break
+                    ids = [r.get('id') for r in rows]
+
+                    now = datetime.now()
+                    db.execute(uhp.insert(), [{
+                        'url_hash_id': r.get('id'),
+                        'hash_key': r.get('hash_key'),
+                        'url_id': r.get('url_id'),
+                        'date_created': r.get('date_created'),
+                        'date_modified': r.get('date_modified'),
+                        'date_purged': now
+                    } for r in rows])
+                    if purge_hits:
+                        purge_hits(db, ids)
+                    db.execute(uh.delete().where(uh.c.id.in_(ids)))
+
+                purged += len(rows)
+                for r in rows:
+                    self.CACHE.invalidate(r.get('hash_key'))
+                if pause:
+                    time.sleep(pause)
+
+        return purged
+
+    def get_hot_urls(self, limit=1000):
+        # The most clicked Short URLs, as `get_url` returns them, from the click counters of every shard
+        uh = self.SCHEMA.url_hash
+        u = self.SCHEMA.url
+        ht = self.SCHEMA.hit_total
+
+        rc_ = [uh, u.c.url, ht.c.num_clicks]
+        # Deleted Short URLs keep their counters, but must never be cached as live
+        wc_ = [uh.c.is_deleted == 0]
+        js_ = uh.join(u, uh.c.url_id == u.c.id).join(ht, uh.c.id == ht.c.url_hash_id)
+        q_ = select(*rc_).select_from(js_).where(and_(*wc_)).order_by(ht.c.num_clicks.desc()).limit(limit)
+
+        urls = []
+        for shard in self._shards():
+            with Database(**self._reader(shard=shard)) as db:
+                urls.extend(db.fetch(q_))
+        urls = sorted(urls, key=lambda url: url.get('num_clicks'), reverse=True)[:limit]
+        return [{k: v for k, v in url.items() if k != 'num_clicks'} for url in urls]
+
+    def warm_up(self, limit=1000):
+        # Does what the first requests of a worker would otherwise do: builds the hash_key filter, syncs and fills
+        # the cache with the `limit` hottest Short URLs, runs the fixed lookups once (so their compiled form is
+        # cached) and builds the fixed write statements. Returns the number of Short URLs loaded.
+        self.build_key_filter(rebuild=False)
+        if self.CACHE.needs_sync():
+            self._sync_caches()
+
+        urls = self.get_hot_urls(limit) if self.CACHE.enabled else []
+        for url in urls:
+            self.CACHE.set(url.get('hash_key'), url)
+
+        self._get_url(urls[0].get('hash_key') if urls else '')
         with Database(app=self.APP, conn_string=self.CONN_STRING) as db:
-            uh = self.SCHEMA.url_hash
+            db.get(self._get_url_by_digest_query(), {'b_digest': ''})
+        self._statement('url.upsert', self._upsert_url_query)
+        self._statement('url_hash.insert', self.SCHEMA.url_hash.insert)
+        self._statement('key_sequence.reserve', self._reserve_keys_query)
+        self._delete_url_query()
+
+        return len(urls)
+
+    def rebalance_shards(self, move_hits=None, batch_size=500):
+        # Moves every Short URL that isn't on the shard owning its hash_key there (ie: after shards were added, or
+        # from the primary when sharding an existing database). Moved rows get an id encoding their new shard, and
+        # `move_hits(source, target, ids)` is given the old to new id mapping of each batch to move their hits.
+        # A hash_key the new shard already uses for another Long URL is reported and left where it is.
+        if not self.SHARDS:
+            raise Exception('Rebalancing requires SQLALCHEMY_SHARDS.')
+
+        uh = self.SCHEMA.url_hash
+        result = {'moved': 0, 'conflicts': []}
+
+        for source in self._databases():
+            last_id = None
+            while True:
+                with Database(**self._on(source)) as db:
+                    q_ = select(uh).order_by(uh.c.id).limit(batch_size)
+                    rows = db.fetch(q_.where(uh.c.id > last_id) if last_id is not None else q_)
+                if not rows:
+                    break
+                last_id = rows[-1].get('id')
+
+                targets = {}
+                for row in rows:
+                    target = self._shard_for(row.get('hash_key'))
+                    if target != source:
+                        targets.setdefault(target, []).append(row)
+
+                for target, moving in targets.items():
+                    moved, conflicts = self._move_url_hashes(source, target, moving, move_hits)
+                    result['moved'] += moved
+                    result['conflicts'].extend(conflicts)
+
+        # Cached rows carry the old ids, so every process drops them on its next sync
+        self.CACHE.clear()
+        self.reserve_keys(CACHE_GENERATION, 1)
+
+        return result
+
+    def _move_url_hashes(self, source, target, rows, move_hits=None):
+        uh = self.SCHEMA.url_hash
+
+        # Rows copied by an interrupted run already exist on the target, under their new id
+        with Database(**self._on(target)) as db:
+            q_ = select(uh.c.id, uh.c.hash_key, uh.c.url_id).where(uh.c.hash_key.in_([r.get('hash_key') for r in rows]))
+            existing = {r.get('hash_key'): r for r in db.fetch(q_)}
+
+        conflicts = [(r.get('hash_key'), source, target) for r in rows
+                     if r.get('hash_key') in existing and existing[r.get('hash_key')].get('url_id') != r.get('url_id')]
+        rows = [r for r in rows if (r.get('hash_key'), source, target) not in conflicts]
+        ids = {r.get('id'): existing[r.get('hash_key')].get('id') for r in rows if r.get('hash_key') in existing}
+
+        copies = self._place(target, [
+            {k: v for k, v in r.items() if k != 'id'} for r in rows if r.get('hash_key') not in existing])
+        if copies:
+            with Database(**self._on(target)) as db:
+                db.execute(uh.insert(), copies)
+        by_key = {r.get('hash_key'): r.get('id') for r in rows}
+        ids.update({by_key.get(copy.get('hash_key')): copy.get('id') for copy in copies})
 
-            wc_ = [uh.c.hash_key == hash_key]
+        if move_hits and ids:
+            move_hits(source, target, ids)
 
-            q_ = uh.update().values(
-                {'is_deleted': 1, 'date_modified': datetime.now()}).where(and_(*wc_))
+        with Database(**self._on(source)) as db:
+            db.execute(uh.delete().where(uh.c.id.in_(list(ids.keys()))))
 
-            return db.execute(q_)
+        return len(ids), conflicts
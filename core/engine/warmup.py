@@ -0,0 +1,32 @@
+import time
+from core.engine.base import STATEMENTS
+from core.engine.hit import HitEngine
+from core.engine.url import UrlEngine
+
+
+def warm_up(top_n=1000, **kwargs):
+    # Run once when a worker starts, so its first requests after a deploy are served like those of a warm one.
+    # Returns what was loaded and the time each step took.
+    timings = {}
+    start = time.perf_counter()
+
+    url_engine = UrlEngine(**kwargs)
+    hit_engine = HitEngine(**kwargs)
+    timings['engines'] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    urls = url_engine.warm_up(top_n)
+    timings['urls'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    user_agents = hit_engine.warm_up(top_n)
+    timings['hits'] = time.perf_counter() - step
+
+    return {
+        'urls': urls,
+        'user_agents': user_agents,
+        'statements': len(STATEMENTS),
+        'key_filter': url_engine.FILTER.stats() if url_engine.FILTER else None,
+        'timings': timings,
+        'seconds': time.perf_counter() - start
+    }
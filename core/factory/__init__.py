@@ -1,2 +1,4 @@
+from .aio import AsyncHitFactory
+from .allocator import KeyAllocator, Md5Allocator, SequenceAllocator, get_allocator
 from .hit import HitFactory
 from .url import UrlFactory
@@ -0,0 +1,67 @@
+from datetime import datetime
+from flask import Response
+from core.engine import AsyncHitEngine, AsyncUrlEngine
+from core.factory.base import BaseFactory
+from core.metrics import METRICS
+from core.timing import timed
+
+
+class AsyncHitFactory(BaseFactory):
+    # Async counterpart of `HitFactory` and `UrlFactory.handle_get_long_url` with the same responses.
+    # There is no Flask request context here, so the caller passes in the request details (and makes responses
+    # conditional).
+    def __init__(self, app, **kwargs):
+        super(AsyncHitFactory, self).__init__(app, **kwargs)
+
+        kwargs.update({'app': app})
+        self.HIT_ENGINE = AsyncHitEngine(**kwargs)
+        self.URL_ENGINE = AsyncUrlEngine(**kwargs)
+
+    @timed('factory')
+    async def handle_redirect(self, hash_key, remote_addr=None, user_agent=None):
+        # Check if a URL exists for the specified hash_key
+        url = await self.URL_ENGINE.aget_url(hash_key)
+        if url:
+            # Log the redirect for analytics
+            hit = {
+                'url_hash_id': url.get('id'),
+                'ip_address': remote_addr,
+                'user_agent_id': await self.HIT_ENGINE.aintern_user_agent(user_agent),
+                'date_created': datetime.now()
+            }
+            await self.HIT_ENGINE.arecord_hit(hit)
+
+            # Handle the redirect
+            METRICS.inc('turl_redirects_total')
+            return self._redirect(url)
+        METRICS.inc('turl_not_found_total', (('route', 'redirect'),))
+        # If unable to find a matching Short URL for the supplied hash
+        return Response('The requested Short URL was not found in the system.', status=404)
+
+    @timed('factory')
+    async def handle_get_long_url(self, hash_key):
+        url = await self.URL_ENGINE.aget_url(hash_key)
+        if url:
+            return self._cacheable(
+                self.APP.json.response(success=True, url=url), self.APP.config.get('URL_MAX_AGE', 60), url)
+
+        deleted = await self.URL_ENGINE.aget_deleted_url(hash_key)
+        if deleted:
+            return Response(f"This Short URL was deleted at {deleted.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}", status=400)
+        METRICS.inc('turl_not_found_total', (('route', 'url'),))
+        return Response('The requested Short URL was not found in the system.', status=400)
+
+    @timed('factory')
+    async def handle_statistics(self, hash_key):
+        # Check if a URL exists for the specified hash_key
+        statistics = await self.HIT_ENGINE.aget_statistics(hash_key)
+        if statistics and statistics.get('id'):
+            if statistics.get('is_deleted', False):
+                return Response(f"This Short URL was deleted at {statistics.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}", status=400)
+            else:
+                return self._cacheable(self.APP.json.response(success=True, statistics=statistics),
+                                       self.APP.config.get('STATISTICS_MAX_AGE', 10), statistics)
+
+        # If unable to find a matching Short URL for the supplied hash
+        METRICS.inc('turl_not_found_total', (('route', 'stats'),))
+        return Response('The requested Short URL was not found in the system.', status=400)
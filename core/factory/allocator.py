@@ -0,0 +1,100 @@
+from abc import ABC, abstractmethod
+import base64
+import hashlib
+import threading
+
+
+BASE62 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+class KeyAllocator(ABC):
+
+    @abstractmethod
+    def allocate(self, url_id, attempt=0):
+        # `attempt` is incremented by the caller each time the previous key turned out to be taken
+        pass
+
+    def allocate_many(self, url_ids, attempt=0):
+        return [self.allocate(url_id, attempt) for url_id in url_ids]
+
+
+class Md5Allocator(KeyAllocator):
+    # The original scheme, a hash of the Primary Index of the long_url (collides for repeated long_urls)
+
+    def __init__(self, length=8, **kwargs):
+        self.LENGTH = length
+
+    def allocate(self, url_id, attempt=0):
+        hasher = hashlib.md5(str(url_id + attempt).encode('utf-8'))
+        return base64.urlsafe_b64encode(hasher.digest()).decode('utf-8')[:self.LENGTH]
+
+
+class SequenceAllocator(KeyAllocator):
+    # Bijective base62 encoding of a database sequence. Each process reserves a block of the sequence at a
+    # time, so generated keys never collide with each other and allocation needs no query inside a block.
+
+    def __init__(self, url_engine, name='hash_key', block_size=1000, length=8, multiplier=2654435761, offset=0):
+        self.URL_ENGINE = url_engine
+        self.NAME = name
+        self.BLOCK_SIZE = block_size
+        self.LENGTH = length
+        # Any multiplier coprime with 62 permutes [0, 62^length), so keys don't look sequential
+        self.SPACE = len(BASE62) ** length
+        self.MULTIPLIER = multiplier
+        self.OFFSET = offset
+
+        self.LOCK = threading.Lock()
+        self.NEXT = 0
+        self.END = 0
+
+    def allocate(self, url_id=None, attempt=0):
+        return self.allocate_many([url_id])[0]
+
+    def allocate_many(self, url_ids, attempt=0):
+        values = []
+        with self.LOCK:
+            while len(values) < len(url_ids):
+                if self.NEXT >= self.END:
+                    size = max(self.BLOCK_SIZE, len(url_ids) - len(values))
+                    self.END = self.URL_ENGINE.reserve_keys(self.NAME, size)
+                    self.NEXT = self.END - size
+                take = min(self.END - self.NEXT, len(url_ids) - len(values))
+                values.extend(range(self.NEXT, self.NEXT + take))
+                self.NEXT += take
+
+        return [self.encode(value) for value in values]
+
+    def encode(self, value):
+        if value >= self.SPACE:
+            raise Exception('The Short URL key space has been exhausted.')
+
+        value = (value * self.MULTIPLIER + self.OFFSET) % self.SPACE
+        chars = []
+        for _ in range(self.LENGTH):
+            value, remainder = divmod(value, len(BASE62))
+            chars.append(BASE62[remainder])
+        return ''.join(reversed(chars))
+
+
+_ALLOCATORS = {}
+_LOCK = threading.Lock()
+
+
+def get_allocator(url_engine, kind='sequence', **options):
+    # Allocators are shared process-wide so a reserved block is used by every request of this worker
+    key = (url_engine._database_name(), kind)
+    allocator = _ALLOCATORS.get(key)
+    if allocator is None:
+        with _LOCK:
+            allocator = _ALLOCATORS.get(key)
+            if allocator is None:
+                options = {k: v for k, v in options.items() if v is not None}
+                match kind:
+                    case 'md5':
+                        allocator = Md5Allocator(**options)
+                    case 'sequence':
+                        allocator = SequenceAllocator(url_engine, **options)
+                    case _:
+                        raise Exception(f"Unknown key allocator '{kind}'.")
+                _ALLOCATORS[key] = allocator
+    return allocator
@@ -1,4 +1,32 @@
+from datetime import timezone
+from flask import redirect
+
+
 class BaseFactory:
 
     def __init__(self, app, **kwargs):
         self.APP = app
+
+    def _redirect(self, url):
+        # A permanent redirect is cached by browsers and CDNs (its later clicks never reach us), a temporary one
+        # must not be, so every click is counted
+        if url.get('is_permanent'):
+            response = redirect(url.get('url'), 301)
+            response.cache_control.public = True
+            response.cache_control.max_age = self.APP.config.get('PERMANENT_REDIRECT_MAX_AGE', 86400)
+        else:
+            response = redirect(url.get('url'), 302)
+            response.cache_control.no_store = True
+        return response
+
+    def _cacheable(self, response, max_age, row):
+        # Kept for `max_age` seconds, then revalidated with `If-None-Match`/`If-Modified-Since` (see
+        # `make_conditional`). `Last-Modified` is the last change to the Short URL (or its clicks) in `row`, stored
+        # in local time but sent in UTC.
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        dates = [d for d in (row.get('date_modified') or row.get('date_created'), row.get('date_last_clicked')) if d]
+        if dates:
+            response.last_modified = max(dates).astimezone(timezone.utc)
+        response.add_etag()
+        return response
@@ -1,7 +1,9 @@
-from datetime import datetime
-from flask import jsonify, request, redirect, Response
+from datetime import datetime, timedelta
+from flask import jsonify, request, Response
 from core.engine import HitEngine, UrlEngine
 from core.factory.base import BaseFactory
+from core.metrics import METRICS
+from core.timing import timed
 
 
 class HitFactory(BaseFactory):
@@ -12,24 +14,29 @@ class HitFactory(BaseFactory):
         self.HIT_ENGINE = HitEngine(**kwargs)
         self.URL_ENGINE = UrlEngine(**kwargs)
 
+    @timed('factory')
     def handle_redirect(self, hash_key):
         # Check if a URL exists for the specified hash_key
         url = self.URL_ENGINE.get_url(hash_key)
-        if url and not url.get('is_deleted', False):
+        if url:
             # Log the redirect for analytics
             hit = {
                 'url_hash_id': url.get('id'),
                 'ip_address': request.remote_addr,
-                'user_agent': request.headers.get('User-Agent'),
+                # Interned up front, almost always from the cache
+                'user_agent_id': self.HIT_ENGINE.intern_user_agent(request.headers.get('User-Agent')),
                 'date_created': datetime.now()
             }
-            self.HIT_ENGINE.create_hit(hit)
+            self.HIT_ENGINE.record_hit(hit)
 
             # Handle the redirect
-            return redirect(url.get('url'))
+            METRICS.inc('turl_redirects_total')
+            return self._redirect(url)
+        METRICS.inc('turl_not_found_total', (('route', 'redirect'),))
         # If unable to find a matching Short URL for the supplied hash
         return Response('The requested Short URL was not found in the system.', status=404)
 
+    @timed('factory')
     def handle_statistics(self, hash_key):
         # Check if a URL exists for the specified hash_key
         statistics = self.HIT_ENGINE.get_statistics(hash_key)
@@ -37,7 +44,54 @@ class HitFactory(BaseFactory):
             if statistics.get('is_deleted', False):
                 return Response(f"This Short URL was deleted at {statistics.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}", status=400)
             else:
-                return jsonify(success=True, statistics=statistics)
+                response = self._cacheable(jsonify(success=True, statistics=statistics),
+                                           self.APP.config.get('STATISTICS_MAX_AGE', 10), statistics)
+                return response.make_conditional(request)
 
         # If unable to find a matching Short URL for the supplied hash
+        METRICS.inc('turl_not_found_total', (('route', 'stats'),))
         return Response('The requested Short URL was not found in the system.', status=400)
+
+    @timed('factory')
+    def handle_clicks(self, hash_key):
+        return self._handle_analytics(hash_key, lambda url_hash_id, start, end: {
+            'clicks': self.HIT_ENGINE.get_clicks(url_hash_id, start, end, request.args.get('bucket', 'day'))
+        })
+
+    @timed('factory')
+    def handle_top_user_agents(self, hash_key):
+        return self._handle_analytics(hash_key, lambda url_hash_id, start, end: {
+            'user_agents': self.HIT_ENGINE.get_top_user_agents(url_hash_id, start, end, self._get_limit())
+        })
+
+    @timed('factory')
+    def handle_top_ip_addresses(self, hash_key):
+        return self._handle_analytics(hash_key, lambda url_hash_id, start, end: {
+            'ip_addresses': self.HIT_ENGINE.get_top_ip_addresses(url_hash_id, start, end, self._get_limit())
+        })
+
+    def _handle_analytics(self, hash_key, query):
+        url = self.URL_ENGINE.get_url(hash_key)
+        if not url:
+            deleted = self.URL_ENGINE.get_deleted_url(hash_key)
+            if deleted:
+                return Response(f"This Short URL was deleted at {deleted.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}", status=400)
+            METRICS.inc('turl_not_found_total', (('route', 'stats'),))
+            return Response('The requested Short URL was not found in the system.', status=400)
+
+        # (Optional) ISO 8601 range to report on, defaults to the last 30 days
+        try:
+            end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.now()
+            start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=30)
+        except ValueError:
+            return Response('The supplied start and end must be ISO 8601 timestamps.', status=400)
+        if start > end:
+            return Response('The supplied start must not be after the end.', status=400)
+        if request.args.get('bucket', 'day') not in ('day', 'hour'):
+            return Response("The supplied bucket must be either 'day' or 'hour'.", status=400)
+
+        return jsonify(success=True, hash_key=hash_key, start=start, end=end, **query(url.get('id'), start, end))
+
+    @staticmethod
+    def _get_limit():
+        return max(1, min(request.args.get('limit', 10, type=int), 100))
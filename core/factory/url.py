@@ -1,10 +1,17 @@
-import base64
 from datetime import datetime
-import hashlib
+from itertools import islice
+import json
 import re
 from flask import jsonify, request, Response
-from core.engine import UrlEngine
+from core.engine import HashKeyConflict, UrlEngine
+from core.factory.allocator import get_allocator
 from core.factory.base import BaseFactory
+from core.metrics import METRICS
+from core.timing import timed
+
+
+IDEMPOTENCY_CONFLICT = 'The Idempotency-Key was already used for another Destination Long URL.'
+INVALID_REDIRECT = "The supplied redirect must be either 'permanent' or 'temporary'."
 
 
 class UrlFactory(BaseFactory):
@@ -12,17 +19,28 @@ class UrlFactory(BaseFactory):
         super(UrlFactory, self).__init__(app, **kwargs)
 
         self.URL_ENGINE = UrlEngine(app=app, **kwargs)
+        self.ALLOCATOR = get_allocator(
+            self.URL_ENGINE,
+            app.config.get('KEY_ALLOCATOR', 'sequence'),
+            block_size=app.config.get('KEY_BLOCK_SIZE'),
+            length=app.config.get('KEY_LENGTH')
+        )
 
+    @timed('factory')
     def handle_get_long_url(self, hash_key):
         url = self.URL_ENGINE.get_url(hash_key)
         if url:
-            if url.get('is_deleted', False):
-                return Response(f"This Short URL was deleted at {url.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}", status=400)
-            else:
-                return jsonify(success=True, url=url)
-        else:
-            return Response('The requested Short URL was not found in the system.', status=400)
+            response = self._cacheable(jsonify(success=True, url=url), self.APP.config.get('URL_MAX_AGE', 60), url)
+            return response.make_conditional(request)
+
+        # Only deleted Short URLs are looked up again, to tell when they were deleted
+        deleted = self.URL_ENGINE.get_deleted_url(hash_key)
+        if deleted:
+            return Response(f"This Short URL was deleted at {deleted.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}", status=400)
+        METRICS.inc('turl_not_found_total', (('route', 'url'),))
+        return Response('The requested Short URL was not found in the system.', status=400)
 
+    @timed('factory')
     def handle_create_short_url(self):
         is_custom = False
         # (Required) The Long URL to create a Short URL for
@@ -31,61 +49,256 @@ class UrlFactory(BaseFactory):
         # (Optional) The User supplied Short URL to use (if possible)
         src_url = request.json.get('src_url') if request.headers.get(
             'Content-Type') == 'application/json' else request.form.get('src_url')
+        # (Optional) `permanent` for a cacheable 301 (clicks are then undercounted), `temporary` for a tracked 302
+        is_permanent = self._is_permanent(request.json.get('redirect') if request.headers.get(
+            'Content-Type') == 'application/json' else request.form.get('redirect'))
+        # (Optional) A client key, retrying a create with the same key returns the Short URL it created
+        idempotency_key = request.headers.get('Idempotency-Key')
 
+        if is_permanent is None:
+            return Response(INVALID_REDIRECT, status=400)
         if dest_url:
+            if idempotency_key:
+                created = self.URL_ENGINE.get_idempotency_keys([(idempotency_key, dest_url)])[0]
+                if created and created.get('conflict'):
+                    return Response(IDEMPOTENCY_CONFLICT, status=400)
+                if created:
+                    return jsonify(success=True, url=f"{self.APP.config.get('BASE_DOMAIN')}/{created.get('hash_key')}")
+
             # Create the `url` record (or retrieve it if it already exists)
             url_id = self.URL_ENGINE.create_url(dest_url)
 
-            # If no Short URL supplied, generate one based on the Primary Index of the Long URL
-            if not src_url or src_url == '':
-                src_url = self._generate_short_url(url_id)
-            # Attempt to create the supplied Short URL
-            else:
-                regx = re.compile(r"https?://(www\.)?")
-                src_url = regx.sub('', src_url.replace(
-                    self.APP.config.get('BASE_DOMAIN'), '')).strip().strip('/')
+            # Attempt to create the supplied Short URL, otherwise one is allocated
+            if src_url:
+                src_url = self._clean_short_url(src_url)
                 is_custom = True
 
             try:
-                src_url = self._create_url_hash(url_id, src_url, is_custom)
+                src_url = self._create_url_hash(url_id, src_url, is_custom, is_permanent)
             except Exception as e:
                 return Response(str(e), status=400)
 
+            if idempotency_key:
+                self.URL_ENGINE.save_idempotency_keys([
+                    {'key': idempotency_key, 'long_url': dest_url, 'hash_key': src_url}])
+
             return jsonify(success=True, url=f"{self.APP.config.get('BASE_DOMAIN')}/{src_url}")
 
         else:
             return Response('A Destination Long URL was not supplied.', status=400)
 
-    def _create_url_hash(self, url_id, short_url, is_custom=False, tries=0):
-        url = self.URL_ENGINE.get_url(short_url)
-        # URL Mapping already exists
-        if url:
-            # If a Custom URL is supplied, raise an Exception
-            if is_custom:
-                raise Exception('CONFLICT! Short URL already exists.')
-            # Otherwise, try again with a new hash_key
-            else:
-                tries = tries + 1
-                short_url = self._generate_short_url(url_id + tries)
-                short_url = self._create_url_hash(url_id, short_url, is_custom)
+    @timed('factory')
+    def handle_create_short_urls(self):
+        # (Required) A JSON array, or newline delimited JSON, of Long URLs or {`dest_url`, `src_url`,
+        # `idempotency_key`, `redirect`} objects
+        if request.mimetype == 'application/x-ndjson':
+            items = self._read_ndjson(request.stream)
         else:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return Response('A JSON array or NDJSON body of Destination Long URLs was not supplied.', status=400)
+            items = iter(items)
+
+        results = []
+        chunk_size = self.APP.config.get('URL_BATCH_CHUNK_SIZE', 1000)
+        while chunk := list(islice(items, chunk_size)):
+            results.extend(self._create_short_urls(chunk, len(results)))
+
+        return jsonify(success=all(r.get('success') for r in results), results=results)
+
+    @staticmethod
+    def _read_ndjson(stream):
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+    def _create_short_urls(self, items, offset=0):
+        results = []
+        for i, item in enumerate(items):
+            if isinstance(item, str):
+                item = {'dest_url': item}
+            if not isinstance(item, dict) or not all(
+                    isinstance(item.get(k), str) for k in ('dest_url', 'src_url', 'idempotency_key', 'redirect')
+                    if item.get(k) is not None):
+                results.append({'index': offset + i, 'success': False, 'error': 'Invalid batch item.'})
+            elif self._is_permanent(item.get('redirect')) is None:
+                results.append({'index': offset + i, 'success': False, 'error': INVALID_REDIRECT})
+            elif not item.get('dest_url'):
+                results.append({'index': offset + i, 'success': False, 'error': 'A Destination Long URL was not supplied.'})
+            else:
+                results.append({
+                    'index': offset + i,
+                    'success': True,
+                    'dest_url': item.get('dest_url'),
+                    'src_url': self._clean_short_url(item.get('src_url')) if item.get('src_url') else None,
+                    'idempotency_key': item.get('idempotency_key'),
+                    'is_permanent': self._is_permanent(item.get('redirect'))
+                })
+        pending = [r for r in results if r.get('success')]
+
+        # Items retried with an `idempotency_key` return the Short URL created the first time, found with one query
+        keyed = [r for r in pending if r.get('idempotency_key')]
+        created = self.URL_ENGINE.get_idempotency_keys([(r.get('idempotency_key'), r.get('dest_url')) for r in keyed])
+        for r, found in zip(keyed, created):
+            if found and found.get('conflict'):
+                r.update({'success': False, 'error': IDEMPOTENCY_CONFLICT})
+            elif found:
+                r['hash_key'] = found.get('hash_key')
+        pending = [r for r in pending if r.get('success') and not r.get('hash_key')]
+
+        # An `idempotency_key` repeated within the batch gets the Short URL of its first item
+        first = {}
+        for r in pending:
+            if r.get('idempotency_key'):
+                r['first'] = first.setdefault(r.get('idempotency_key'), r)
+        repeated = [r for r in pending if r.get('first', r) is not r]
+        pending = [r for r in pending if r.get('first', r) is r]
+
+        # Create (or retrieve) every `url` record with set-based queries
+        url_ids = self.URL_ENGINE.create_urls([r.get('dest_url') for r in pending])
+        for r in pending:
+            r['url_id'] = url_ids.get(r.get('dest_url'))
+
+        self._create_url_hashes(pending)
+
+        for r in repeated:
+            if r.get('first').get('dest_url') != r.get('dest_url'):
+                r.update({'success': False, 'error': IDEMPOTENCY_CONFLICT})
+            else:
+                r.update({k: r.get('first').get(k) for k in ('success', 'error', 'hash_key') if k in r.get('first')})
+        self.URL_ENGINE.save_idempotency_keys([
+            {'key': r.get('idempotency_key'), 'long_url': r.get('dest_url'), 'hash_key': r.get('hash_key')}
+            for r in pending if r.get('success') and r.get('idempotency_key')])
+
+        for r in results:
+            hash_key = r.pop('hash_key', None)
+            for k in ('url_id', 'src_url', 'idempotency_key', 'is_permanent', 'first'):
+                r.pop(k, None)
+            if r.get('success'):
+                r['url'] = f"{self.APP.config.get('BASE_DOMAIN')}/{hash_key}"
+
+        return results
+
+    def _create_url_hashes(self, pending, max_tries=100):
+        # Batch version of `_create_url_hash`, only generated keys that turn out to be taken are allocated again
+        reusing = []
+        # Creates without a Custom URL return the Long URL's existing generated Short URL, permanent redirects
+        # always get their own (ie: so a tracked Short URL is never handed out as a cacheable one)
+        if self.APP.config.get('REUSE_GENERATED_HASH_KEYS') and pending:
+            generated = self.URL_ENGINE.get_generated_hash_keys(
+                [r.get('url_id') for r in pending if not r.get('src_url') and not r.get('is_permanent')])
+            # Long URLs repeated within the batch share the Short URL generated for their first item
+            firsts = {}
+            for r in pending:
+                if not r.get('src_url') and not r.get('is_permanent'):
+                    if r.get('url_id') in generated:
+                        r['hash_key'] = generated.get(r.get('url_id'))
+                    else:
+                        r['same_url'] = firsts.setdefault(r.get('url_id'), r)
+            reusing = [r for r in pending if r.get('same_url', r) is not r]
+            pending = [r for r in pending if not r.get('hash_key') and r.get('same_url', r) is r]
+            for r in pending:
+                r.pop('same_url', None)
+
+        self._allocate_url_hashes(pending, max_tries)
+
+        for r in reusing:
+            same_url = r.pop('same_url')
+            r.update({k: same_url.get(k) for k in ('success', 'error', 'hash_key') if k in same_url})
+
+    def _allocate_url_hashes(self, pending, max_tries=100):
+        claimed = set()
+        for attempt in range(max_tries):
+            if not pending:
+                break
+
+            generated = [r for r in pending if not r.get('src_url')]
+            hash_keys = self.ALLOCATOR.allocate_many([r.get('url_id') for r in generated], attempt)
+            for r, hash_key in zip(generated, hash_keys):
+                r['hash_key'] = hash_key
+
+            rows = []
+            retry = []
+            for r in pending:
+                r.setdefault('hash_key', r.get('src_url'))
+                # Keys used by an earlier item of this batch
+                if r.get('hash_key') in claimed:
+                    retry.append(r)
+                else:
+                    claimed.add(r.get('hash_key'))
+                    rows.append(r)
+
+            now = datetime.now()
+            conflicts = self.URL_ENGINE.create_url_hashes([
+                {'hash_key': r.get('hash_key'), 'url_id': r.get('url_id'), 'date_created': now,
+                 'is_custom': 1 if r.get('src_url') else 0, 'is_permanent': r.get('is_permanent', 0)} for r in rows
+            ])
+            retry.extend(r for r in rows if r.get('hash_key') in conflicts)
+            for r in rows:
+                if r.get('hash_key') in conflicts:
+                    METRICS.inc('turl_hash_key_collisions_total')
+                else:
+                    METRICS.inc('turl_creates_total', (('kind', 'custom' if r.get('src_url') else 'generated'),))
+
+            pending = []
+            for r in retry:
+                # If a Custom URL is supplied, it's a conflict
+                if r.get('src_url'):
+                    r.update({'success': False, 'error': 'CONFLICT! Short URL already exists.'})
+                else:
+                    pending.append(r)
+
+        for r in pending:
+            r.update({'success': False, 'error': 'Unable to generate a unique Short URL.'})
+
+    def _clean_short_url(self, short_url):
+        regx = re.compile(r"https?://(www\.)?")
+        return regx.sub('', short_url.replace(
+            self.APP.config.get('BASE_DOMAIN'), '')).strip().strip('/')
+
+    def _is_permanent(self, redirect):
+        # 1 or 0 for `url_hash.is_permanent`, None for an unknown redirect (or one that isn't a string)
+        redirect = redirect or self.APP.config.get('DEFAULT_REDIRECT', 'temporary')
+        if not isinstance(redirect, str):
+            return None
+        return {'permanent': 1, 'temporary': 0}.get(redirect)
+
+    def _create_url_hash(self, url_id, short_url=None, is_custom=False, is_permanent=False, max_tries=100):
+        if self.APP.config.get('REUSE_GENERATED_HASH_KEYS') and not is_custom and not is_permanent:
+            short_url = self.URL_ENGINE.get_generated_hash_keys([url_id]).get(url_id)
+            if short_url:
+                return short_url
+
+        for attempt in range(max_tries):
+            # If no Short URL supplied, allocate one
+            if not is_custom:
+                short_url = self.ALLOCATOR.allocate(url_id, attempt)
+
             url_hash = {
                 'hash_key': short_url,
                 'url_id': url_id,
-                'date_created': datetime.now()
+                'date_created': datetime.now(),
+                'is_custom': 1 if is_custom else 0,
+                'is_permanent': 1 if is_permanent else 0
             }
-            self.URL_ENGINE.create_url_hash(url_hash)
-        return short_url
-
-    def _generate_short_url(self, url_id):
-        return self._generate_url_hash(url_id)
+            try:
+                self.URL_ENGINE.create_url_hash(url_hash)
+                METRICS.inc('turl_creates_total', (('kind', 'custom' if is_custom else 'generated'),))
+                return short_url
+            # URL Mapping already exists
+            except HashKeyConflict:
+                METRICS.inc('turl_hash_key_collisions_total')
+                # If a Custom URL is supplied, raise an Exception
+                if is_custom:
+                    raise Exception('CONFLICT! Short URL already exists.')
+                # Otherwise, try again with a new hash_key
 
-    @staticmethod
-    def _generate_url_hash(url_id):
-        # Generate the unique hash for the Short URL based on the Primary Index of the long_url
-        hasher = hashlib.md5(str(url_id).encode('utf-8'))
-        return base64.urlsafe_b64encode(hasher.digest()).decode('utf-8')[:8]
+        raise Exception('Unable to generate a unique Short URL.')
 
+    @timed('factory')
     def handle_delete_short_url(self, hash_key):
         if hash_key:
             url = self.URL_ENGINE.get_url(hash_key)
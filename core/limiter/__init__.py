@@ -0,0 +1,2 @@
+from .buckets import MemoryBuckets, SqliteBuckets, TokenBuckets, get_buckets
+from .limiter import RateLimiter
@@ -0,0 +1,97 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import math
+import threading
+import time
+from sqlalchemy import bindparam, case, func
+from sqlalchemy.dialects.sqlite import insert
+from core.db import Database, Schema
+
+
+class TokenBuckets(ABC):
+    # Token buckets by key, each refilled at `rate` tokens per second up to `burst`
+
+    @abstractmethod
+    def take(self, key, rate, burst, cost=1):
+        # Returns (allowed, retry_after), `retry_after` being the seconds until `cost` tokens are available again
+        pass
+
+    def give_back(self, key, rate, burst, cost=1):
+        # Returns the tokens of a request another bucket turned away, never beyond `burst`
+        self.take(key, rate, burst, -cost)
+
+    @staticmethod
+    def _retry_after(tokens, rate, cost):
+        return max(math.ceil((cost - tokens) / rate), 1) if rate > 0 else 60
+
+
+class MemoryBuckets(TokenBuckets):
+    # Buckets of this process only. The `max_keys` least recently used buckets are kept, a dropped one starts full
+    # again (ie: a client idle long enough to be evicted would have refilled anyway).
+
+    def __init__(self, max_keys=100000, **kwargs):
+        self.MAX_KEYS = max_keys
+        self.BUCKETS = OrderedDict()
+        self.LOCK = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self.LOCK:
+            bucket = self.BUCKETS.get(key)
+            if bucket is None:
+                tokens = burst
+                if len(self.BUCKETS) >= self.MAX_KEYS:
+                    self.BUCKETS.popitem(last=False)
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                self.BUCKETS.move_to_end(key)
+
+            allowed = tokens >= cost
+            self.BUCKETS[key] = (min(tokens - cost, burst) if allowed else tokens, now)
+
+        return allowed, None if allowed else self._retry_after(tokens, rate, cost)
+
+
+class SqliteBuckets(TokenBuckets):
+    # Buckets shared by every worker using the same SQLite database, each take is a single upsert
+
+    def __init__(self, conn_string='sqlite:///rate_limit.db', **kwargs):
+        self.CONN_STRING = conn_string
+        self.SCHEMA = Schema()
+
+        rb = self.SCHEMA.rate_bucket
+        with Database(conn_string=self.CONN_STRING) as db:
+            db.create(rb)
+
+        rate_ = bindparam('b_rate', type_=rb.c.tokens.type)
+        burst_ = bindparam('b_burst', type_=rb.c.tokens.type)
+        cost_ = bindparam('b_cost', type_=rb.c.tokens.type)
+        now_ = bindparam('b_now', type_=rb.c.updated.type)
+        refilled_ = func.min(burst_, rb.c.tokens + (now_ - rb.c.updated) * rate_)
+
+        q_ = insert(rb).values(key=bindparam('b_key'), tokens=func.min(burst_ - cost_, burst_), updated=now_, allowed=1)
+        self.TAKE = q_.on_conflict_do_update(index_elements=[rb.c.key], set_={
+            'tokens': case((refilled_ >= cost_, func.min(refilled_ - cost_, burst_)), else_=refilled_),
+            'updated': now_,
+            'allowed': case((refilled_ >= cost_, 1), else_=0)
+        }).returning(rb.c.tokens, rb.c.allowed)
+
+    def take(self, key, rate, burst, cost=1):
+        with Database(conn_string=self.CONN_STRING) as db:
+            bucket = db.get(self.TAKE, {
+                'b_key': key, 'b_rate': rate, 'b_burst': burst, 'b_cost': cost, 'b_now': time.time()})
+
+        if bucket.get('allowed'):
+            return True, None
+        return False, self._retry_after(bucket.get('tokens'), rate, cost)
+
+
+def get_buckets(kind='memory', **options):
+    options = {k: v for k, v in options.items() if v is not None}
+    match kind:
+        case 'memory':
+            return MemoryBuckets(**options)
+        case 'sqlite':
+            return SqliteBuckets(**options)
+        case _:
+            raise Exception(f"Unknown rate limit backend '{kind}'.")
@@ -0,0 +1,45 @@
+import threading
+
+
+class RateLimiter:
+    # Token bucket rules by endpoint and a cap on the requests in progress. Each rule is a dict of `endpoint` (or
+    # `*` for every one), `per` (`ip` for a bucket per client, `route` for one shared by every client), `rate`
+    # (tokens per second) and `burst` (bucket size). Every matching rule takes a token, only if they all allow it.
+
+    def __init__(self, buckets, rules=None, max_concurrent=None):
+        self.BUCKETS = buckets
+        self.RULES = {}
+        for rule in rules or []:
+            self.RULES.setdefault(rule.get('endpoint', '*'), []).append(rule)
+        # Requests beyond the cap are turned away rather than queued
+        self.SLOTS = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    def check(self, endpoint, client):
+        # None if the request may proceed, otherwise the seconds to wait before retrying
+        rules = self.RULES.get(endpoint)
+        if rules is None and '*' not in self.RULES:
+            return None
+
+        taken = []
+        for rule in (rules or []) + self.RULES.get('*', []):
+            key = rule.get('endpoint', '*')
+            if rule.get('per', 'ip') == 'ip':
+                key = f"{key}:{client}"
+            bucket = (key, rule.get('rate'), rule.get('burst', rule.get('rate')))
+            allowed, retry_after = self.BUCKETS.take(*bucket)
+            # A request turned away by one rule gives back what the earlier ones took (ie: a client blocked by the
+            # route's bucket keeps its own)
+            if not allowed:
+                for bucket in taken:
+                    self.BUCKETS.give_back(*bucket)
+                return retry_after
+            taken.append(bucket)
+        return None
+
+    def enter(self):
+        # Claims a slot without waiting, False when every slot is taken
+        return self.SLOTS is None or self.SLOTS.acquire(blocking=False)
+
+    def exit(self):
+        if self.SLOTS is not None:
+            self.SLOTS.release()
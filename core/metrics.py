@@ -0,0 +1,174 @@
+from bisect import bisect_left
+import math
+import threading
+import weakref
+
+
+# Upper bounds (seconds) of the latency histogram buckets, from sub-millisecond cache hits to slow writes
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Shard:
+    # One thread's counters and histograms, only ever written by that thread so recording takes no lock
+
+    def __init__(self):
+        self.COUNTERS = {}
+        self.HISTOGRAMS = {}
+
+    def merge(self, other):
+        for key, value in list(other.COUNTERS.items()):
+            self.COUNTERS[key] = self.COUNTERS.get(key, 0) + value
+        for key, (counts, total) in list(other.HISTOGRAMS.items()):
+            entry = self.HISTOGRAMS.get(key)
+            if entry is None:
+                self.HISTOGRAMS[key] = [list(counts), total]
+            else:
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+
+class _Holder:
+    # Kept in the thread's locals, its finalizer folds the shard into the retired totals once the thread is gone
+
+    def __init__(self, shard):
+        self.SHARD = shard
+
+
+class Metrics:
+    # Counters and latency histograms aggregated per thread and summed when rendered (ie: by `/metrics`)
+
+    def __init__(self, buckets=BUCKETS):
+        self.ENABLED = True
+        self.BUCKETS = tuple(buckets)
+        self.DESCRIPTIONS = {}
+        self.COLLECTORS = []
+
+        self.LOCAL = threading.local()
+        self.SHARDS = []
+        self.RETIRED = _Shard()
+        self.LOCK = threading.Lock()
+
+    def describe(self, name, kind, description):
+        # `kind` is one of `counter`, `gauge` or `histogram`
+        self.DESCRIPTIONS[name] = (kind, description)
+
+    def collect(self, collector):
+        # `collector()` returns (name, kind, description, [(labels, value)]) tuples read when rendering, for values
+        # that are already tracked elsewhere (ie: pool and cache statistics)
+        with self.LOCK:
+            self.COLLECTORS.append(collector)
+
+    def _shard(self):
+        holder = getattr(self.LOCAL, 'holder', None)
+        if holder is None:
+            shard = _Shard()
+            holder = _Holder(shard)
+            self.LOCAL.holder = holder
+            weakref.finalize(holder, self._retire, shard)
+            with self.LOCK:
+                self.SHARDS.append(shard)
+        return holder.SHARD
+
+    def _retire(self, shard):
+        with self.LOCK:
+            self.RETIRED.merge(shard)
+            self.SHARDS.remove(shard)
+
+    def inc(self, name, labels=(), value=1):
+        # `labels` is a tuple of (name, value) pairs
+        if not self.ENABLED:
+            return
+        counters = self._shard().COUNTERS
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        if not self.ENABLED:
+            return
+        histograms = self._shard().HISTOGRAMS
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [[0] * (len(self.BUCKETS) + 1), 0.0]
+        entry[0][bisect_left(self.BUCKETS, seconds)] += 1
+        entry[1] += seconds
+
+    def snapshot(self):
+        # Every thread's values summed, other threads may still be recording into theirs
+        totals = _Shard()
+        with self.LOCK:
+            totals.merge(self.RETIRED)
+            shards = list(self.SHARDS)
+        for shard in shards:
+            totals.merge(shard)
+        return totals
+
+    def render(self):
+        totals = self.snapshot()
+        families = {}
+        for (name, labels), value in totals.COUNTERS.items():
+            families.setdefault(name, []).append(_sample(name, labels, value))
+        for (name, labels), (counts, total) in totals.HISTOGRAMS.items():
+            samples = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + (math.inf,), counts):
+                cumulative += count
+                samples.append(_sample(f"{name}_bucket", labels + (('le', _format(bound)),), cumulative))
+            samples.append(_sample(f"{name}_sum", labels, total))
+            samples.append(_sample(f"{name}_count", labels, cumulative))
+
+        kinds = {name: kind for name, (kind, description) in self.DESCRIPTIONS.items()}
+        descriptions = {name: description for name, (kind, description) in self.DESCRIPTIONS.items()}
+        for collector in list(self.COLLECTORS):
+            for name, kind, description, values in collector():
+                kinds[name] = kind
+                descriptions[name] = description
+                families.setdefault(name, []).extend(_sample(name, labels, value) for labels, value in values)
+
+        lines = []
+        for name in sorted(families):
+            if name in descriptions:
+                lines.append(f"# HELP {name} {descriptions.get(name)}")
+            lines.append(f"# TYPE {name} {kinds.get(name, 'untyped')}")
+            lines.extend(families.get(name))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.LOCK:
+            self.RETIRED = _Shard()
+            for shard in self.SHARDS:
+                shard.COUNTERS.clear()
+                shard.HISTOGRAMS.clear()
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels, value):
+    # ie: `turl_http_requests_total{method="GET",route="/<hash_key>",status="302"} 12`
+    if labels:
+        pairs = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+        return f"{name}{{{pairs}}} {_format(value)}"
+    return f"{name} {_format(value)}"
+
+
+METRICS = Metrics()
+METRICS.describe('turl_http_requests_total', 'counter', 'Requests served, by route and status.')
+METRICS.describe('turl_http_request_duration_seconds', 'histogram', 'Request latency, by route.')
+METRICS.describe('turl_db_query_duration_seconds', 'histogram', 'Query latency, by statement and table.')
+METRICS.describe('turl_redirects_total', 'counter', 'Short URLs redirected to their Long URL.')
+METRICS.describe('turl_not_found_total', 'counter', 'Requests for a Short URL that does not exist, by route.')
+METRICS.describe('turl_creates_total', 'counter', 'Short URLs created, by kind (generated or custom).')
+METRICS.describe('turl_requests_limited_total', 'counter', 'Requests turned away by a rate limit, by endpoint.')
+METRICS.describe('turl_requests_shed_total', 'counter', 'Requests turned away while every slot was taken.')
+METRICS.describe('turl_hash_key_collisions_total', 'counter', 'Short URL creates that found their hash_key taken.')
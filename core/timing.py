@@ -0,0 +1,80 @@
+from contextvars import ContextVar
+from functools import wraps
+import inspect
+import time
+
+
+# Per-request (or per-thread) timings, only collected once `start` has been called
+_TIMINGS = ContextVar('timings', default=None)
+
+
+class Timings:
+
+    def __init__(self):
+        self.START = time.perf_counter()
+        self.DURATIONS = {}
+        self.CALLS = {}
+        self.ACTIVE = set()
+
+    def add(self, layer, seconds):
+        self.DURATIONS[layer] = self.DURATIONS.get(layer, 0.0) + seconds
+        self.CALLS[layer] = self.CALLS.get(layer, 0) + 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.START
+
+    def as_dict(self):
+        return {layer: {'duration': d, 'calls': self.CALLS.get(layer)} for layer, d in self.DURATIONS.items()}
+
+
+def start():
+    timings = Timings()
+    _TIMINGS.set(timings)
+    return timings
+
+
+def stop():
+    timings = _TIMINGS.get()
+    _TIMINGS.set(None)
+    return timings
+
+
+def current():
+    return _TIMINGS.get()
+
+
+def timed(layer):
+    # Records the time spent in the decorated call against `layer`. Nested calls within the same
+    # layer (ie: `create_hit` calling `create_hits`) are only counted once, by the outermost call.
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                timings = _TIMINGS.get()
+                if timings is None or layer in timings.ACTIVE:
+                    return await fn(*args, **kwargs)
+
+                timings.ACTIVE.add(layer)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    timings.add(layer, time.perf_counter() - start)
+                    timings.ACTIVE.discard(layer)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = _TIMINGS.get()
+            if timings is None or layer in timings.ACTIVE:
+                return fn(*args, **kwargs)
+
+            timings.ACTIVE.add(layer)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings.add(layer, time.perf_counter() - start)
+                timings.ACTIVE.discard(layer)
+        return wrapper
+    return decorator
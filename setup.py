@@ -1,8 +1,10 @@
 import datetime
+import getopt
 import json
+import sys
 from flask import Flask
 
-from core.engine import HitEngine, UrlEngine
+from core.engine import HitEngine, UrlEngine, warm_up
 
 
 def _init_db(app):
@@ -13,12 +15,134 @@ def _init_db(app):
     hit_engine.create_table()
 
 
+def _migrate_db(app):
+    # Safe to run repeatedly, brings databases created by older versions up to date
+    url_engine = UrlEngine(app=app)
+    hit_engine = HitEngine(app=app)
+
+    resolved = url_engine.migrate_tables()
+    hit_engine.migrate_table()
+
+    if resolved.get('merged_urls'):
+        print(f"Merged {resolved.get('merged_urls')} duplicate Long URL(s).")
+    for hash_key, new_key in resolved.get('rekeyed_hash_keys'):
+        print(f"Duplicate Short URL '{hash_key}' was re-keyed to '{new_key}'.")
+
+
+def _check_counters(app, repair=False):
+    hit_engine = HitEngine(app=app)
+
+    mismatches = hit_engine.check_counters()
+    for mismatch in mismatches:
+        bucket = ', '.join(str(b) for b in mismatch.get('bucket'))
+        print(f"{mismatch.get('table')} url_hash {mismatch.get('url_hash_id')}{f' ({bucket})' if bucket else ''}: "
+              f"expected {mismatch.get('expected')} clicks, counted {mismatch.get('actual')}")
+    print(f"{len(mismatches)} click counter(s) do not match the recorded hits.")
+
+    if repair:
+        hit_engine.rebuild_counters()
+        print('Click counters have been rebuilt from the recorded hits.')
+
+
+def _compact_hits(app):
+    hit_engine = HitEngine(app=app)
+
+    archived = hit_engine.compact_hits(app.config.get('HIT_ARCHIVE_DIR', 'archive'), app.config.get('HIT_HOT_MONTHS', 3))
+    for partition in archived:
+        print(f"Archived {partition.get('num_rows')} hit(s) of {partition.get('partition')} to {partition.get('archive_path')}.")
+    print(f"{len(archived)} hit partition(s) compacted.")
+
+
+def _build_key_filter(app):
+    url_engine = UrlEngine(app=app)
+
+    stats = url_engine.build_key_filter()
+    if stats is None:
+        print('The hash_key filter is disabled (HASH_KEY_FILTER_ENABLED).')
+        return
+    print(f"hash_key filter of {stats.get('keys')} key(s) in {stats.get('bytes') / 1024 / 1024:.1f} MB, "
+          f"{stats.get('num_hashes')} hash(es), estimated false positive rate {stats.get('estimated_error_rate'):.4%} "
+          f"({'loaded' if stats.get('loaded') else 'built'} in {stats.get('build_seconds') or 0:.2f}s).")
+
+
+def _purge_deleted(app):
+    url_engine = UrlEngine(app=app)
+    hit_engine = HitEngine(app=app)
+
+    purged = url_engine.purge_deleted(
+        app.config.get('PURGE_DELETED_AFTER_DAYS', 30), app.config.get('PURGE_BATCH_SIZE', 500),
+        hit_engine.purge_hits, app.config.get('PURGE_PAUSE', 0.0))
+    print(f"{purged} deleted Short URL(s) purged.")
+
+
+def _warm_up(app):
+    # Mostly for the time it takes, the caches it fills belong to this process. It still builds (and persists) the
+    # hash_key filter, creates this month's hit partitions and pulls the hottest rows into the OS page cache.
+    report = warm_up(app=app, top_n=app.config.get('WARM_UP_TOP_N') or 1000)
+    steps = ', '.join(f"{step} {seconds:.2f}s" for step, seconds in report.get('timings').items())
+    print(f"Warmed up {report.get('urls')} Short URL(s), {report.get('user_agents')} user agent(s) and "
+          f"{report.get('statements')} statement(s) in {report.get('seconds'):.2f}s ({steps}).")
+
+
+def _rebalance_shards(app):
+    url_engine = UrlEngine(app=app)
+    hit_engine = HitEngine(app=app)
+
+    result = url_engine.rebalance_shards(hit_engine.move_hits)
+    for hash_key, source, target in result.get('conflicts'):
+        print(f"Short URL '{hash_key}' exists on both {source or 'the primary'} and {target}, it was left in place.")
+    print(f"{result.get('moved')} Short URL(s) moved to their shard.")
+
+
+def main(argv):
+    check = False
+    repair = False
+    compact = False
+    rebalance = False
+    key_filter = False
+    warm = False
+    purge = False
+    try:
+        opts, args = getopt.getopt(argv, '', ['check-counters', 'rebuild-counters', 'compact-hits', 'rebalance-shards',
+                                           'build-key-filter', 'warm-up', 'purge-deleted'])
+        for opt, arg in opts:
+            if opt == '--check-counters':
+                check = True
+            elif opt == '--rebuild-counters':
+                repair = True
+            elif opt == '--compact-hits':
+                compact = True
+            elif opt == '--rebalance-shards':
+                rebalance = True
+            elif opt == '--build-key-filter':
+                key_filter = True
+            elif opt == '--warm-up':
+                warm = True
+            elif opt == '--purge-deleted':
+                purge = True
+
+    except getopt.GetoptError as e:
+        print(e)
+        sys.exit(2)
 
-def main():
     app = Flask(__name__)
     app.config.from_file('web/config.json', load=json.load)
     _init_db(app)
+    _migrate_db(app)
+
+    if rebalance:
+        _rebalance_shards(app)
+    if purge:
+        _purge_deleted(app)
+    if compact:
+        _compact_hits(app)
+    if check or repair:
+        _check_counters(app, repair)
+    if key_filter:
+        _build_key_filter(app)
+    if warm:
+        _warm_up(app)
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,5 @@
+import uvicorn
+
+
+if __name__ == '__main__':
+    uvicorn.run('web.asgi:application', port=8081, lifespan='on')
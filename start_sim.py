@@ -9,7 +9,7 @@ import sys
 import getopt
 import uuid
 
-from core.engine import HitEngine, UrlEngine
+from core.engine import HashKeyConflict, HitEngine, UrlEngine
 
 
 class TurlSim(cmd.Cmd):
@@ -111,12 +111,12 @@ class TurlSim(cmd.Cmd):
         hash_key = self._parse_hash_from_url(hash_key)
         if hash_key and hash_key != '':
             url = self.URL_ENGINE.get_url(hash_key)
+            deleted = self.URL_ENGINE.get_deleted_url(hash_key) if not url else None
             if url:
-                if url.get('is_deleted', False):
-                    print(f"This Short URL was deleted at { url.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}")
-                else:
-                    print(f"The Long URL Object to redirect for hash key '{hash_key}' is:")
-                    pprint(dict({'url': url.get('url')}, **url))
+                print(f"The Long URL Object to redirect for hash key '{hash_key}' is:")
+                pprint(dict({'url': url.get('url')}, **url))
+            elif deleted:
+                print(f"This Short URL was deleted at { deleted.get('date_modified').strftime('%m/%d/%Y, %H:%M:%S')}")
             else:
                 print('The requested Short URL was not found in the system.')
         else:
@@ -155,7 +155,7 @@ class TurlSim(cmd.Cmd):
         hash_key = self._parse_hash_from_url(hash_key)
         if hash_key and hash_key != '':
             url = self.URL_ENGINE.get_url(hash_key)
-            if url and not url.get('is_deleted', False):
+            if url:
                 # Log the redirect for analytics
                 hit = {
                     'url_hash_id': url.get('id'),
@@ -173,27 +173,26 @@ class TurlSim(cmd.Cmd):
         self.URL_ENGINE.create_tables()
         self.HIT_ENGINE.create_table()
 
-    def _create_url_hash(self, url_id, hash_key, is_custom=False, tries=0):
-        url = self.URL_ENGINE.get_url(hash_key)
-        # URL Mapping already exists
-        if url:
-            # If a Custom URL is supplied, raise an Exception
-            if is_custom:
-                raise Exception('CONFLICT! Short URL already exists.')
-            # Otherwise, try again with a new hash_key
-            else:
-                tries = tries + 1
-                hash_key = self._generate_short_url(url_id + tries)
-                hash_key = self._create_url_hash(
-                    url_id, hash_key, is_custom, tries)
-        else:
+    def _create_url_hash(self, url_id, hash_key, is_custom=False, max_tries=100):
+        for tries in range(max_tries):
             url_hash = {
                 'hash_key': hash_key,
                 'url_id': url_id,
-                'date_created': datetime.now()
+                'date_created': datetime.now(),
+                'is_custom': 1 if is_custom else 0
             }
-            self.URL_ENGINE.create_url_hash(url_hash)
-        return hash_key
+            try:
+                self.URL_ENGINE.create_url_hash(url_hash)
+                return hash_key
+            # URL Mapping already exists (live or deleted, the unique index covers both)
+            except HashKeyConflict:
+                # If a Custom URL is supplied, raise an Exception
+                if is_custom:
+                    raise Exception('CONFLICT! Short URL already exists.')
+                # Otherwise, try again with a new hash_key
+                hash_key = self._generate_short_url(url_id + tries + 1)
+
+        raise Exception('Unable to generate a unique Short URL.')
 
     def _generate_short_url(self, url_id):
         return self._generate_url_hash(url_id)
@@ -1,5 +1,9 @@
 import pytest
 import uuid
+from datetime import datetime
+from sqlalchemy import event
+from core.db import REGISTRY
+from core.engine import HitEngine, UrlEngine
 from web import app
 
 
@@ -15,10 +19,69 @@ def global_var():
 def test_client():
     # Set the Testing configuration prior to creating the Flask application
     flask_app = app
-    flask_app.config.update({'TESTING': True})
+    # Tests read the counters straight after clicking, so reads always wait for buffered hits
+    flask_app.config.update({'TESTING': True, 'HIT_READ_MAX_LAG': None})
 
     # Create a test client using the Flask application configured for testing
     with flask_app.test_client() as c:
         # Establish an application context
         with flask_app.app_context():
             yield c
+
+
+@pytest.fixture
+def init_engines(tmp_path):
+    # A `UrlEngine` and a `HitEngine` on `<tmp_path>/<name>.db` (unless given a `conn_string`) with their tables
+    # created, every other option is passed to both
+    def _init(name='turl', **options):
+        options.setdefault('conn_string', f"sqlite:///{tmp_path}/{name}.db")
+        url_engine = UrlEngine(**options)
+        hit_engine = HitEngine(**options)
+        url_engine.create_tables()
+        hit_engine.create_table()
+        return url_engine, hit_engine
+    return _init
+
+
+@pytest.fixture
+def create_url_hashes():
+    # Creates a Short URL for each of `hash_keys`, all of the same Long URL, and returns their ids
+    def _create(url_engine, hash_keys, long_url='https://www.graysonebarb.com'):
+        url_id = url_engine.create_url(long_url)
+        return [url_engine.create_url_hash({'hash_key': hash_key, 'url_id': url_id, 'date_created': datetime.now()})
+                for hash_key in hash_keys]
+    return _create
+
+
+def _full_scans(plans):
+    # The queries that read a whole table, rather than searching it (or walking an index, ie: to sort)
+    return [(statement, detail) for statement, details in plans for detail in details
+            if detail.startswith('SCAN ') and ' USING ' not in detail and detail != 'SCAN CONSTANT ROW']
+
+
+@pytest.fixture
+def assert_no_full_scans():
+    # Runs `fn()`, then `EXPLAIN QUERY PLAN` for every query it ran against `conn_string` (with the same
+    # parameters), and fails if any of them scans a whole table. Returns the plans otherwise.
+    def _check(conn_string, fn):
+        engine = REGISTRY.get(conn_string)
+        statements = []
+
+        def _record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                statements.append((statement, parameters[0] if executemany else parameters))
+
+        event.listen(engine, 'before_cursor_execute', _record)
+        try:
+            fn()
+        finally:
+            event.remove(engine, 'before_cursor_execute', _record)
+
+        with engine.connect() as conn:
+            plans = [(statement, [r[3] for r in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)])
+                     for statement, parameters in statements]
+        scans = _full_scans(plans)
+        if scans:
+            pytest.fail('Full table scans:\n' + '\n'.join(f"{detail}: {statement}" for statement, detail in scans))
+        return plans
+    return _check
@@ -0,0 +1,34 @@
+import pytest
+from core.factory import KeyAllocator, Md5Allocator, SequenceAllocator
+
+
+def test_md5_allocator():
+    # Matches the original `_generate_url_hash` scheme
+    assert Md5Allocator().allocate(1) == 'xMpCOKC5'
+    assert Md5Allocator().allocate(1, 1) == Md5Allocator().allocate(2)
+
+    # Allocators must implement `allocate`
+    with pytest.raises(TypeError):
+        KeyAllocator()
+
+
+def test_sequence_allocator(init_engines):
+    engine, _ = init_engines('allocator')
+
+    # Two workers sharing the database reserve separate blocks
+    first = SequenceAllocator(engine, block_size=10)
+    second = SequenceAllocator(engine, block_size=10)
+
+    keys = [first.allocate() for _ in range(15)] + [second.allocate() for _ in range(15)]
+    keys += first.allocate_many([None] * 25)
+
+    assert len(set(keys)) == len(keys)
+    assert all(len(k) == 8 and k.isalnum() for k in keys)
+
+
+def test_sequence_encoding_is_bijective():
+    allocator = SequenceAllocator(None, length=2)
+
+    keys = [allocator.encode(value) for value in range(62 ** 2)]
+
+    assert len(set(keys)) == 62 ** 2
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+from core.engine import AsyncHitEngine
+from web.asgi import application
+
+
+def _request(path, method='GET', headers=None):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'headers': headers or [],
+        'client': ('127.0.0.1', 50000)
+    }
+    asyncio.run(application(scope, receive, send))
+
+    start, body = messages
+    return start.get('status'), dict(start.get('headers')), body.get('body')
+
+
+def test_async_redirect(test_client):
+    response = test_client.post('/url/create', json={'dest_url': 'https://www.python.org/'})
+    hash_key = response.get_json().get('url').replace(
+        test_client.application.config.get('BASE_DOMAIN'), '').strip('/')
+
+    status, headers, _ = _request(f"/{hash_key}", headers=[(b'user-agent', b'pytest-asgi')])
+    assert status == 302
+    assert headers.get(b'location') == b'https://www.python.org/'
+
+    status, _, body = _request(f"/url/{hash_key}")
+    assert status == 200
+    assert b'https://www.python.org/' in body
+
+    status, _, body = _request(f"/stats/{hash_key}")
+    assert status == 200
+    assert test_client.get(f"/stats/{hash_key}").get_json().get('statistics').get('num_clicks') == 1
+
+
+
+def test_async_http_caching(test_client):
+    response = test_client.post('/url', json={'dest_url': 'https://www.python.org/', 'redirect': 'permanent'})
+    hash_key = response.get_json().get('url').replace(
+        test_client.application.config.get('BASE_DOMAIN'), '').strip('/')
+
+    status, headers, _ = _request(f"/{hash_key}")
+    assert status == 301
+    assert b'max-age' in headers.get(b'cache-control')
+
+    status, headers, _ = _request(f"/url/{hash_key}")
+    assert status == 200
+    status, _, body = _request(f"/url/{hash_key}", headers=[(b'if-none-match', headers.get(b'etag'))])
+    assert status == 304
+    assert body == b''
+
+def test_async_not_found(test_client):
+    status, _, body = _request('/doesnotexist')
+    assert status == 404
+    assert body == b'The requested Short URL was not found in the system.'
+
+    status, _, _ = _request('/url/doesnotexist')
+    assert status == 400
+
+    status, _, _ = _request('/url/doesnotexist', method='POST')
+    assert status == 405
+
+
+def test_async_engine_sync_methods(tmp_path):
+    options = {'conn_string': f"sqlite:///{tmp_path}/async_hits.db", 'hit_buffer_enabled': True,
+               'hit_buffer_flush_interval': 60}
+    engine = AsyncHitEngine(**options)
+    engine.create_table()
+
+    # A hit in a month without a partition yet, written from the event loop
+    asyncio.run(engine.acreate_hit({'url_hash_id': 1, 'user_agent': 'pytest', 'date_created': datetime(2025, 1, 2)}))
+    assert engine.count_hits() == 1
+
+    # The inherited synchronous methods still flush the buffer themselves
+    engine.RECORDER.record({'url_hash_id': 1, 'date_created': datetime(2025, 1, 3)})
+    clicks = engine.get_clicks(1, datetime(2025, 1, 1), datetime(2025, 1, 31))
+    assert sum(c.get('num_clicks') for c in clicks) == 2
+    engine.RECORDER.close()
@@ -0,0 +1,39 @@
+from benchmarks.bench_load import EngineTarget, init_db, run
+from benchmarks.workload import load_workload, percentile, save_workload, zipf_workload
+
+
+def test_zipf_workload_replay(tmp_path):
+    ops = zipf_workload(links=20, clicks=500)
+
+    # Deterministic, and saved workloads replay identically
+    assert ops == zipf_workload(links=20, clicks=500)
+    save_workload(ops, tmp_path / 'workload.jsonl')
+    assert load_workload(tmp_path / 'workload.jsonl') == ops
+
+    conn_string = f"sqlite:///{tmp_path}/bench.db"
+    init_db(conn_string)
+    results = run(EngineTarget(conn_string), ops, concurrency=2).as_dict()
+
+    assert results.get('endpoints').get('create').get('count') == 20
+    assert sum(e.get('count') for e in results.get('endpoints').values()) + results.get('skipped') == len(ops)
+    for e in results.get('endpoints').values():
+        assert e.get('errors') == 0
+        assert e.get('p50_ms') <= e.get('p95_ms') <= e.get('p99_ms') <= e.get('max_ms')
+
+
+def test_request_log(tmp_path):
+    (tmp_path / 'access.jsonl').write_text('\n'.join([
+        '{"method": "POST", "path": "/url/create", "json": {"dest_url": "https://www.google.com"}}',
+        '{"method": "GET", "path": "/abc?utm=1"}',
+        '{"method": "GET", "path": "/stats/abc"}',
+        '{"method": "DELETE", "path": "/url/abc"}',
+        '{"method": "GET", "path": "/stats/abc/clicks"}'
+    ]))
+
+    assert load_workload(tmp_path / 'access.jsonl') == [
+        {'op': 'create', 'dest_url': 'https://www.google.com'},
+        {'op': 'redirect', 'hash_key': 'abc'},
+        {'op': 'stats', 'hash_key': 'abc'},
+        {'op': 'delete', 'hash_key': 'abc'}
+    ]
+    assert percentile([1, 2, 3, 4], 50) == 2
@@ -0,0 +1,76 @@
+from datetime import datetime
+from core.cache import ResolutionCache
+
+
+def test_cache_hit_and_invalidate(init_engines):
+    engine, _ = init_engines('cache')
+
+    url_id = engine.create_url('https://www.graysonebarb.com')
+    engine.create_url_hash({'hash_key': 'cached', 'url_id': url_id, 'date_created': datetime.now()})
+
+    assert engine.get_url('cached').get('url') == 'https://www.graysonebarb.com'
+    assert engine.get_url('cached').get('is_deleted') == 0
+    assert engine.CACHE.stats().get('hits') == 1
+
+    # Deletes must take effect immediately
+    engine.delete_url('cached')
+    assert engine.get_url('cached') is None
+    assert engine.get_deleted_url('cached').get('is_deleted') == 1
+
+
+def test_cache_negative_lookup(init_engines):
+    engine, _ = init_engines('cache')
+
+    assert engine.get_url('missing') is None
+    assert engine.get_url('missing') is None
+    assert engine.CACHE.stats().get('hits') == 1
+
+    # Creating the hash_key drops the cached miss
+    url_id = engine.create_url('https://www.google.com')
+    engine.create_url_hash({'hash_key': 'missing', 'url_id': url_id, 'date_created': datetime.now()})
+    assert engine.get_url('missing').get('url') == 'https://www.google.com'
+
+
+def test_cache_eviction():
+    cache = ResolutionCache(max_size=2)
+
+    cache.set('a', {'id': 1})
+    cache.set('b', {'id': 2})
+    cache.get('a')
+    cache.set('c', {'id': 3})
+
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, {'id': 1})
+    assert cache.stats().get('evictions') == 1
+
+
+def test_cache_stale_set():
+    cache = ResolutionCache()
+
+    token = cache.token()
+    cache.invalidate('a')
+    cache.set('a', {'id': 1}, token)
+
+    assert cache.get('a') == (False, None)
+
+
+def test_cache_sync_across_processes(init_engines):
+    engine, _ = init_engines('cache', url_cache_sync_interval=0)
+    # Stands in for the same database cached by another worker process
+    other, _ = init_engines('cache')
+    other.CACHE = ResolutionCache(sync_interval=0)
+
+    url_id = engine.create_url('https://www.graysonebarb.com')
+    engine.create_url_hash({'hash_key': 'synced', 'url_id': url_id, 'date_created': datetime.now()})
+    assert other.get_url('synced').get('is_deleted') == 0
+
+    engine.create_url_hash({'hash_key': 'kept', 'url_id': url_id, 'date_created': datetime.now()})
+    assert other.get_url('kept')
+
+    engine.delete_url('synced')
+    assert other.get_url('synced') is None
+    # Only the deleted key is dropped elsewhere, without a write to tell other processes or clearing their caches
+    assert other.CACHE.get('kept')[0]
+    assert other.CACHE.stats().get('sync_clears') == 0
+    assert other.CACHE.stats().get('invalidations') == 1
+    assert engine.CACHE.stats().get('sync_clears') == 0
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from core.db import Database
+
+
+def test_counters_incremented(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('counters')
+    url_hash_id, = create_url_hashes(url_engine, ['counted'])
+
+    yesterday = datetime.now() - timedelta(days=1)
+    hit_engine.create_hit({'url_hash_id': url_hash_id, 'date_created': datetime.now()})
+    hit_engine.create_hits([{'url_hash_id': url_hash_id, 'date_created': yesterday}] * 3)
+
+    assert hit_engine.get_statistics('counted').get('num_clicks') == 4
+    assert hit_engine.check_counters() == []
+
+    with Database(conn_string=hit_engine.CONN_STRING) as db:
+        days = db.fetch(hit_engine.SCHEMA.hit_daily.select().order_by('day'))
+    assert [d.get('num_clicks') for d in days] == [3, 1]
+    assert days[0].get('day') == yesterday.date()
+
+
+def test_counters_rebuild(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('counters')
+    url_hash_id, = create_url_hashes(url_engine, ['counted'])
+
+    hit_engine.create_hits([{'url_hash_id': url_hash_id, 'date_created': datetime.now()}] * 2)
+    with Database(conn_string=hit_engine.CONN_STRING) as db:
+        db.execute(text('UPDATE hit_total SET num_clicks = 10'))
+
+    assert hit_engine.check_counters() == [
+        {'table': 'hit_total', 'url_hash_id': url_hash_id, 'bucket': (), 'expected': 2, 'actual': 10}]
+
+    hit_engine.rebuild_counters()
+    assert hit_engine.check_counters() == []
+    assert hit_engine.get_statistics('counted').get('num_clicks') == 2
+
+
+def test_rollups_rebuild(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('counters')
+    url_hash_id, = create_url_hashes(url_engine, ['counted'])
+
+    now = datetime.now()
+    hit_engine.create_hits([
+        {'url_hash_id': url_hash_id, 'user_agent': 'curl', 'ip_address': '127.0.0.1', 'date_created': now},
+        {'url_hash_id': url_hash_id, 'user_agent': 'curl', 'ip_address': '127.0.0.2', 'date_created': now},
+        {'url_hash_id': url_hash_id, 'user_agent': None, 'ip_address': '127.0.0.1', 'date_created': now}
+    ])
+    start = now - timedelta(hours=1)
+
+    before = (hit_engine.get_clicks(url_hash_id, start, now, 'hour'),
+              hit_engine.get_top_user_agents(url_hash_id, start, now),
+              hit_engine.get_top_ip_addresses(url_hash_id, start, now))
+    hit_engine.rebuild_counters()
+    after = (hit_engine.get_clicks(url_hash_id, start, now, 'hour'),
+             hit_engine.get_top_user_agents(url_hash_id, start, now),
+             hit_engine.get_top_ip_addresses(url_hash_id, start, now))
+
+    assert before == after
+    assert hit_engine.check_counters() == []
+
+    # Per-bucket drift is caught even when the totals agree
+    curl = hit_engine.intern_user_agent('curl')
+    with Database(conn_string=hit_engine.CONN_STRING) as db:
+        db.execute(text(f"UPDATE hit_agent_daily SET num_clicks = 3 WHERE user_agent_id = {curl}"))
+    mismatches = hit_engine.check_counters()
+    assert [(m.get('table'), m.get('bucket'), m.get('actual')) for m in mismatches] == [
+        ('hit_agent_daily', (now.date().isoformat(), curl), 3)]
+    assert before[1][0] == {'user_agent': 'curl', 'num_clicks': 2}
+    assert before[2][0] == {'ip_address': '127.0.0.1', 'num_clicks': 2}
@@ -0,0 +1,61 @@
+import asyncio
+from sqlalchemy import text
+from core.db import AsyncDatabase, Database, REGISTRY
+from core.db.aio import async_conn_string
+
+
+def test_engine_is_shared(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/shared.db"
+
+    with Database(conn_string=conn_string) as db:
+        first = db.CONNECTION
+        db.execute(text('SELECT 1'))
+    with Database(conn_string=conn_string) as db:
+        second = db.CONNECTION
+        db.execute(text('SELECT 1'))
+
+    assert first is second
+
+    stats = REGISTRY.stats().get(f"{conn_string}#default")
+    assert stats.get('checkouts') == 2
+    assert stats.get('checked_out') == 0
+
+
+def test_engine_options(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/options.db"
+
+    with Database(conn_string=conn_string, engine_options={'pool_size': 3, 'max_overflow': 1}) as db:
+        assert db.CONNECTION.pool.size() == 3
+
+    # Queue pool options are ignored for in-memory SQLite databases
+    with Database(conn_string='sqlite://', engine_options={'pool_size': 3, 'max_overflow': 1}) as db:
+        assert db.scalar(text('SELECT 1')) == 1
+
+
+def test_sqlite_pragmas(tmp_path):
+    with Database(conn_string=f"sqlite:///{tmp_path}/tuned.db") as db:
+        assert db.scalar(text('PRAGMA journal_mode')) == 'wal'
+        assert db.scalar(text('PRAGMA synchronous')) == 1
+        assert db.scalar(text('PRAGMA busy_timeout')) == 5000
+
+    # An empty profile leaves SQLite's defaults alone
+    with Database(conn_string=f"sqlite:///{tmp_path}/default.db", engine_options={'sqlite_pragmas': {}}) as db:
+        assert db.scalar(text('PRAGMA journal_mode')) == 'delete'
+
+
+def test_async_engine_is_pooled(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/async.db"
+
+    async def _queries():
+        for _ in range(3):
+            async with AsyncDatabase(conn_string=conn_string) as db:
+                assert await db.scalar(text('PRAGMA journal_mode')) == 'wal'
+
+    asyncio.run(_queries())
+    asyncio.run(_queries())
+
+    # One connection (and PRAGMA round) serves every query, even across event loops
+    stats = AsyncDatabase.pool_stats().get(f"{async_conn_string(conn_string)}#default")
+    assert stats.get('pool') == 'AsyncAdaptedQueuePool'
+    assert stats.get('connects') == 1
+    assert stats.get('checkouts') == 6
@@ -0,0 +1,65 @@
+import uuid
+
+
+def _create(test_client, **kwargs):
+    response = test_client.post('/url', json={'dest_url': f"https://www.graysonebarb.com/{uuid.uuid4()}", **kwargs})
+    assert response.status_code == 200
+    return response.get_json().get('url').replace(test_client.application.config.get('BASE_DOMAIN'), '').strip('/')
+
+
+def test_redirect_policy(test_client):
+    # Tracked Short URLs are never cached, so every click reaches us
+    response = test_client.get(f"/{_create(test_client)}")
+    assert response.status_code == 302
+    assert response.cache_control.no_store
+
+    hash_key = _create(test_client, redirect='permanent')
+    response = test_client.get(f"/{hash_key}")
+    assert response.status_code == 301
+    assert response.cache_control.public
+    assert response.cache_control.max_age == test_client.application.config.get('PERMANENT_REDIRECT_MAX_AGE')
+
+    for redirect in ('sometimes', [1], {'permanent': True}):
+        response = test_client.post('/url', json={'dest_url': 'https://www.python.org/', 'redirect': redirect})
+        assert response.status_code == 400
+    results = test_client.post('/url/batch', json=[
+        {'dest_url': 'https://www.python.org/', 'redirect': 'permanent'},
+        {'dest_url': 'https://www.python.org/', 'redirect': 'sometimes'}
+    ]).get_json().get('results')
+    assert results[0].get('success') and not results[1].get('success')
+    assert test_client.get(f"/{results[0].get('url').rsplit('/', 1)[-1]}").status_code == 301
+
+
+def test_permanent_urls_not_reused(test_client):
+    dest_url = f"https://www.graysonebarb.com/{uuid.uuid4()}"
+
+    test_client.application.config.update({'REUSE_GENERATED_HASH_KEYS': True})
+    try:
+        permanent = _create(test_client, dest_url=dest_url, redirect='permanent')
+        tracked = _create(test_client, dest_url=dest_url)
+        assert tracked != permanent
+        assert _create(test_client, dest_url=dest_url) == tracked
+    finally:
+        test_client.application.config.update({'REUSE_GENERATED_HASH_KEYS': False})
+
+
+def test_conditional_get(test_client):
+    hash_key = _create(test_client)
+
+    for path in (f"/url/{hash_key}", f"/stats/{hash_key}"):
+        response = test_client.get(path)
+        assert response.status_code == 200
+        assert response.cache_control.public and response.cache_control.max_age
+        assert response.headers.get('ETag') and response.headers.get('Last-Modified')
+
+        assert test_client.get(path, headers={'If-None-Match': response.headers.get('ETag')}).status_code == 304
+        assert test_client.get(
+            path, headers={'If-Modified-Since': response.headers.get('Last-Modified')}).status_code == 304
+        assert test_client.get(path, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+    # A click changes the statistics, and so their ETag
+    etag = test_client.get(f"/stats/{hash_key}").headers.get('ETag')
+    test_client.get(f"/{hash_key}")
+    response = test_client.get(f"/stats/{hash_key}", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json().get('statistics').get('num_clicks') == 1
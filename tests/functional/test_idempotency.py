@@ -0,0 +1,66 @@
+import uuid
+
+
+def _hash_key(test_client, response):
+    return response.get_json().get('url').replace(test_client.application.config.get('BASE_DOMAIN'), '').strip('/')
+
+
+def test_reuse_generated_url(test_client):
+    dest_url = f"https://www.graysonebarb.com/{uuid.uuid4()}"
+    custom = str(uuid.uuid4())[:8]
+
+    test_client.application.config.update({'REUSE_GENERATED_HASH_KEYS': True})
+    try:
+        # A Custom URL is never returned for a create without one
+        response = test_client.post('/url', data={'dest_url': dest_url, 'src_url': custom})
+        assert _hash_key(test_client, response) == custom
+
+        first = _hash_key(test_client, test_client.post('/url', data={'dest_url': dest_url}))
+        assert first != custom
+        assert _hash_key(test_client, test_client.post('/url', data={'dest_url': dest_url})) == first
+
+        response = test_client.post('/url/batch', json=[dest_url, f"{dest_url}/batch", f"{dest_url}/batch"])
+        results = response.get_json().get('results')
+        assert results[0].get('url').endswith(f"/{first}")
+        assert results[1].get('url') == results[2].get('url')
+
+        # Once deleted, another one is generated
+        test_client.delete(f"/url/{first}")
+        assert _hash_key(test_client, test_client.post('/url', data={'dest_url': dest_url})) not in (first, custom)
+    finally:
+        test_client.application.config.update({'REUSE_GENERATED_HASH_KEYS': False})
+
+
+def test_idempotency_key(test_client):
+    dest_url = f"https://www.graysonebarb.com/{uuid.uuid4()}"
+    idempotency_key = str(uuid.uuid4())
+
+    first = test_client.post('/url', data={'dest_url': dest_url}, headers={'Idempotency-Key': idempotency_key})
+    retry = test_client.post('/url', data={'dest_url': dest_url}, headers={'Idempotency-Key': idempotency_key})
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json().get('url') == first.get_json().get('url')
+
+    other = test_client.post('/url', data={'dest_url': f"{dest_url}/other"},
+                             headers={'Idempotency-Key': idempotency_key})
+    assert other.status_code == 400
+    assert test_client.post('/url', data={'dest_url': dest_url}).get_json().get('url') != first.get_json().get('url')
+
+
+def test_batch_idempotency_keys(test_client):
+    keys = [str(uuid.uuid4()) for _ in range(3)]
+    items = [
+        {'dest_url': 'https://www.graysonebarb.com/import/0', 'idempotency_key': keys[0]},
+        {'dest_url': 'https://www.graysonebarb.com/import/1', 'idempotency_key': keys[1]},
+        {'dest_url': 'https://www.graysonebarb.com/import/0', 'idempotency_key': keys[0]},
+        {'dest_url': 'https://www.graysonebarb.com/import/2', 'idempotency_key': keys[0]},
+        {'dest_url': 'https://www.graysonebarb.com/import/3', 'idempotency_key': 3}
+    ]
+    results = test_client.post('/url/batch', json=items).get_json().get('results')
+    assert [r.get('success') for r in results] == [True, True, True, False, False]
+    assert results[2].get('url') == results[0].get('url')
+
+    # A retried import returns the same Short URLs, and keys used with another Long URL are still rejected
+    retried = test_client.post('/url/batch', json=items[:2] + [
+        {'dest_url': 'https://www.graysonebarb.com/import/1', 'idempotency_key': keys[0]}]).get_json().get('results')
+    assert [r.get('url') for r in retried[:2]] == [r.get('url') for r in results[:2]]
+    assert retried[2].get('success') is False
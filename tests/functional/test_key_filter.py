@@ -0,0 +1,54 @@
+from core.cache import BloomFilter, FILTERS
+from core.engine import UrlEngine
+
+
+OPTIONS = {'hash_key_filter_enabled': True, 'hash_key_filter_sync_interval': 0, 'url_cache_size': 0}
+
+
+def test_bloom_filter_error_rate():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"key{i}")
+
+    assert all(f"key{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+    assert abs(bloom.estimated_error_rate() - 0.01) < 0.005
+
+
+def test_filter_skips_unknown_keys(tmp_path, init_engines, create_url_hashes):
+    FILTERS.clear()
+    engine, _ = init_engines('filter', **OPTIONS)
+    create_url_hashes(engine, ['existing'])
+
+    assert engine.get_url('existing').get('hash_key') == 'existing'
+    assert engine.get_url('unknown') is None
+    assert engine.FILTER.stats().get('negatives') == 1
+
+    # Keys created by another process (without this filter) are picked up by the next sync
+    create_url_hashes(UrlEngine(conn_string=f"sqlite:///{tmp_path}/filter.db"), ['elsewhere'])
+    assert engine.get_url('elsewhere').get('hash_key') == 'elsewhere'
+    # And keys created by this one right away
+    create_url_hashes(engine, ['here'])
+    assert engine.get_url('here').get('hash_key') == 'here'
+
+
+def test_filter_persisted(tmp_path, init_engines, create_url_hashes):
+    FILTERS.clear()
+    path = str(tmp_path / 'filter.bloom')
+    engine, _ = init_engines('filter', hash_key_filter_path=path, **OPTIONS)
+    create_url_hashes(engine, [f"saved{i}" for i in range(10)])
+    assert engine.build_key_filter().get('loaded') is False
+
+    # Another start maps the saved filter and catches up with the keys created since
+    create_url_hashes(UrlEngine(conn_string=f"sqlite:///{tmp_path}/filter.db"), ['later'])
+    FILTERS.clear()
+    engine, _ = init_engines('filter', hash_key_filter_path=path, **OPTIONS)
+    stats = engine.build_key_filter()
+    assert stats.get('loaded') is True
+    assert stats.get('keys') == 11
+    assert engine.get_url('later').get('hash_key') == 'later'
+    assert engine.get_url('saved3').get('hash_key') == 'saved3'
+    assert engine.get_url('never') is None
+    assert engine.FILTER.stats().get('negatives') == 1
+    FILTERS.clear()
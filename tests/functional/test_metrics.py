@@ -0,0 +1,55 @@
+import threading
+from core.metrics import Metrics
+
+
+def _value(text, sample):
+    for line in text.splitlines():
+        if line.startswith(f"{sample} "):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_metrics_summed_across_threads():
+    metrics = Metrics(buckets=(0.01, 0.1))
+    metrics.describe('requests_total', 'counter', 'Requests.')
+
+    def record():
+        for _ in range(100):
+            metrics.inc('requests_total', (('route', '/a'),))
+            metrics.observe('latency_seconds', 0.05)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    del threads
+    metrics.inc('requests_total', (('route', '/a'),))
+
+    # Threads that are gone still count
+    text = metrics.render()
+    assert '# TYPE requests_total counter' in text
+    assert _value(text, 'requests_total{route="/a"}') == 401
+    assert _value(text, 'latency_seconds_bucket{le="0.01"}') == 0
+    assert _value(text, 'latency_seconds_bucket{le="0.1"}') == 400
+    assert _value(text, 'latency_seconds_bucket{le="+Inf"}') == 400
+    assert _value(text, 'latency_seconds_count') == 400
+
+
+def test_metrics_endpoint(test_client):
+    response = test_client.post('/url', data={'dest_url': 'https://www.graysonebarb.com/metrics'})
+    hash_key = response.get_json().get('url').rsplit('/', 1)[1]
+    test_client.get(f"/{hash_key}")
+    test_client.get('/never-created-metrics')
+
+    response = test_client.get('/metrics')
+    text = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert _value(text, 'turl_redirects_total') >= 1
+    assert _value(text, 'turl_not_found_total{route="redirect"}') >= 1
+    assert _value(text, 'turl_creates_total{kind="generated"}') >= 1
+    assert _value(text, 'turl_http_requests_total{method="GET",route="/<string:hash_key>",status="302"}') >= 1
+    assert _value(text, 'turl_http_request_duration_seconds_count{method="POST",route="/url"}') >= 1
+    assert 'turl_db_query_duration_seconds_bucket{statement="SELECT",table="url_hash"' in text
+    assert 'turl_cache_hits_total{cache=' in text
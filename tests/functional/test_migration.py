@@ -0,0 +1,150 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from core.db import Database
+from core.engine import HashKeyConflict, HitEngine, UrlEngine
+
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE url (id INTEGER NOT NULL PRIMARY KEY, url TEXT NOT NULL, date_created DATETIME NOT NULL)',
+    'CREATE TABLE url_hash (id INTEGER NOT NULL PRIMARY KEY, hash_key TEXT NOT NULL, url_id INTEGER NOT NULL, '
+    'date_created DATETIME NOT NULL, date_modified DATETIME, is_deleted INTEGER NOT NULL)',
+    'CREATE TABLE hit (id INTEGER NOT NULL PRIMARY KEY, url_hash_id INTEGER, ip_address TEXT, user_agent TEXT, '
+    'date_created DATETIME NOT NULL)',
+    "INSERT INTO url (url, date_created) VALUES ('https://www.graysonebarb.com', '2024-11-07 00:00:00')"
+]
+
+
+def test_migrate_legacy_database(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/legacy.db"
+    with Database(conn_string=conn_string) as db:
+        for statement in LEGACY_SCHEMA:
+            db.execute(text(statement))
+
+    url_engine = UrlEngine(conn_string=conn_string)
+    hit_engine = HitEngine(conn_string=conn_string)
+
+    # Running the migration twice must be a no-op the second time
+    for _ in range(2):
+        url_engine.migrate_tables()
+        hit_engine.migrate_table()
+
+    with Database(conn_string=conn_string) as db:
+        inspector = inspect(db.CURSOR)
+        assert 'ix_url_url_digest' in [i.get('name') for i in inspector.get_indexes('url')]
+        assert 'ix_url_hash_hash_key' in [i.get('name') for i in inspector.get_indexes('url_hash')]
+        assert 'ix_hit_url_hash_id_date_created' in [i.get('name') for i in inspector.get_indexes('hit')]
+
+    # The existing row is found through its backfilled digest
+    assert url_engine.create_url('https://www.graysonebarb.com') == 1
+
+
+def test_migrate_duplicates(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/duplicates.db"
+    with Database(conn_string=conn_string) as db:
+        for statement in LEGACY_SCHEMA[:3] + [
+            "INSERT INTO url (url, date_created) VALUES ('https://www.google.com', '2024-11-07 00:00:00')",
+            "INSERT INTO url (url, date_created) VALUES ('https://www.google.com', '2024-11-07 00:00:01')",
+            "INSERT INTO url_hash (hash_key, url_id, date_created, is_deleted) VALUES ('dupe', 1, '2024-11-07', 1)",
+            "INSERT INTO url_hash (hash_key, url_id, date_created, is_deleted) VALUES ('dupe', 2, '2024-11-07', 0)"
+        ]:
+            db.execute(text(statement))
+
+    # As `setup.py` does, which creates the tables that don't exist yet first
+    url_engine = UrlEngine(conn_string=conn_string)
+    url_engine.create_tables()
+    resolved = url_engine.migrate_tables()
+
+    assert resolved.get('merged_urls') == 1
+    assert resolved.get('rekeyed_hash_keys') == [('dupe', 'dupe-1')]
+
+    # The live row keeps the hash_key, and both now point at the surviving url
+    assert url_engine.get_url('dupe').get('is_deleted') == 0
+    assert url_engine.get_deleted_url('dupe-1').get('url_id') == 1
+    assert url_engine.get_url('dupe').get('url_id') == 1
+
+
+def test_migrate_url_normalization(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/normalization.db"
+    url_engine = UrlEngine(conn_string=conn_string)
+    url_engine.create_tables()
+    url_engine.migrate_tables()
+    first = url_engine.create_url('https://www.graysonebarb.com/')
+    second = url_engine.create_url('HTTPS://WWW.GraysonEbarb.com:443')
+    assert first != second
+    url_engine.create_url_hash({'hash_key': 'second', 'url_id': second, 'date_created': datetime.now()})
+
+    # Enabling normalization re-digests the stored urls, merging those that are now equivalent
+    options = {'lowercase': True, 'default_ports': True, 'trailing_slash': True}
+    url_engine = UrlEngine(conn_string=conn_string, url_normalization=options)
+    assert url_engine.migrate_tables().get('merged_urls') == 1
+    assert url_engine.get_url('second').get('url_id') == first
+
+    assert url_engine.create_url('https://www.graysonebarb.com:443/') == first
+    assert url_engine.create_urls(['https://WWW.graysonebarb.com', 'https://www.google.com']).get(
+        'https://WWW.graysonebarb.com') == first
+    assert url_engine.migrate_tables().get('merged_urls') == 0
+
+
+def test_unmigrated_hash_key_conflict(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/unmigrated.db"
+    with Database(conn_string=conn_string) as db:
+        for statement in LEGACY_SCHEMA:
+            db.execute(text(statement))
+
+    # Without `ix_url_hash_hash_key` conflicts are still detected, by probing
+    url_engine = UrlEngine(conn_string=conn_string)
+    assert not url_engine.has_unique_hash_keys()
+
+    url_engine.create_url_hash({'hash_key': 'custom', 'url_id': 1, 'date_created': datetime.now()})
+    with pytest.raises(HashKeyConflict):
+        url_engine.create_url_hash({'hash_key': 'custom', 'url_id': 1, 'date_created': datetime.now()})
+    assert url_engine.create_url_hashes([
+        {'hash_key': 'custom', 'url_id': 1, 'date_created': datetime.now()},
+        {'hash_key': 'other', 'url_id': 1, 'date_created': datetime.now()}
+    ]) == {'custom'}
+
+    # Other integrity errors are not mistaken for a taken key
+    with pytest.raises(IntegrityError):
+        url_engine.create_url_hash({'hash_key': 'invalid', 'url_id': None, 'date_created': datetime.now()})
+
+
+def test_migrate_hit_encoding(tmp_path):
+    conn_string = f"sqlite:///{tmp_path}/encoding.db"
+    with Database(conn_string=conn_string) as db:
+        for statement in LEGACY_SCHEMA + [
+            "INSERT INTO url_hash (hash_key, url_id, date_created, is_deleted) VALUES ('old', 1, '2025-01-01', 0)",
+            "INSERT INTO hit (url_hash_id, ip_address, user_agent, date_created) "
+            "VALUES (1, '127.0.0.1', 'curl', '2025-01-02 10:00:00.000000')",
+            # A partition and counters as written before user agents were interned and IPs packed
+            'CREATE TABLE hit_2025_02 (id INTEGER NOT NULL PRIMARY KEY, url_hash_id INTEGER, ip_address TEXT, '
+            'user_agent TEXT, date_created DATETIME NOT NULL)',
+            "INSERT INTO hit_2025_02 (url_hash_id, ip_address, user_agent, date_created) "
+            "VALUES (1, '::1', 'curl', '2025-02-02 10:00:00.000000')",
+            'CREATE TABLE hit_partition (name TEXT NOT NULL PRIMARY KEY, month DATE NOT NULL, num_rows INTEGER, '
+            'archive_path TEXT, date_archived DATETIME)',
+            "INSERT INTO hit_partition (name, month) VALUES ('hit_2025_02', '2025-02-01')",
+            'CREATE TABLE hit_agent_daily (url_hash_id INTEGER NOT NULL, day DATE NOT NULL, user_agent TEXT NOT NULL, '
+            'num_clicks INTEGER NOT NULL, PRIMARY KEY (url_hash_id, day, user_agent)) WITHOUT ROWID',
+            "INSERT INTO hit_agent_daily VALUES (1, '2025-01-02', 'curl', 1), (1, '2025-02-02', 'curl', 1)",
+            'CREATE TABLE hit_ip_daily (url_hash_id INTEGER NOT NULL, day DATE NOT NULL, ip_address TEXT NOT NULL, '
+            'num_clicks INTEGER NOT NULL, PRIMARY KEY (url_hash_id, day, ip_address)) WITHOUT ROWID',
+            "INSERT INTO hit_ip_daily VALUES (1, '2025-01-02', '127.0.0.1', 1), (1, '2025-02-02', '::1', 1)"
+        ]:
+            db.execute(text(statement))
+
+    url_engine = UrlEngine(conn_string=conn_string)
+    hit_engine = HitEngine(conn_string=conn_string)
+    for _ in range(2):
+        url_engine.create_tables()
+        hit_engine.create_table()
+        url_engine.migrate_tables()
+        hit_engine.migrate_table()
+
+    start, end = datetime(2025, 1, 1), datetime(2025, 3, 1)
+    assert hit_engine.count_hits() == 2
+    assert hit_engine.get_top_user_agents(1, start, end) == [{'user_agent': 'curl', 'num_clicks': 2}]
+    assert sorted(r.get('ip_address') for r in hit_engine.get_top_ip_addresses(1, start, end)) == ['127.0.0.1', '::1']
+    assert [h.get('ip_address') for h in hit_engine.get_hits(1, start, end)] == ['::1', '127.0.0.1']
+    assert hit_engine.check_counters() == []
@@ -0,0 +1,61 @@
+import gzip
+import json
+from datetime import date, datetime, timedelta
+from sqlalchemy import inspect
+from core.db import Database
+from core.engine.hit import add_months, month_start
+
+
+def _tables(engine):
+    with Database(conn_string=engine.CONN_STRING) as db:
+        return [t for t in inspect(db.CURSOR).get_table_names() if t.startswith('hit_2')]
+
+
+def test_hits_partitioned_by_month(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('partitions')
+    url_hash_id, = create_url_hashes(url_engine, ['parted'])
+
+    this_month = month_start(date.today())
+    last_month = datetime.combine(add_months(this_month, -1), datetime.min.time())
+    hit_engine.create_hits([
+        {'url_hash_id': url_hash_id, 'date_created': datetime.now()},
+        {'url_hash_id': url_hash_id, 'date_created': last_month},
+        {'url_hash_id': url_hash_id, 'date_created': last_month + timedelta(hours=1)}
+    ])
+
+    assert sorted(_tables(hit_engine)) == [f"hit_{add_months(this_month, -1):%Y_%m}", f"hit_{this_month:%Y_%m}"]
+    assert hit_engine.count_hits() == 3
+    assert hit_engine.check_counters() == []
+
+    # Only last month's partition overlaps the window
+    hits = hit_engine.get_hits(url_hash_id, last_month, last_month + timedelta(days=1))
+    assert [h.get('date_created') for h in hits] == [last_month + timedelta(hours=1), last_month]
+
+
+def test_compact_hits(tmp_path, init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('partitions')
+    url_hash_id, = create_url_hashes(url_engine, ['parted'])
+
+    this_month = month_start(date.today())
+    old = datetime.combine(add_months(this_month, -5), datetime.min.time())
+    hit_engine.create_hits([{'url_hash_id': url_hash_id, 'ip_address': '127.0.0.1', 'date_created': old}] * 4)
+    hit_engine.create_hit({'url_hash_id': url_hash_id, 'date_created': datetime.now()})
+
+    archived = hit_engine.compact_hits(str(tmp_path / 'archive'), hot_months=3)
+    assert [(a.get('partition'), a.get('num_rows')) for a in archived] == [(f"hit_{old:%Y_%m}", 4)]
+    assert _tables(hit_engine) == [f"hit_{this_month:%Y_%m}"]
+
+    with gzip.open(archived[0].get('archive_path'), 'rt') as f:
+        rows = [json.loads(line) for line in f]
+    assert len(rows) == 4 and rows[0].get('ip_address') == '127.0.0.1'
+
+    # The archived month's clicks are still counted, and neither checking nor rebuilding loses them
+    assert hit_engine.count_hits() == 1
+    assert hit_engine.get_statistics('parted').get('num_clicks') == 5
+    assert hit_engine.check_counters() == []
+    hit_engine.rebuild_counters()
+    assert hit_engine.get_statistics('parted').get('num_clicks') == 5
+    assert [d.get('num_clicks') for d in hit_engine.get_clicks(url_hash_id, old, datetime.now())] == [4, 1]
+
+    # Nothing else is old enough
+    assert hit_engine.compact_hits(str(tmp_path / 'archive'), hot_months=3) == []
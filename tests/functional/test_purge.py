@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from core.db import Database
+
+
+def test_purge_deleted(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('purge')
+    conn_string = url_engine.CONN_STRING
+
+    for url_hash_id in create_url_hashes(url_engine, ['kept', 'recent', 'old', 'older']):
+        hit_engine.create_hits([{'url_hash_id': url_hash_id, 'ip_address': '10.0.0.1', 'user_agent': 'curl',
+                                 'date_created': datetime.now()}] * 2)
+    ids = {hash_key: url_engine.get_url(hash_key).get('id') for hash_key in ('old', 'older')}
+
+    for hash_key in ('recent', 'old', 'older'):
+        url_engine.delete_url(hash_key)
+    uh = url_engine.SCHEMA.url_hash
+    with Database(conn_string=conn_string) as db:
+        db.execute(uh.update().where(uh.c.hash_key.in_(['old', 'older'])).values(
+            date_modified=datetime.now() - timedelta(days=40)))
+
+    # Deleted Short URLs are only found by the tombstone lookup
+    assert url_engine.get_url('recent') is None
+    assert url_engine.get_deleted_url('recent').get('is_deleted') == 1
+    assert url_engine.get_deleted_url('kept') is None
+
+    assert url_engine.purge_deleted(30, batch_size=1, purge_hits=hit_engine.purge_hits) == 2
+    assert url_engine.purge_deleted(30, batch_size=1, purge_hits=hit_engine.purge_hits) == 0
+
+    hp = hit_engine.SCHEMA.hit_purged
+    with Database(conn_string=conn_string) as db:
+        assert db.scalar(select(func.count()).select_from(uh)) == 2
+        assert db.scalar(select(func.count()).select_from(hp).where(hp.c.url_hash_id.in_(ids.values()))) == 4
+    assert hit_engine.count_hits() == 4
+    assert hit_engine.check_counters() == []
+    assert hit_engine.get_statistics('kept').get('num_clicks') == 2
+
+    # Purged Short URLs still tell when they were deleted, and their hash_key can be used again
+    deleted = url_engine.get_deleted_url('old')
+    assert deleted.get('id') == ids.get('old')
+    assert deleted.get('date_modified') < datetime.now() - timedelta(days=30)
+    create_url_hashes(url_engine, ['old'])
+    assert url_engine.get_url('old').get('url') == 'https://www.graysonebarb.com'
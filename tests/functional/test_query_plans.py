@@ -0,0 +1,58 @@
+from datetime import datetime
+from core.db import SLOW_QUERIES
+
+
+def _seed(init_engines):
+    url_engine, hit_engine = init_engines('plans', url_cache_size=0)
+
+    # Enough rows that the planner has a choice between scanning and searching
+    url_ids = url_engine.create_urls([f"https://www.graysonebarb.com/{i}" for i in range(200)])
+    url_engine.create_url_hashes([{'hash_key': f"seed{i}", 'url_id': url_id, 'date_created': datetime.now()}
+                                  for i, url_id in enumerate(url_ids.values())])
+    for i in range(0, 200, 10):
+        url = url_engine.get_url(f"seed{i}")
+        hit_engine.create_hits([{'url_hash_id': url.get('id'), 'ip_address': '10.0.0.1', 'user_agent': 'curl',
+                                 'date_created': datetime.now()}] * 3)
+    return url_engine, hit_engine
+
+
+def test_fixed_queries_use_indexes(init_engines, assert_no_full_scans):
+    url_engine, hit_engine = _seed(init_engines)
+
+    def run():
+        assert url_engine.get_url('seed10').get('hash_key') == 'seed10'
+        assert url_engine.get_url('unknown') is None
+        url_id = url_engine.create_url('https://www.graysonebarb.com/new')
+        assert url_engine.create_url('https://www.graysonebarb.com/new') == url_id
+        url_engine.create_url_hash({'hash_key': 'new', 'url_id': url_id, 'date_created': datetime.now()})
+        assert hit_engine.get_statistics('seed10').get('num_clicks') == 3
+        url_engine.delete_url('seed20')
+        assert url_engine.get_deleted_url('seed20').get('is_deleted') == 1
+
+    plans = assert_no_full_scans(url_engine.CONN_STRING, run)
+    assert any('USING' in detail and 'url_hash' in detail for statement, details in plans for detail in details)
+
+
+def test_slow_query_log(init_engines):
+    url_engine, hit_engine = _seed(init_engines)
+    SLOW_QUERIES.clear()
+    # Every query is slow with a threshold of 0
+    SLOW_QUERIES.THRESHOLD = 0
+    try:
+        url_engine.get_url('seed10')
+        hit_engine.get_statistics('seed10')
+    finally:
+        SLOW_QUERIES.THRESHOLD = None
+
+    entries = SLOW_QUERIES.entries()
+    assert [e.get('caller') for e in entries] == ['UrlEngine.get_url', 'HitEngine.get_statistics']
+    assert 'FROM url_hash' in entries[0].get('sql')
+    # Inline values are logged too, with those passed to `execute`
+    assert entries[0].get('params') == {'b_hash_key': 'seed10', 'is_deleted_1': 0}
+    assert entries[0].get('duration') >= 0
+    assert entries[0].get('database') == url_engine.CONN_STRING
+
+    # Nothing is timed while it's off
+    url_engine.get_url('seed20')
+    assert len(SLOW_QUERIES.entries()) == 2
+    SLOW_QUERIES.clear()
@@ -0,0 +1,86 @@
+import time
+import web.controller.rate_limit
+from core.limiter import MemoryBuckets, RateLimiter, SqliteBuckets
+
+
+def test_memory_buckets():
+    buckets = MemoryBuckets(max_keys=2)
+    assert [buckets.take('a', rate=100, burst=3)[0] for _ in range(4)] == [True, True, True, False]
+    assert buckets.take('a', rate=100, burst=3) == (False, 1)
+    # Other keys have their own bucket, and refill over time
+    assert buckets.take('b', rate=100, burst=3)[0]
+    time.sleep(0.02)
+    assert buckets.take('a', rate=100, burst=3)[0]
+
+    # The least recently used bucket is dropped beyond `max_keys`
+    buckets.take('c', rate=1, burst=1)
+    assert list(buckets.BUCKETS) == ['a', 'c']
+
+
+def test_sqlite_buckets_shared(tmp_path):
+    # Two workers using the same database draw from the same buckets
+    first = SqliteBuckets(conn_string=f"sqlite:///{tmp_path}/limit.db")
+    second = SqliteBuckets(conn_string=f"sqlite:///{tmp_path}/limit.db")
+
+    taken = [buckets.take('ip:10.0.0.1', rate=0.5, burst=4) for buckets in [first, second] * 3]
+    assert [allowed for allowed, retry_after in taken] == [True, True, True, True, False, False]
+    assert taken[-1][1] == 2
+
+
+def test_rate_limiter_rules():
+    limiter = RateLimiter(MemoryBuckets(), [
+        {'endpoint': 'redirect', 'per': 'ip', 'rate': 0.1, 'burst': 2},
+        {'endpoint': 'redirect', 'per': 'route', 'rate': 0.1, 'burst': 3}
+    ], max_concurrent=1)
+
+    assert limiter.check('redirect', '10.0.0.1') is None
+    assert limiter.check('redirect', '10.0.0.1') is None
+    assert limiter.check('redirect', '10.0.0.1') == 10
+    # Another client has its own bucket, until the one shared by the route runs out
+    assert limiter.check('redirect', '10.0.0.2') is None
+    assert limiter.check('redirect', '10.0.0.3') is not None
+    assert limiter.check('index', '10.0.0.1') is None
+
+    assert limiter.enter()
+    assert not limiter.enter()
+    limiter.exit()
+    assert limiter.enter()
+
+
+def test_rate_limited_requests(test_client, monkeypatch):
+    monkeypatch.setattr(web.controller.rate_limit, 'LIMITER', RateLimiter(MemoryBuckets(), [
+        {'endpoint': 'redirect', 'per': 'ip', 'rate': 0.5, 'burst': 1}
+    ], max_concurrent=2))
+    monkeypatch.setitem(test_client.application.config, 'RATE_LIMIT_ENABLED', True)
+
+    assert test_client.get('/never-created-limited').status_code == 404
+    response = test_client.get('/never-created-limited')
+    assert response.status_code == 429
+    assert response.headers.get('Retry-After') == '2'
+    assert test_client.get('/').status_code == 200
+
+    # Once every slot is taken requests are shed straight away, except for the metrics
+    limiter = web.controller.rate_limit.LIMITER
+    assert limiter.enter() and limiter.enter()
+    try:
+        response = test_client.get('/')
+        assert response.status_code == 503
+        assert response.headers.get('Retry-After') == '1'
+        assert test_client.get('/metrics').status_code == 200
+    finally:
+        limiter.exit()
+        limiter.exit()
+    assert test_client.get('/').status_code == 200
+
+
+def test_rejected_requests_keep_tokens(tmp_path):
+    for buckets in [MemoryBuckets(), SqliteBuckets(conn_string=f"sqlite:///{tmp_path}/refund.db")]:
+        limiter = RateLimiter(buckets, [
+            {'endpoint': 'redirect', 'per': 'ip', 'rate': 0.01, 'burst': 3},
+            {'endpoint': '*', 'per': 'route', 'rate': 0.01, 'burst': 1}
+        ])
+
+        assert limiter.check('redirect', '10.0.0.1') is None
+        # Turned away by the shared bucket, without draining the client's own
+        assert all(limiter.check('redirect', '10.0.0.1') is not None for _ in range(5))
+        assert [buckets.take('redirect:10.0.0.1', rate=0.01, burst=3)[0] for _ in range(3)] == [True, True, False]
@@ -0,0 +1,53 @@
+import sqlite3
+from core.db import RECENT_WRITES, pin, unpin
+
+
+def _replicate(tmp_path):
+    # Stand-in for replication, copies the primary over the read database
+    src = sqlite3.connect(tmp_path / 'primary.db')
+    dst = sqlite3.connect(tmp_path / 'replica.db')
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def test_reads_routed_to_replica(tmp_path, init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('primary', read_conn_string=f"sqlite:///{tmp_path}/replica.db",
+                                          url_cache_size=0)
+    _replicate(tmp_path)
+    create_url_hashes(url_engine, ['routed'])
+
+    # Another request, after the key's read-your-writes window
+    unpin()
+    RECENT_WRITES.clear()
+    assert url_engine.get_url('routed') is None
+    assert hit_engine.get_statistics('routed') is None
+
+    _replicate(tmp_path)
+    assert url_engine.get_url('routed').get('hash_key') == 'routed'
+    assert hit_engine.get_statistics('routed').get('num_clicks') == 0
+
+
+def test_read_your_writes(tmp_path, init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('primary', read_conn_string=f"sqlite:///{tmp_path}/replica.db",
+                                          url_cache_size=0)
+    _replicate(tmp_path)
+
+    # The request that created the link reads it back from the primary
+    unpin()
+    create_url_hashes(url_engine, ['pinned'])
+    assert url_engine.get_url('pinned').get('hash_key') == 'pinned'
+
+    # As do other requests reading that link, while everything else stays on the replica
+    unpin()
+    assert url_engine.get_url('pinned').get('hash_key') == 'pinned'
+    assert hit_engine.get_statistics('pinned').get('hash_key') == 'pinned'
+
+    _replicate(tmp_path)
+    url_engine.delete_url('pinned')
+    unpin()
+    RECENT_WRITES.clear()
+    assert url_engine.get_url('pinned').get('is_deleted') == 0
+    pin()
+    assert url_engine.get_url('pinned') is None
+    unpin()
@@ -0,0 +1,84 @@
+from datetime import datetime
+import time
+from sqlalchemy.exc import OperationalError
+from core.engine import HitRecorder
+
+
+def _count_hits(engine):
+    return engine.count_hits()
+
+
+def test_recorder_flush(init_engines):
+    _, engine = init_engines('recorder')
+    recorder = HitRecorder(engine, batch_size=10, flush_interval=60).start()
+
+    for _ in range(25):
+        recorder.record({'url_hash_id': 1, 'date_created': datetime.now()})
+    recorder.flush()
+
+    assert _count_hits(engine) == 25
+    assert recorder.stats().get('queue_depth') == 0
+    assert recorder.stats().get('written') == 25
+
+    recorder.close()
+
+
+def test_recorder_backpressure(init_engines):
+    _, engine = init_engines('recorder')
+    # Without a worker the queue fills up and further hits are written through
+    recorder = HitRecorder(engine, max_queue=2, put_timeout=0)
+
+    for _ in range(5):
+        recorder.record({'url_hash_id': 1, 'date_created': datetime.now()})
+
+    assert recorder.stats().get('write_throughs') == 3
+    assert _count_hits(engine) == 3
+
+    # Nothing queued is lost on shutdown
+    recorder.close()
+    assert _count_hits(engine) == 5
+
+
+class _LockedEngine:
+    # Fails like a contended SQLite database for the first `failures` writes
+    def __init__(self, engine, failures):
+        self.ENGINE = engine
+        self.FAILURES = failures
+
+    def create_hits(self, hits):
+        if self.FAILURES > 0:
+            self.FAILURES -= 1
+            raise OperationalError('INSERT INTO hit', {}, Exception('database is locked'))
+        self.ENGINE.create_hits(hits)
+
+
+def test_recorder_retry(init_engines):
+    _, engine = init_engines('recorder')
+
+    recorder = HitRecorder(_LockedEngine(engine, 2), retry_backoff=0)
+    recorder.record({'url_hash_id': 1, 'date_created': datetime.now()})
+    recorder.flush()
+    assert _count_hits(engine) == 1
+    assert recorder.stats().get('retries') == 2
+    assert recorder.stats().get('dropped') == 0
+
+    # Only dropped once the retries are exhausted
+    recorder = HitRecorder(_LockedEngine(engine, 10), max_retries=3, retry_backoff=0)
+    recorder.record({'url_hash_id': 1, 'date_created': datetime.now()})
+    recorder.flush()
+    assert _count_hits(engine) == 1
+    assert recorder.stats().get('dropped') == 1
+
+
+def test_read_max_lag(init_engines):
+    _, engine = init_engines('lag', hit_buffer_enabled=True, hit_buffer_flush_interval=60, hit_read_max_lag=0.05)
+
+    engine.record_hit({'url_hash_id': 1, 'date_created': datetime.now()})
+    assert engine.RECORDER.lag() > 0
+
+    # A fresh hit isn't worth a flush on the read path, one older than the bound is
+    assert engine.get_clicks(1, datetime(2000, 1, 1), datetime.now()) == []
+    time.sleep(0.06)
+    assert sum(c.get('num_clicks') for c in engine.get_clicks(1, datetime(2000, 1, 1), datetime.now())) == 1
+    assert engine.RECORDER.lag() == 0
+    engine.RECORDER.close()
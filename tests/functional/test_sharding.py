@@ -0,0 +1,77 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import func, select
+from core.db import Database
+from core.engine import HashKeyConflict, UrlEngine
+
+
+def _shard_strings(tmp_path, num_shards):
+    return [f"sqlite:///{tmp_path}/shard_{i}.db" for i in range(num_shards)]
+
+
+def _count_url_hashes(shard):
+    with Database(conn_string=shard) as db:
+        return db.scalar(select(func.count()).select_from(UrlEngine().SCHEMA.url_hash))
+
+
+def test_keys_spread_over_shards(tmp_path, init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('primary', shards=_shard_strings(tmp_path, 3), url_cache_size=0)
+    hash_keys = [f"spread{i}" for i in range(60)]
+    create_url_hashes(url_engine, hash_keys)
+
+    counts = [_count_url_hashes(shard) for shard in url_engine.SHARDS.SHARDS]
+    assert sum(counts) == 60
+    assert all(count > 0 for count in counts)
+
+    for hash_key in hash_keys:
+        url = url_engine.get_url(hash_key)
+        assert url.get('url') == 'https://www.graysonebarb.com'
+        # Hits are routed by the id, which encodes the shard of its Short URL
+        assert url_engine._shard_of_id(url.get('id')) == url_engine._shard_for(hash_key)
+
+        hit_engine.create_hit({'url_hash_id': url.get('id'), 'ip_address': '127.0.0.1', 'user_agent': 'curl',
+                               'date_created': datetime.now()})
+        assert hit_engine.get_statistics(hash_key).get('num_clicks') == 1
+
+    assert hit_engine.count_hits() == 60
+    assert hit_engine.check_counters() == []
+    url = url_engine.get_url('spread0')
+    assert hit_engine.get_top_user_agents(url.get('id'), datetime.now(), datetime.now())[0].get('user_agent') == 'curl'
+
+
+def test_rebalance_after_adding_a_shard(tmp_path, init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('primary', shards=_shard_strings(tmp_path, 2), url_cache_size=0)
+    hash_keys = [f"moved{i}" for i in range(40)]
+    create_url_hashes(url_engine, hash_keys)
+    for hash_key in hash_keys:
+        url = url_engine.get_url(hash_key)
+        hit_engine.create_hits([{'url_hash_id': url.get('id'), 'ip_address': '10.0.0.1', 'user_agent': 'curl',
+                                 'date_created': datetime.now()}] * 2)
+
+    previous = url_engine.SHARDS.SHARDS
+    url_engine, hit_engine = init_engines('primary', shards=_shard_strings(tmp_path, 3), shards_previous=previous,
+                                          url_cache_size=0)
+    moving = [hash_key for hash_key in hash_keys if url_engine._shard_for(hash_key) not in previous]
+    assert moving
+
+    # Until the rebalance, keys are still found (and taken) on the shard that owned them before
+    assert url_engine.get_url(moving[0]).get('hash_key') == moving[0]
+    assert hit_engine.get_statistics(moving[0]).get('num_clicks') == 2
+    with pytest.raises(HashKeyConflict):
+        create_url_hashes(url_engine, [moving[0]], 'https://www.graysonebarb.com/other')
+
+    result = url_engine.rebalance_shards(hit_engine.move_hits)
+    assert result == {'moved': len(moving), 'conflicts': []}
+    assert _count_url_hashes(url_engine.SHARDS.SHARDS[2]) == len(moving)
+
+    url_engine, hit_engine = init_engines('primary', shards=_shard_strings(tmp_path, 3), url_cache_size=0)
+    for hash_key in hash_keys:
+        url = url_engine.get_url(hash_key)
+        assert url_engine._shard_of_id(url.get('id')) == url_engine._shard_for(hash_key)
+        assert hit_engine.get_statistics(hash_key).get('num_clicks') == 2
+        assert len(hit_engine.get_hits(url.get('id'), datetime(2000, 1, 1), datetime.now())) == 2
+    assert hit_engine.count_hits() == 80
+    assert hit_engine.check_counters() == []
+
+    # Running it again has nothing left to move
+    assert url_engine.rebalance_shards(hit_engine.move_hits) == {'moved': 0, 'conflicts': []}
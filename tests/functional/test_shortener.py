@@ -118,4 +118,88 @@ def test_deleted_statistics(test_client):
     assert b'This Short URL was deleted' in response.data
 
 
+def test_statistics_clicks(test_client):
+    response = test_client.get(f"/stats/{pytest.first_url}/clicks?bucket=hour")
 
+    assert response.status_code == 200
+    assert sum(c.get('num_clicks') for c in response.get_json().get('clicks')) > 0
+
+    response = test_client.get(f"/stats/{pytest.first_url}/clicks?start=invalid")
+
+    assert response.status_code == 400
+
+    response = test_client.get(f"/stats/{pytest.first_url}/clicks?start=2024-11-08&end=2024-11-07")
+
+    assert response.status_code == 400
+
+    response = test_client.get(f"/stats/{pytest.first_url}/clicks?bucket=week")
+
+    assert response.status_code == 400
+
+
+def test_statistics_top(test_client):
+    response = test_client.get(f"/stats/{pytest.first_url}/agents?limit=1")
+
+    assert response.status_code == 200
+    assert len(response.get_json().get('user_agents')) == 1
+
+    response = test_client.get(f"/stats/{pytest.first_url}/agents?limit=-1")
+
+    assert response.status_code == 200
+    assert len(response.get_json().get('user_agents')) == 1
+
+    response = test_client.get(f"/stats/{pytest.first_url}/ips")
+
+    assert response.status_code == 200
+    assert response.get_json().get('ip_addresses')[0].get('num_clicks') > 0
+
+
+def test_create_batch_urls(test_client):
+    response = test_client.post('/url/batch', json=[
+        'https://www.graysonebarb.com/batch',
+        {'dest_url': 'https://www.graysonebarb.com/batch'},
+        {'dest_url': 'https://www.google.com', 'src_url': pytest.dupe_hash},
+        {'src_url': 'missing'},
+        {'dest_url': 123},
+        {'dest_url': 'https://www.google.com', 'src_url': 5}
+    ])
+    results = response.get_json().get('results')
+
+    assert response.status_code == 200
+    assert [r.get('success') for r in results] == [True, True, False, False, False, False]
+    assert [r.get('error') for r in results[4:]] == ['Invalid batch item.'] * 2
+    assert results[0].get('url') != results[1].get('url')
+    assert results[2].get('error') == 'CONFLICT! Short URL already exists.'
+
+    response = test_client.get(results[0].get('url').replace(test_client.application.config.get('BASE_DOMAIN'), ''))
+
+    assert response.status_code == 302
+    assert response.headers.get('Location') == 'https://www.graysonebarb.com/batch'
+
+
+def test_create_batch_urls_ndjson(test_client):
+    response = test_client.post('/url/batch', data='"https://www.yahoo.com/ndjson"\n{"dest_url": "https://www.google.com/ndjson"}\n{invalid\n',
+                                content_type='application/x-ndjson')
+    results = response.get_json().get('results')
+
+    assert response.status_code == 200
+    assert response.get_json().get('success') is False
+    assert [r.get('success') for r in results] == [True, True, False]
+
+
+def test_server_timing(test_client):
+    # Internal timings are not exposed unless enabled
+    response = test_client.get(f"/{pytest.first_url}")
+
+    assert response.status_code == 302
+    assert response.headers.get('Server-Timing') is None
+
+    test_client.application.config.update({'SERVER_TIMING': True})
+    try:
+        response = test_client.get(f"/{pytest.first_url}")
+    finally:
+        test_client.application.config.update({'SERVER_TIMING': False})
+    layers = [entry.split(';')[0] for entry in response.headers.get('Server-Timing').split(', ')]
+
+    assert response.status_code == 302
+    assert {'factory', 'engine', 'total'} <= set(layers)
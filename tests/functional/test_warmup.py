@@ -0,0 +1,46 @@
+from datetime import date, datetime
+from sqlalchemy import inspect
+from core.db import Database
+from core.engine import warm_up
+from core.engine.base import STATEMENTS
+from core.engine.hit import month_start
+
+
+def test_warm_up(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('warm', hash_key_filter_enabled=True)
+
+    for clicks, url_hash_id in enumerate(create_url_hashes(url_engine, ['cold', 'warm', 'hot'])):
+        hit_engine.create_hits([{'url_hash_id': url_hash_id, 'user_agent': f"agent{clicks}",
+                                 'date_created': datetime.now()}] * (clicks + 1))
+    url_engine.CACHE.clear()
+    hit_engine.USER_AGENTS.clear()
+
+    report = warm_up(top_n=2, conn_string=url_engine.CONN_STRING, hash_key_filter_enabled=True)
+    assert report.get('urls') == 2
+    assert report.get('user_agents') == 2
+    assert report.get('key_filter').get('keys') == 3
+    assert report.get('seconds') >= sum(report.get('timings').values())
+    assert {'url.get_url', 'url.upsert', 'url_hash.insert', 'hit.get_statistics', 'user_agent.insert'} <= set(STATEMENTS)
+
+    # The hottest links and user agents are served from the caches
+    assert url_engine.CACHE.get('hot')[1].get('url') == 'https://www.graysonebarb.com'
+    assert url_engine.CACHE.get('warm')[0]
+    assert not url_engine.CACHE.get('cold')[0]
+    assert hit_engine.USER_AGENTS.get('agent2')[0]
+    assert not hit_engine.USER_AGENTS.get('agent0')[0]
+
+    with Database(conn_string=url_engine.CONN_STRING) as db:
+        assert inspect(db.CURSOR).has_table(hit_engine.SCHEMA.hit_month(month_start(date.today())).name)
+
+
+def test_warm_up_skips_deleted(init_engines, create_url_hashes):
+    url_engine, hit_engine = init_engines('deleted')
+
+    url_hash_id, = create_url_hashes(url_engine, ['gone'])
+    hit_engine.create_hits([{'url_hash_id': url_hash_id, 'user_agent': 'agent', 'date_created': datetime.now()}] * 3)
+    url_engine.delete_url('gone')
+    url_engine.CACHE.clear()
+
+    # A deleted Short URL, however hot, is never cached as live
+    assert url_engine.warm_up(10) == 0
+    assert url_engine.get_url('gone') is None
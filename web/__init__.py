@@ -1,10 +1,26 @@
 import json
 from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 app.config.from_file("config.json", load=json.load)
 
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Behind `TRUSTED_PROXIES` reverse proxies, the client address (and scheme) come from their `X-Forwarded-*` headers
+if app.config.get('TRUSTED_PROXIES'):
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=app.config.get('TRUSTED_PROXIES'), x_proto=app.config.get('TRUSTED_PROXIES'))
+
 from web.controller import *
+
+# Preload the caches before serving, so the first requests after a deploy don't all go to the database. A database
+# that can't be warmed up (ie: before `setup.py` created it) is left to the first requests.
+if app.config.get('WARM_UP_TOP_N'):
+    from core.engine import warm_up
+    try:
+        app.extensions['warm_up'] = warm_up(app=app, top_n=app.config.get('WARM_UP_TOP_N'))
+        app.logger.info(f"Warmed up in {app.extensions['warm_up'].get('seconds'):.2f}s.")
+    except Exception as e:
+        app.logger.warning(f"Warm-up failed, starting cold: {e}")
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from urllib.parse import unquote
+from flask import Response
+from core import timing
+from core.db import ASYNC_REGISTRY
+from core.engine import RECORDERS
+from core.factory import AsyncHitFactory
+from core.metrics import CONTENT_TYPE, METRICS
+from web import app
+
+
+# Created once at startup and shared by every connection, factories and engines hold no per-request state
+FACTORY = AsyncHitFactory(app)
+
+
+async def application(scope, receive, send):
+    # Minimal ASGI application serving the read-heavy routes of the Flask application (see `start_async.py`)
+    match scope.get('type'):
+        case 'lifespan':
+            await _lifespan(receive, send)
+        case 'http':
+            await _send(send, await _dispatch(scope), scope.get('method') == 'HEAD')
+        case _:
+            raise Exception(f"Unsupported ASGI scope type '{scope.get('type')}'.")
+
+
+async def _dispatch(scope):
+    if scope.get('method') not in ('GET', 'HEAD'):
+        return Response('Method Not Allowed', status=405, headers={'Allow': 'GET, HEAD'})
+
+    if app.config.get('SERVER_TIMING', False):
+        timing.start()
+    start = time.perf_counter()
+
+    # Routes are labelled like the Flask rules they mirror
+    parts = [unquote(part) for part in scope.get('path', '/').strip('/').split('/')]
+    match parts:
+        case ['']:
+            route = '/'
+            response = Response('Hello, Tiny URL!')
+        case ['metrics'] if METRICS.ENABLED:
+            route = '/metrics'
+            response = Response(METRICS.render(), mimetype=CONTENT_TYPE)
+        case [hash_key]:
+            route = '/<string:hash_key>'
+            headers = dict(scope.get('headers') or [])
+            client = scope.get('client') or (None, None)
+            response = await FACTORY.handle_redirect(
+                hash_key, client[0], headers.get(b'user-agent', b'').decode('latin-1') or None)
+        case ['url', hash_key]:
+            route = '/url/<string:hash_key>'
+            response = await FACTORY.handle_get_long_url(hash_key)
+        case ['stats', hash_key]:
+            route = '/stats/<string:hash_key>'
+            response = await FACTORY.handle_statistics(hash_key)
+        case _:
+            route = 'unmatched'
+            response = Response('Not Found', status=404)
+
+    # 304 for a cached JSON response that is still current
+    headers = dict(scope.get('headers') or [])
+    response.make_conditional({
+        'REQUEST_METHOD': scope.get('method'),
+        'HTTP_IF_NONE_MATCH': headers.get(b'if-none-match', b'').decode('latin-1'),
+        'HTTP_IF_MODIFIED_SINCE': headers.get(b'if-modified-since', b'').decode('latin-1')
+    })
+
+    labels = (('method', scope.get('method')), ('route', route))
+    METRICS.observe('turl_http_request_duration_seconds', time.perf_counter() - start, labels)
+    METRICS.inc('turl_http_requests_total', labels + (('status', str(response.status_code)),))
+
+    timings = timing.stop()
+    if timings:
+        entries = [f"{layer};dur={t.get('duration') * 1000:.2f}" for layer, t in timings.as_dict().items()]
+        entries.append(f"total;dur={timings.elapsed() * 1000:.2f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+async def _send(send, response, is_head=False):
+    # Like werkzeug's `get_app_iter`, a 304 has no body
+    body = b'' if is_head or response.status_code == 304 else response.get_data()
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        match message.get('type'):
+            case 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            case 'lifespan.shutdown':
+                # Write any buffered hits before the engines go away
+                await asyncio.to_thread(RECORDERS.close)
+                await ASYNC_REGISTRY.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -1,3 +1,7 @@
 from .hit import *
 from .index import *
+from .metrics import *
+from .rate_limit import *
+from .read_routing import *
+from .server_timing import *
 from .url import *
\ No newline at end of file
@@ -2,14 +2,29 @@ from core.factory import HitFactory
 from web import app
 
 
-def _init_factory():
-    return HitFactory(app)
+# Created once at startup and shared by every request thread, factories and engines hold no per-request state
+FACTORY = HitFactory(app)
 
 
 @app.get('/<string:hash_key>')
 def redirect(hash_key):
-    return _init_factory().handle_redirect(hash_key)
+    return FACTORY.handle_redirect(hash_key)
 
 @app.get('/stats/<string:hash_key>')
 def stats(hash_key):
-    return _init_factory().handle_statistics(hash_key)
\ No newline at end of file
+    return FACTORY.handle_statistics(hash_key)
+
+
+@app.get('/stats/<string:hash_key>/clicks')
+def stats_clicks(hash_key):
+    return FACTORY.handle_clicks(hash_key)
+
+
+@app.get('/stats/<string:hash_key>/agents')
+def stats_user_agents(hash_key):
+    return FACTORY.handle_top_user_agents(hash_key)
+
+
+@app.get('/stats/<string:hash_key>/ips')
+def stats_ip_addresses(hash_key):
+    return FACTORY.handle_top_ip_addresses(hash_key)
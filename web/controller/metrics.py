@@ -0,0 +1,77 @@
+import time
+from flask import g, request, Response
+from sqlalchemy.engine import make_url
+from core.cache import CACHES, FILTERS
+from core.db import Database
+from core.engine import RECORDERS
+from core.metrics import CONTENT_TYPE, METRICS
+from web import app
+
+
+METRICS.ENABLED = app.config.get('METRICS_ENABLED', True)
+
+
+def _database(name):
+    # Pools and caches are named after their connection string, which may hold a password
+    conn_string, _, suffix = name.partition('#')
+    try:
+        conn_string = make_url(conn_string).render_as_string(hide_password=True)
+    except Exception:
+        pass
+    return f"{conn_string}#{suffix}" if suffix else conn_string
+
+
+def _collect():
+    # The statistics already kept by the pools, caches, filters and hit buffers
+    pools = Database.pool_stats()
+    caches = CACHES.stats()
+    filters = {name: stats for name, stats in FILTERS.stats().items() if stats.get('ready')}
+    recorders = RECORDERS.stats()
+
+    return [
+        ('turl_db_pool_checked_out', 'gauge', 'Connections currently checked out, by engine.',
+         [((('engine', _database(name)),), s.get('checked_out')) for name, s in pools.items()]),
+        ('turl_db_pool_timeouts_total', 'counter', 'Connection checkouts that timed out, by engine.',
+         [((('engine', _database(name)),), s.get('timeouts')) for name, s in pools.items()]),
+        ('turl_cache_hits_total', 'counter', 'In-process cache hits, by cache.',
+         [((('cache', _database(name)),), s.get('hits')) for name, s in caches.items()]),
+        ('turl_cache_misses_total', 'counter', 'In-process cache misses, by cache.',
+         [((('cache', _database(name)),), s.get('misses')) for name, s in caches.items()]),
+        ('turl_cache_size', 'gauge', 'In-process cache entries, by cache.',
+         [((('cache', _database(name)),), s.get('size')) for name, s in caches.items()]),
+        ('turl_key_filter_negatives_total', 'counter', 'Lookups answered by the hash_key filter without a query.',
+         [((('database', _database(name)),), s.get('negatives')) for name, s in filters.items()]),
+        ('turl_hit_buffer_queue_depth', 'gauge', 'Hits waiting to be written, by database.',
+         [((('database', _database(name)),), s.get('queue_depth')) for name, s in recorders.items()]),
+        ('turl_hit_buffer_lag_seconds', 'gauge', 'Age of the oldest hit waiting to be written, by database.',
+         [((('database', _database(name)),), s.get('lag')) for name, s in recorders.items()]),
+        ('turl_hit_buffer_dropped_total', 'counter', 'Hits dropped after their batch failed, by database.',
+         [((('database', _database(name)),), s.get('dropped')) for name, s in recorders.items()])
+    ]
+
+
+METRICS.collect(_collect)
+
+
+@app.before_request
+def start_metrics():
+    g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def record_metrics(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        # Labelled by the matched rule (ie: `/<string:hash_key>`) rather than the path, to keep the series bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+        METRICS.observe('turl_http_request_duration_seconds', time.perf_counter() - start, labels)
+        METRICS.inc('turl_http_requests_total', labels + (('status', str(response.status_code)),))
+    return response
+
+
+@app.get('/metrics')
+def metrics():
+    if not METRICS.ENABLED:
+        return Response('Metrics are disabled.', status=404)
+    return Response(METRICS.render(), mimetype=CONTENT_TYPE)
@@ -0,0 +1,43 @@
+from flask import request, Response
+from core.limiter import RateLimiter, get_buckets
+from core.metrics import METRICS
+from web import app
+
+
+def _buckets():
+    # The `sqlite` backend's database is only created once rate limiting is enabled
+    if not app.config.get('RATE_LIMIT_ENABLED', False):
+        return get_buckets('memory')
+    return get_buckets(
+        app.config.get('RATE_LIMIT_BACKEND', 'memory'), conn_string=app.config.get('RATE_LIMIT_SQLITE_URI'))
+
+
+# Shared by every request thread, with the `sqlite` backend by every worker as well
+LIMITER = RateLimiter(_buckets(), app.config.get('RATE_LIMITS'), app.config.get('MAX_CONCURRENT_REQUESTS'))
+# Still served while shedding load, so the shedding can be observed
+EXEMPT = {'metrics'}
+
+
+@app.before_request
+def limit_request():
+    if not app.config.get('RATE_LIMIT_ENABLED', False) or request.endpoint in EXEMPT:
+        return None
+
+    # Rejected quickly rather than queued behind the requests already in progress
+    if not LIMITER.enter():
+        METRICS.inc('turl_requests_shed_total')
+        return Response('The service is busy, please retry shortly.', status=503, headers={'Retry-After': '1'})
+    # On the request rather than `g`, which may be gone by teardown (ie: with a test client preserving the context)
+    request.environ['turl.limiter_slot'] = True
+
+    retry_after = LIMITER.check(request.endpoint, request.remote_addr)
+    if retry_after is not None:
+        METRICS.inc('turl_requests_limited_total', (('endpoint', request.endpoint or 'unmatched'),))
+        return Response('Too many requests, please retry later.', status=429, headers={'Retry-After': str(retry_after)})
+    return None
+
+
+@app.teardown_request
+def release_request(error=None):
+    if request.environ.pop('turl.limiter_slot', False):
+        LIMITER.exit()
@@ -0,0 +1,8 @@
+from core.db import unpin
+from web import app
+
+
+@app.before_request
+def reset_read_routing():
+    # Worker threads are reused, so a previous request's writes must not keep this one's reads on the primary
+    unpin()
@@ -0,0 +1,19 @@
+from core import timing
+from web import app
+
+
+@app.before_request
+def start_timing():
+    if app.config.get('SERVER_TIMING', False):
+        timing.start()
+
+
+@app.after_request
+def report_timing(response):
+    timings = timing.stop()
+    if timings:
+        # ie: `Server-Timing: factory;dur=1.52, engine;dur=1.31, db;dur=0.84, pool;dur=0.05, total;dur=1.71`
+        entries = [f"{layer};dur={t.get('duration') * 1000:.2f}" for layer, t in timings.as_dict().items()]
+        entries.append(f"total;dur={timings.elapsed() * 1000:.2f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
@@ -2,22 +2,26 @@ from core.factory import UrlFactory
 from web import app
 
 
-def _init_factory():
-    return UrlFactory(app)
+# Created once at startup and shared by every request thread, factories and engines hold no per-request state
+FACTORY = UrlFactory(app)
 
 
 @app.get('/url/<string:hash_key>')
 def get_long_url(hash_key):
-    return _init_factory().handle_get_long_url(hash_key)
+    return FACTORY.handle_get_long_url(hash_key)
 
 
 @app.post('/url')
 @app.post('/url/create')
 def create_short_url():
-    return _init_factory().handle_create_short_url()
+    return FACTORY.handle_create_short_url()
 
 
+@app.post('/url/batch')
+def create_short_urls():
+    return FACTORY.handle_create_short_urls()
+
 
 @app.delete('/url/<string:hash_key>')
 def delete_short_url(hash_key):
-    return _init_factory().handle_delete_short_url(hash_key)
+    return FACTORY.handle_delete_short_url(hash_key)